@@ -1,2 +1,179 @@
-import cv2
+import importlib
+import json
+import numpy as np
+import os
+from stereo_vision.projection import ProjectionMatrix, StereoVisionSystem
 
+format_version = 2  # Version 2 encodes the metadata, which can hold numpy arrays and tuples
+magic = b"SVCALIB\0"
+array_alignment = 64
+# (module, class qualified name) of the distortion models that a bundle can rebuild
+allowed_distortion_model_classes = {('camera_distortion_calibration.radial_distortion', 'RadialDistortion')}
+
+def SaveCalibrationBundle(filepath, projection_matrices_list, distortion_models_list=None, camera_names=None, metadata=None):
+    """
+    Writes the calibration of all the cameras of a stereo system in a single file:
+        magic: b"SVCALIB\0"
+        header length: uint64, little-endian
+        header: JSON (format version, camera names, metadata, and for each camera, the projection matrix and the
+                distortion model description)
+        arrays: the projection matrices and the array attributes of the distortion models, each one aligned on
+                array_alignment bytes, at the offset given in the header
+    A distortion model is stored as its module, its class name and its attributes (numbers, strings, tuples, lists,
+    dictionaries and numpy arrays), so it is rebuilt without pickle. The metadata is encoded like the model attributes.
+    """
+    if distortion_models_list is not None and len(distortion_models_list) != len(projection_matrices_list):
+        raise ValueError(f"SaveCalibrationBundle(): len(distortion_models_list) ({len(distortion_models_list)}) != len(projection_matrices_list) ({len(projection_matrices_list)})")
+    if camera_names is None:
+        camera_names = ['camera_' + str(camera_ndx + 1) for camera_ndx in range(len(projection_matrices_list))]
+    if len(camera_names) != len(projection_matrices_list):
+        raise ValueError(f"SaveCalibrationBundle(): len(camera_names) ({len(camera_names)}) != len(projection_matrices_list) ({len(projection_matrices_list)})")
+    arrays = []
+    cameras = []
+    for camera_ndx in range(len(projection_matrices_list)):
+        camera = {'projection_matrix': _EncodeValue(np.asarray(projection_matrices_list[camera_ndx].matrix, dtype=np.float64), arrays),
+                  'depth_sign': getattr(projection_matrices_list[camera_ndx], 'depth_sign', None), 'distortion_model': None}
+        if distortion_models_list is not None and distortion_models_list[camera_ndx] is not None:
+            distortion_model = distortion_models_list[camera_ndx]
+            camera['distortion_model'] = {'module': type(distortion_model).__module__,
+                                          'class': type(distortion_model).__qualname__,
+                                          'attributes': {name: _EncodeValue(value, arrays) for name, value in vars(distortion_model).items()}}
+        cameras.append(camera)
+    header = {'format_version': format_version, 'camera_names': list(camera_names),
+              'metadata': _EncodeValue(metadata if metadata is not None else {}, arrays), 'cameras': cameras, 'arrays': []}
+
+    # The array offsets depend on the header length, and the header holds the offsets: the header is padded to a
+    # multiple of array_alignment, and re-encoded until its padded length is stable
+    header_nbytes = 0
+    while True:
+        offset = _AlignedOffset(len(magic) + 8 + header_nbytes)
+        header['arrays'] = []
+        for array in arrays:
+            header['arrays'].append({'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)})
+            offset = _AlignedOffset(offset + array.nbytes)
+        header_bytes = json.dumps(header, indent=1).encode('utf-8')
+        if _AlignedOffset(len(magic) + 8 + len(header_bytes)) == _AlignedOffset(len(magic) + 8 + header_nbytes):
+            break
+        header_nbytes = len(header_bytes)
+    header_bytes += b" " * (_AlignedOffset(len(magic) + 8 + len(header_bytes)) - len(magic) - 8 - len(header_bytes))
+
+    temporary_filepath = filepath + ".tmp"
+    with open(temporary_filepath, 'wb') as bundle_file:
+        bundle_file.write(magic)
+        bundle_file.write(np.uint64(len(header_bytes)).astype('<u8').tobytes())
+        bundle_file.write(header_bytes)
+        for array, array_description in zip(arrays, header['arrays']):
+            bundle_file.write(b"\0" * (array_description['offset'] - bundle_file.tell()))
+            bundle_file.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temporary_filepath, filepath)
+
+class CalibrationBundle():
+    """
+    Reader of the files written by SaveCalibrationBundle(). The arrays are memory-mapped on first access, and the module
+    of a distortion model is only imported when the model is requested. Only the allowed classes can be rebuilt, so
+    that a bundle can't import arbitrary modules.
+    """
+    def __init__(self, filepath, allowed_model_classes=None):
+        # allowed_model_classes: The (module, class qualified name) of the distortion models that can be rebuilt, in
+        # addition to allowed_distortion_model_classes
+        self.filepath = filepath
+        self.allowed_model_classes = set(allowed_distortion_model_classes)
+        if allowed_model_classes is not None:
+            self.allowed_model_classes.update(tuple(allowed_model_class) for allowed_model_class in allowed_model_classes)
+        with open(filepath, 'rb') as bundle_file:
+            file_magic = bundle_file.read(len(magic))
+            if file_magic != magic:
+                raise ValueError(f"CalibrationBundle.__init__(): '{filepath}' is not a calibration bundle (magic {file_magic})")
+            header_nbytes = int(np.frombuffer(bundle_file.read(8), dtype='<u8')[0])
+            self.header = json.loads(bundle_file.read(header_nbytes).decode('utf-8'))
+        if self.header['format_version'] > format_version:
+            raise ValueError(f"CalibrationBundle.__init__(): The format version of '{filepath}' ({self.header['format_version']}) > {format_version}")
+        self.camera_names = self.header['camera_names']
+        self.arrays = [None] * len(self.header['arrays'])
+        # The version 1 metadata is plain JSON
+        self.metadata = self._DecodeValue(self.header['metadata']) if self.header['format_version'] >= 2 else self.header['metadata']
+        self.distortion_models = [None] * len(self.camera_names)
+
+    def __len__(self):
+        return len(self.camera_names)
+
+    def CameraIndex(self, camera_name):
+        if not camera_name in self.camera_names:
+            raise ValueError(f"CalibrationBundle.CameraIndex(): Camera '{camera_name}' is not in {self.camera_names}")
+        return self.camera_names.index(camera_name)
+
+    def ProjectionMatrix(self, camera_ndx):
+        projection_matrix = ProjectionMatrix()
+        # A copy, since the memory-mapped array is read-only
+        projection_matrix.matrix = np.array(self._DecodeValue(self.header['cameras'][camera_ndx]['projection_matrix']))
+        projection_matrix.depth_sign = self.header['cameras'][camera_ndx].get('depth_sign')  # Absent from the older bundles
+        return projection_matrix
+
+    def ProjectionMatrices(self):
+        return [self.ProjectionMatrix(camera_ndx) for camera_ndx in range(len(self))]
+
+    def DistortionModel(self, camera_ndx):
+        # Rebuilt on the first call, without calling the class constructor. Returns None if the camera has no model
+        description = self.header['cameras'][camera_ndx]['distortion_model']
+        if description is None:
+            return None
+        if self.distortion_models[camera_ndx] is None:
+            if not (description['module'], description['class']) in self.allowed_model_classes:
+                raise ValueError(f"CalibrationBundle.DistortionModel(): The distortion model class '{description['module']}.{description['class']}' is not allowed. The allowed classes are {sorted(self.allowed_model_classes)}")
+            model_class = importlib.import_module(description['module'])
+            for name in description['class'].split('.'):
+                model_class = getattr(model_class, name)
+            distortion_model = model_class.__new__(model_class)
+            for name, value in description['attributes'].items():
+                setattr(distortion_model, name, self._DecodeValue(value))
+            self.distortion_models[camera_ndx] = distortion_model
+        return self.distortion_models[camera_ndx]
+
+    def DistortionModels(self):
+        return [self.DistortionModel(camera_ndx) for camera_ndx in range(len(self))]
+
+    def StereoVisionSystem(self):
+        return StereoVisionSystem(self.ProjectionMatrices())
+
+    def _Array(self, array_ndx):
+        if self.arrays[array_ndx] is None:
+            array_description = self.header['arrays'][array_ndx]
+            self.arrays[array_ndx] = np.memmap(self.filepath, dtype=np.dtype(array_description['dtype']), mode='r',
+                                               offset=array_description['offset'], shape=tuple(array_description['shape']))
+        return self.arrays[array_ndx]
+
+    def _DecodeValue(self, value):
+        if isinstance(value, list):
+            return [self._DecodeValue(element) for element in value]
+        if isinstance(value, dict):
+            if 'array' in value:
+                return self._Array(value['array'])
+            if 'tuple' in value:
+                return tuple(self._DecodeValue(element) for element in value['tuple'])
+            return {key: self._DecodeValue(element) for key, element in value['dict'].items()}
+        return value
+
+def LoadStereoVisionSystem(filepath, allowed_model_classes=None):
+    # Returns the stereo system and the list of distortion models of a calibration bundle
+    calibration_bundle = CalibrationBundle(filepath, allowed_model_classes)
+    return calibration_bundle.StereoVisionSystem(), calibration_bundle.DistortionModels()
+
+def _EncodeValue(value, arrays):
+    # JSON-compatible description of value. The numpy arrays are appended to arrays, and referred to by their index
+    if isinstance(value, np.ndarray):
+        arrays.append(value)
+        return {'array': len(arrays) - 1}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, tuple):
+        return {'tuple': [_EncodeValue(element, arrays) for element in value]}
+    if isinstance(value, list):
+        return [_EncodeValue(element, arrays) for element in value]
+    if isinstance(value, dict) and all(isinstance(key, str) for key in value.keys()):
+        return {'dict': {key: _EncodeValue(element, arrays) for key, element in value.items()}}
+    raise ValueError(f"_EncodeValue(): Values of type {type(value)} can't be stored in a calibration bundle")
+
+def _AlignedOffset(offset):
+    return (offset + array_alignment - 1) // array_alignment * array_alignment
@@ -1,5 +1,8 @@
+import collections
 import cv2
+import threading
 import time
+from stereo_vision import instrumentation
 
 class Grabber():
     def __init__(self, cameraCaptures_id_list, grab_delays=None):
@@ -9,13 +12,21 @@ class Grabber():
         self.grab_delays = grab_delays
 
     def Grab(self):
+        grabbed_images, timestamps = self.GrabWithTimestamps()
+        return grabbed_images
+
+    @instrumentation.Timed()
+    def GrabWithTimestamps(self):
         grabbed_images = []
+        timestamps = []
         #for camera_capture, id in self.cameraCaptures_id_list:
         for camera_ndx in range(len(self.cameraCaptures_id_list)):
             camera_capture = self.cameraCaptures_id_list[camera_ndx][0]
-            if self.grab_delays is not None and camera_ndx > 0:
+            if self.grab_delays is not None and camera_ndx > 0 and self.grab_delays[camera_ndx - 1] > 0:
                 time.sleep(self.grab_delays[camera_ndx - 1])
-            retval = camera_capture.grab()  # Cf. https://docs.opencv.org/4.x/d8/dfe/classcv_1_1VideoCapture.html#ae38c2a053d39d6b20c9c649e08ff0146
+            with instrumentation.Timer('Grabber.grab'):
+                retval = camera_capture.grab()  # Cf. https://docs.opencv.org/4.x/d8/dfe/classcv_1_1VideoCapture.html#ae38c2a053d39d6b20c9c649e08ff0146
+            timestamps.append(time.monotonic())
             #ret_val, image = camera_capture.read()
             """if ret_val == True:
                 grabbed_images.append(image)
@@ -25,9 +36,10 @@ class Grabber():
                 self.RestartCameras()
             """
         for camera_capture, id in self.cameraCaptures_id_list:
-            retval, image = camera_capture.retrieve(flag=0)
+            with instrumentation.Timer('Grabber.retrieve'):
+                retval, image = camera_capture.retrieve(flag=0)
             grabbed_images.append(image)
-        return grabbed_images
+        return grabbed_images, timestamps
 
     """
     def Grab(self):
@@ -54,3 +66,111 @@ class Grabber():
             video_capture = cv2.VideoCapture(camera_id)
             self.cameraCaptures_id_list.append((video_capture, camera_id))
         self.camera_id_backup_list = new_camera_backup_id_list
+
+
+class ThreadedGrabber(Grabber):
+    """
+    Free-running grabber: each camera is read by its own capture thread, that pushes time-stamped frames in a small
+    ring buffer. Grab() returns the newest frame of each camera without blocking. PopBufferedFrames() hands over all
+    the buffered frames, for example to a synchronization.FrameSynchronizer. A frame that falls off the ring buffer,
+    or gets skipped by Grab(), before being handed over is counted as dropped.
+    Timestamps come from time.monotonic(), taken right after the frame is grabbed.
+    """
+    def __init__(self, cameraCaptures_id_list, buffer_size=1, failure_sleep=0.01):
+        super().__init__(cameraCaptures_id_list, grab_delays=None)
+        if buffer_size < 1:
+            raise ValueError(f"ThreadedGrabber.__init__(): buffer_size ({buffer_size}) < 1")
+        self.failure_sleep = failure_sleep
+        self.lock = threading.Lock()
+        self.capture_threads = []
+        self.is_running = False
+        self.buffers = [collections.deque(maxlen=buffer_size) for _ in cameraCaptures_id_list]
+        self.latest_images = [None] * len(cameraCaptures_id_list)
+        self.latest_timestamps = [None] * len(cameraCaptures_id_list)
+        self.captured_counts = [0] * len(cameraCaptures_id_list)
+        self.dropped_counts = [0] * len(cameraCaptures_id_list)
+        self.failed_counts = [0] * len(cameraCaptures_id_list)
+
+    def Start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.capture_threads = []
+        for camera_ndx in range(len(self.cameraCaptures_id_list)):
+            capture_thread = threading.Thread(target=self._Capture, args=(camera_ndx,), daemon=True)
+            capture_thread.start()
+            self.capture_threads.append(capture_thread)
+
+    def Stop(self):
+        self.is_running = False
+        for capture_thread in self.capture_threads:
+            capture_thread.join()
+        self.capture_threads = []
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Stop()
+
+    def _Capture(self, camera_ndx):
+        camera_capture = self.cameraCaptures_id_list[camera_ndx][0]
+        buffer = self.buffers[camera_ndx]
+        while self.is_running:
+            with instrumentation.Timer('ThreadedGrabber.grab'):
+                retval = camera_capture.grab()
+            timestamp = time.monotonic()
+            if retval:
+                with instrumentation.Timer('ThreadedGrabber.retrieve'):
+                    retval, image = camera_capture.retrieve()
+            if not retval:
+                with self.lock:
+                    self.failed_counts[camera_ndx] += 1
+                instrumentation.Increment('ThreadedGrabber.failed')
+                time.sleep(self.failure_sleep)
+                continue
+            instrumentation.Increment('ThreadedGrabber.captured')
+            with self.lock:
+                if len(buffer) == buffer.maxlen:
+                    self.dropped_counts[camera_ndx] += 1
+                buffer.append((timestamp, image))
+                self.latest_images[camera_ndx] = image
+                self.latest_timestamps[camera_ndx] = timestamp
+                self.captured_counts[camera_ndx] += 1
+
+    def Grab(self):
+        grabbed_images, timestamps = self.GrabWithTimestamps()
+        return grabbed_images
+
+    @instrumentation.Timed()
+    def GrabWithTimestamps(self):
+        with self.lock:
+            grabbed_images = list(self.latest_images)
+            timestamps = list(self.latest_timestamps)
+            for camera_ndx in range(len(self.buffers)):
+                # All the buffered frames but the newest one are skipped
+                self.dropped_counts[camera_ndx] += max(len(self.buffers[camera_ndx]) - 1, 0)
+                self.buffers[camera_ndx].clear()
+        return grabbed_images, timestamps
+
+    def PopBufferedFrames(self):
+        with self.lock:
+            timestampImage_lists = [list(buffer) for buffer in self.buffers]
+            for buffer in self.buffers:
+                buffer.clear()
+        return timestampImage_lists
+
+    def WaitForFirstImages(self, timeout=5.0, polling_period=0.005):
+        end_time = time.monotonic() + timeout
+        while time.monotonic() < end_time:
+            with self.lock:
+                if all(image is not None for image in self.latest_images):
+                    return True
+            time.sleep(polling_period)
+        return False
+
+    def Statistics(self):
+        with self.lock:
+            return {'captured': list(self.captured_counts), 'dropped': list(self.dropped_counts),
+                    'failed': list(self.failed_counts)}
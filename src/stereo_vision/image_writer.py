@@ -0,0 +1,97 @@
+import cv2
+import queue
+import threading
+from stereo_vision import instrumentation
+
+class AsyncImageWriter():
+    """
+    Writes images to disk from a pool of encoder threads, fed by a bounded queue, so that the encoding time does not
+    slow down the caller. cv2.imwrite() releases the GIL while encoding, so the threads run in parallel.
+    When the queue is full, backpressure is either 'block' (Write() waits for a free slot) or 'drop_oldest' (the
+    oldest queued image is discarded to make room).
+    """
+    def __init__(self, number_of_threads=2, queue_size=32, backpressure='block', imwrite_params=None):
+        if number_of_threads < 1:
+            raise ValueError(f"AsyncImageWriter.__init__(): number_of_threads ({number_of_threads}) < 1")
+        if queue_size < 1:
+            raise ValueError(f"AsyncImageWriter.__init__(): queue_size ({queue_size}) < 1")
+        if backpressure not in ['block', 'drop_oldest']:
+            raise ValueError(f"AsyncImageWriter.__init__(): Unknown backpressure '{backpressure}'. Expected 'block' or 'drop_oldest'")
+        self.backpressure = backpressure
+        self.imwrite_params = imwrite_params if imwrite_params is not None else []
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.written_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+        self.maximum_queue_depth = 0
+        self.is_closed = False
+        self.threads = []
+        for thread_ndx in range(number_of_threads):
+            thread = threading.Thread(target=self._Encode, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+    def Write(self, filepath, image):
+        if self.is_closed:
+            raise RuntimeError("AsyncImageWriter.Write(): The writer is closed")
+        if self.backpressure == 'block':
+            self.queue.put((filepath, image))
+        else:
+            with self.lock:
+                while True:
+                    try:
+                        self.queue.put_nowait((filepath, image))
+                        break
+                    except queue.Full:
+                        try:
+                            self.queue.get_nowait()
+                            self.queue.task_done()
+                            self.dropped_count += 1
+                        except queue.Empty:
+                            pass
+        with self.lock:
+            self.maximum_queue_depth = max(self.maximum_queue_depth, self.queue.qsize())
+
+    def Flush(self):
+        self.queue.join()
+
+    def Close(self):
+        if self.is_closed:
+            return
+        self.Flush()
+        self.is_closed = True
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _Encode(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            filepath, image = item
+            try:
+                with instrumentation.Timer('AsyncImageWriter.imwrite'):
+                    is_written = cv2.imwrite(filepath, image, self.imwrite_params)
+            except cv2.error:
+                is_written = False
+            with self.lock:
+                if is_written:
+                    self.written_count += 1
+                else:
+                    self.failed_count += 1
+            self.queue.task_done()
+
+    def Statistics(self):
+        with self.lock:
+            return {'written': self.written_count, 'dropped': self.dropped_count, 'failed': self.failed_count,
+                    'queue_depth': self.queue.qsize(), 'maximum_queue_depth': self.maximum_queue_depth}
@@ -0,0 +1,225 @@
+import collections
+import functools
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+
+# Timers, counters and histograms of the pipeline stages, in a process-wide registry. The instrumentation is disabled
+# by default: a timer is then a shared no-op context manager, and a decorated function costs one flag test on top of
+# the call, so the instrumentation can stay in the hot paths.
+is_enabled = False
+is_tracing = False
+history_length = 10000
+maximum_number_of_trace_events = 1000000
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_trace_events = []
+_thread_names = {}  # (pid, tid) -> thread name
+
+class Histogram():
+    """
+    Count, sum, minimum and maximum of all the observed values, and the history_length most recent values, for the
+    percentiles.
+    """
+    def __init__(self, unit=None):
+        self.unit = unit
+        self.count = 0
+        self.sum = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.recent_values = collections.deque(maxlen=history_length)
+
+    def Observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        self.recent_values.append(value)
+
+    def Summary(self, percentiles=(50, 95, 99)):
+        summary = {'unit': self.unit, 'count': self.count, 'sum': self.sum,
+                   'mean': self.sum / self.count if self.count > 0 else None,
+                   'min': self.minimum if self.count > 0 else None, 'max': self.maximum if self.count > 0 else None}
+        recent_values_arr = np.array(self.recent_values)
+        for percentile in percentiles:
+            summary[f"p{percentile}"] = float(np.percentile(recent_values_arr, percentile)) if len(recent_values_arr) > 0 else None
+        return summary
+
+class _NullTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_timer = _NullTimer()
+
+class _Timer():
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end_time = time.perf_counter()
+        _RecordDuration(self.name, self.start_time, end_time)
+        return False
+
+def Enable(trace=False):
+    """
+    From now on, a timer feeds the histogram of its name with durations in seconds and, if trace, records a Chrome
+    trace event, to be opened in chrome://tracing or https://ui.perfetto.dev. The durations come from
+    time.perf_counter(), a system-wide monotonic clock on Linux, so the events of the worker processes, gathered with
+    Collect() and Merge(), are on the same timeline.
+    """
+    global is_enabled, is_tracing
+    is_enabled = True
+    is_tracing = trace
+
+def Disable():
+    global is_enabled, is_tracing
+    is_enabled = False
+    is_tracing = False
+
+def Reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _trace_events.clear()
+        _thread_names.clear()
+
+def Timer(name):
+    # Context manager that measures the duration of its block
+    if not is_enabled:
+        return _null_timer
+    return _Timer(name)
+
+def Timed(name=None):
+    # Decorator that measures the duration of each call. The default name is the function qualified name
+    def Decorator(function):
+        timer_name = name if name is not None else function.__qualname__
+        @functools.wraps(function)
+        def TimedFunction(*args, **kwargs):
+            if not is_enabled:
+                return function(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _RecordDuration(timer_name, start_time, time.perf_counter())
+        return TimedFunction
+    return Decorator
+
+def Increment(name, value=1):
+    if not is_enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def Observe(name, value, unit=None):
+    if not is_enabled:
+        return
+    with _lock:
+        if not name in _histograms:
+            _histograms[name] = Histogram(unit)
+        _histograms[name].Observe(value)
+
+def _RecordDuration(name, start_time, end_time):
+    with _lock:
+        if not name in _histograms:
+            _histograms[name] = Histogram('seconds')
+        _histograms[name].Observe(end_time - start_time)
+        if is_tracing and len(_trace_events) < maximum_number_of_trace_events:
+            thread = threading.current_thread()
+            pid = os.getpid()
+            _thread_names[(pid, thread.ident)] = thread.name
+            _trace_events.append({'name': name, 'ph': 'X', 'ts': start_time * 1e6, 'dur': (end_time - start_time) * 1e6,
+                                  'pid': pid, 'tid': thread.ident})
+
+def Summary(percentiles=(50, 95, 99)):
+    with _lock:
+        return {'counters': dict(_counters),
+                'histograms': {name: histogram.Summary(percentiles) for name, histogram in _histograms.items()}}
+
+def Collect():
+    # Hands over, and clears, the metrics of this process. For a worker process, whose metrics are merged by the main process
+    with _lock:
+        collected = {'counters': dict(_counters), 'histograms': dict(_histograms), 'trace_events': list(_trace_events),
+                     'thread_names': dict(_thread_names)}
+        _counters.clear()
+        _histograms.clear()
+        _trace_events.clear()
+        _thread_names.clear()
+    return collected
+
+def Merge(collected):
+    with _lock:
+        for name, value in collected['counters'].items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, histogram in collected['histograms'].items():
+            if not name in _histograms:
+                _histograms[name] = Histogram(histogram.unit)
+            merged_histogram = _histograms[name]
+            merged_histogram.count += histogram.count
+            merged_histogram.sum += histogram.sum
+            merged_histogram.minimum = min(merged_histogram.minimum, histogram.minimum)
+            merged_histogram.maximum = max(merged_histogram.maximum, histogram.maximum)
+            merged_histogram.recent_values.extend(histogram.recent_values)
+        number_of_kept_events = max(maximum_number_of_trace_events - len(_trace_events), 0)
+        _trace_events.extend(collected['trace_events'][0: number_of_kept_events])
+        _thread_names.update(collected['thread_names'])
+
+def PrometheusText(prefix='stereo_vision_', percentiles=(50, 95, 99)):
+    # The counters, and the histograms as summaries, in the Prometheus text exposition format
+    lines = []
+    summary = Summary(percentiles)
+    for name, value in sorted(summary['counters'].items()):
+        metric_name = _PrometheusName(prefix + name) + '_total'
+        lines += [f"# TYPE {metric_name} counter", f"{metric_name} {value}"]
+    for name, histogram_summary in sorted(summary['histograms'].items()):
+        metric_name = _PrometheusName(prefix + name + ('_' + histogram_summary['unit'] if histogram_summary['unit'] is not None else ''))
+        lines.append(f"# TYPE {metric_name} summary")
+        for percentile in percentiles:
+            if histogram_summary[f"p{percentile}"] is not None:
+                lines.append(f"{metric_name}{{quantile=\"{percentile / 100}\"}} {histogram_summary[f'p{percentile}']!r}")
+        lines += [f"{metric_name}_sum {histogram_summary['sum']!r}", f"{metric_name}_count {histogram_summary['count']}"]
+    return "\n".join(lines) + "\n"
+
+def _PrometheusName(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+def ChromeTrace():
+    # The trace events, with the thread names as metadata events, in the Chrome trace event format
+    with _lock:
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}}
+                  for (pid, tid), thread_name in _thread_names.items()]
+        events += list(_trace_events)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def SaveJson(filepath, percentiles=(50, 95, 99)):
+    with open(filepath, 'w') as output_file:
+        json.dump(Summary(percentiles), output_file, indent=1)
+
+def SavePrometheus(filepath, prefix='stereo_vision_', percentiles=(50, 95, 99)):
+    with open(filepath, 'w') as output_file:
+        output_file.write(PrometheusText(prefix, percentiles))
+
+def SaveChromeTrace(filepath):
+    with open(filepath, 'w') as output_file:
+        json.dump(ChromeTrace(), output_file)
+
+def SaveReports(output_directory):
+    # Writes metrics.json, metrics.prom and, if tracing, trace.json in output_directory
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    SaveJson(os.path.join(output_directory, 'metrics.json'))
+    SavePrometheus(os.path.join(output_directory, 'metrics.prom'))
+    if is_tracing:
+        SaveChromeTrace(os.path.join(output_directory, 'trace.json'))
@@ -0,0 +1,218 @@
+import collections
+import numpy as np
+import queue
+import threading
+import time
+
+class LiveTrackingPipeline():
+    """
+    Streaming 3D tracking: grabber -> one detector per camera -> undistortion -> triangulation, with each stage in its
+    own thread, so that the grab of a frame overlaps with the detection of the previous one and the triangulation of
+    the one before. The stages are connected by bounded queues. With backpressure 'drop_oldest', a stage that falls
+    behind makes the oldest queued frames be dropped, which bounds the latency. With 'block', the grabber waits.
+    detectors: One callable per camera, image -> (x, y), that returns (-1, -1) when nothing is found, e.g. the bound
+    Detect() or Track() method of a red square detector.
+    undistorters: None, or one object per camera (or None) with an UndistortPoints((N, 2) array) -> (N, 2) array
+    method, e.g. an undistortion.UndistortionMaps.
+    trajectory_filter: None, or a trajectory_filter.TrajectoryFilter with one target.
+    The results are popped with Pop(). Each result is a dictionary with the frame index, the grab timestamp
+    (time.monotonic() clock), the (n_cameras, 2) detected centers, the XYZ point (NaN if a camera missed the target),
+    and the filtered XYZ point if a trajectory filter is used.
+    """
+    def __init__(self, grabber, detectors, stereo_system, undistorters=None, trajectory_filter=None, queue_size=4,
+                 backpressure='drop_oldest', output_queue_size=256, latency_history_length=10000):
+        if len(detectors) != len(stereo_system.projection_matrices_list):
+            raise ValueError(f"LiveTrackingPipeline.__init__(): len(detectors) ({len(detectors)}) != len(stereo_system.projection_matrices_list) ({len(stereo_system.projection_matrices_list)})")
+        if undistorters is not None and len(undistorters) != len(detectors):
+            raise ValueError(f"LiveTrackingPipeline.__init__(): len(undistorters) ({len(undistorters)}) != len(detectors) ({len(detectors)})")
+        if backpressure not in ['block', 'drop_oldest']:
+            raise ValueError(f"LiveTrackingPipeline.__init__(): Unknown backpressure '{backpressure}'. Expected 'block' or 'drop_oldest'")
+        self.grabber = grabber
+        self.detectors = detectors
+        self.stereo_system = stereo_system
+        self.undistorters = undistorters
+        self.trajectory_filter = trajectory_filter
+        self.backpressure = backpressure
+        self.number_of_cameras = len(detectors)
+        self.detection_queues = [queue.Queue(maxsize=queue_size) for _ in detectors]
+        self.detection_results_queue = queue.Queue()
+        self.output_queue = queue.Queue(maxsize=output_queue_size)
+        self.lock = threading.Lock()
+        self.stage_names = ['grab', 'queue', 'detect', 'solve', 'end_to_end']
+        self.latencies = {stage_name: collections.deque(maxlen=latency_history_length) for stage_name in self.stage_names}
+        self.grabbed_count = 0
+        self.solved_count = 0
+        self.output_dropped_count = 0
+        self.start_time = None
+        self.last_output_time = None
+        self.is_running = False
+        self.is_finished = False
+        self.threads = []
+
+    def Start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.start_time = time.monotonic()
+        self.threads = [threading.Thread(target=self._GrabLoop, daemon=True), threading.Thread(target=self._SolveLoop, daemon=True)]
+        for camera_ndx in range(self.number_of_cameras):
+            self.threads.append(threading.Thread(target=self._DetectLoop, args=(camera_ndx,), daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def Stop(self):
+        # Stops grabbing, and waits for the frames in the pipeline to be processed
+        self.is_running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Stop()
+
+    def Pop(self, timeout=None):
+        # Returns the next result, or None if the timeout expired or the pipeline is finished
+        try:
+            result = self.output_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if result is None:
+            self.is_finished = True
+        return result
+
+    def IsFinished(self):
+        # True once the grabber ran out of frames, or Stop() was called, and all the results were popped
+        return self.is_finished
+
+    def _Put(self, item_queue, item):
+        if self.backpressure == 'block' and item_queue is not self.output_queue:
+            item_queue.put(item)
+            return
+        while True:
+            try:
+                item_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    item_queue.get_nowait()
+                    if item_queue is self.output_queue:
+                        with self.lock:
+                            self.output_dropped_count += 1
+                except queue.Empty:
+                    pass
+
+    def _GrabLoop(self):
+        frame_ndx = 0
+        last_timestamps = None
+        while self.is_running:
+            images, timestamps = self.grabber.GrabWithTimestamps()
+            grabbed_time = time.monotonic()
+            if any(image is None for image in images):
+                if all(timestamp is None for timestamp in timestamps):
+                    time.sleep(0.001)  # A threaded grabber without a first image yet
+                    continue
+                break  # End of the recording
+            if timestamps == last_timestamps:
+                time.sleep(0.001)  # A threaded grabber that has no new frame yet
+                continue
+            last_timestamps = timestamps
+            with self.lock:
+                self.grabbed_count += 1
+                self.latencies['grab'].append(grabbed_time - min(timestamps))
+            for camera_ndx in range(self.number_of_cameras):
+                self._Put(self.detection_queues[camera_ndx], (frame_ndx, min(timestamps), grabbed_time, images[camera_ndx]))
+            frame_ndx += 1
+        for detection_queue in self.detection_queues:
+            detection_queue.put(None)
+
+    def _DetectLoop(self, camera_ndx):
+        detector = self.detectors[camera_ndx]
+        while True:
+            item = self.detection_queues[camera_ndx].get()
+            if item is None:
+                self.detection_results_queue.put((camera_ndx, None))
+                return
+            frame_ndx, timestamp, grabbed_time, image = item
+            detection_start_time = time.monotonic()
+            center = detector(image)
+            self.detection_results_queue.put((camera_ndx, (frame_ndx, timestamp, grabbed_time, center, detection_start_time, time.monotonic())))
+
+    def _SolveLoop(self):
+        """
+        The detection queues may drop different frames: the results are gathered per frame index, and a frame is
+        solved once all the cameras have processed it. The incomplete frames that are older are then dropped.
+        """
+        frameNdx_to_results = {}
+        number_of_finished_cameras = 0
+        while number_of_finished_cameras < self.number_of_cameras:
+            camera_ndx, detection_result = self.detection_results_queue.get()
+            if detection_result is None:
+                number_of_finished_cameras += 1
+                continue
+            frame_ndx = detection_result[0]
+            frameNdx_to_results.setdefault(frame_ndx, [None] * self.number_of_cameras)[camera_ndx] = detection_result
+            if any(result is None for result in frameNdx_to_results[frame_ndx]):
+                continue
+            detection_results = frameNdx_to_results.pop(frame_ndx)
+            for older_frame_ndx in [ndx for ndx in frameNdx_to_results.keys() if ndx < frame_ndx]:
+                del frameNdx_to_results[older_frame_ndx]
+            self._Solve(frame_ndx, detection_results)
+        self._Put(self.output_queue, None)
+
+    def _Solve(self, frame_ndx, detection_results):
+        solve_start_time = time.monotonic()
+        timestamp = detection_results[0][1]
+        grabbed_time = detection_results[0][2]
+        centers_arr = np.array([detection_result[3] for detection_result in detection_results], dtype=float)
+        undistorted_centers_arr = centers_arr.copy()
+        is_detected = ~np.all(centers_arr == -1, axis=1)
+        XYZ = np.full(3, np.nan)
+        if np.all(is_detected):
+            if self.undistorters is not None:
+                for camera_ndx in range(self.number_of_cameras):
+                    if self.undistorters[camera_ndx] is not None:
+                        undistorted_centers_arr[camera_ndx] = self.undistorters[camera_ndx].UndistortPoints(centers_arr[camera_ndx: camera_ndx + 1])[0]
+            XYZ = self.stereo_system.SolveXYZBatch(undistorted_centers_arr[None])[0]
+        result = {'frame_index': frame_ndx, 'timestamp': timestamp, 'centers': centers_arr, 'XYZ': XYZ}
+        if self.trajectory_filter is not None:
+            filtered_positions, is_accepted = self.trajectory_filter.Update(timestamp, XYZ[None])
+            result['filtered_XYZ'] = filtered_positions[0]
+        output_time = time.monotonic()
+        result['latency'] = output_time - timestamp
+        with self.lock:
+            self.solved_count += 1
+            self.last_output_time = output_time
+            self.latencies['queue'].append(max(detection_result[4] for detection_result in detection_results) - grabbed_time)
+            self.latencies['detect'].append(max(detection_result[5] - detection_result[4] for detection_result in detection_results))
+            self.latencies['solve'].append(output_time - solve_start_time)
+            self.latencies['end_to_end'].append(output_time - timestamp)
+        self._Put(self.output_queue, result)
+
+    def Statistics(self, percentiles=(50, 95, 99)):
+        """
+        The frame counts (the dropped frames did not reach the triangulation, the output_dropped results were not
+        popped in time), the output rate in frames per second, and the latency percentiles of each stage, in seconds:
+        grab (from the first camera grab to the images being retrieved), queue (waiting for a detector), detect (the
+        slowest camera), solve (undistortion, triangulation and filtering) and end_to_end (from the first camera grab to
+        the result).
+        """
+        with self.lock:
+            duration = self.last_output_time - self.start_time if self.last_output_time is not None else 0
+            # The frames still in the pipeline are not counted as dropped
+            number_of_frames_in_pipeline = sum(detection_queue.qsize() for detection_queue in self.detection_queues) // self.number_of_cameras
+            statistics = {'grabbed': self.grabbed_count, 'solved': self.solved_count,
+                          'dropped': max(self.grabbed_count - self.solved_count - number_of_frames_in_pipeline, 0),
+                          'output_dropped': self.output_dropped_count,
+                          'fps': self.solved_count / duration if duration > 0 else 0.0}
+            for stage_name in self.stage_names:
+                latencies_arr = np.array(self.latencies[stage_name])
+                if len(latencies_arr) == 0:
+                    statistics[stage_name] = {}
+                    continue
+                statistics[stage_name] = {f"p{percentile}": float(np.percentile(latencies_arr, percentile)) for percentile in percentiles}
+                statistics[stage_name]['max'] = float(np.max(latencies_arr))
+        return statistics
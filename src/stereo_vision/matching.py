@@ -0,0 +1,140 @@
+import numpy as np
+
+def FundamentalMatrix(projection_matrix1, projection_matrix2):
+    # F = [e2]x P2 P1^+, with e2 = P2 C1 the epipole in image 2, and C1 the center of camera 1 (Hartley & Zisserman, 9.2.2)
+    P1 = np.asarray(projection_matrix1.matrix, dtype=float)
+    P2 = np.asarray(projection_matrix2.matrix, dtype=float)
+    _, _, Vt = np.linalg.svd(P1)
+    C1 = Vt[-1]
+    e2 = P2 @ C1
+    e2_cross = np.array([[0, -e2[2], e2[1]], [e2[2], 0, -e2[0]], [-e2[1], e2[0], 0]])
+    F = e2_cross @ P2 @ np.linalg.pinv(P1)
+    return F / np.linalg.norm(F)
+
+def Epipole(F):
+    # The epipole in image 2, in homogeneous coordinates: F^T e2 = 0
+    _, _, Vt = np.linalg.svd(F.T)
+    return Vt[-1]
+
+def EpipolarDistances(F, points1_arr, points2_arr):
+    # The distances, in pixels, of points2_arr[k] to the epipolar line of points1_arr[k], and of points1_arr[k] to the
+    # epipolar line of points2_arr[k]: two (K,) arrays
+    lines2 = np.hstack([points1_arr, np.ones((len(points1_arr), 1))]) @ F.T  # (K, 3): F x1
+    lines1 = np.hstack([points2_arr, np.ones((len(points2_arr), 1))]) @ F  # (K, 3): F^T x2
+    distances2 = np.abs(np.sum(lines2[:, 0:2] * points2_arr, axis=1) + lines2[:, 2]) / np.linalg.norm(lines2[:, 0:2], axis=1)
+    distances1 = np.abs(np.sum(lines1[:, 0:2] * points1_arr, axis=1) + lines1[:, 2]) / np.linalg.norm(lines1[:, 0:2], axis=1)
+    return distances1, distances2
+
+def CandidatePairs(F, points1_arr, points2_arr, maximum_distance):
+    """
+    Returns the (K, 2) index pairs (i, j) such that points2_arr[j] may be within maximum_distance of the epipolar line
+    of points1_arr[i]. Only the points of image 2 within a window of the sorted key are returned, for each point of
+    image 1: the candidates are a superset of the pairs within maximum_distance, that the caller must filter.
+    The epipolar lines in image 2 all go through the epipole e2: the points of image 2 are sorted by their direction
+    from e2, or by their offset across the parallel epipolar lines if e2 is at infinity, so that the candidates are
+    found with a binary search instead of scoring all the pairs.
+    """
+    points1_arr = np.asarray(points1_arr, dtype=float).reshape(-1, 2)
+    points2_arr = np.asarray(points2_arr, dtype=float).reshape(-1, 2)
+    if len(points1_arr) == 0 or len(points2_arr) == 0:
+        return np.zeros((0, 2), dtype=int)
+    lines2 = np.hstack([points1_arr, np.ones((len(points1_arr), 1))]) @ F.T  # (N1, 3)
+    e2 = Epipole(F)
+    if abs(e2[2]) > 1e-12 * np.linalg.norm(e2[0:2]):
+        # Finite epipole: the key is the direction, modulo pi, from the epipole. A point at a distance r from the
+        # epipole is within maximum_distance of a line through the epipole if the angle between them is within
+        # arcsin(maximum_distance / r)
+        epipole = e2[0:2] / e2[2]
+        offsets2 = points2_arr - epipole
+        keys2 = np.mod(np.arctan2(offsets2[:, 1], offsets2[:, 0]), np.pi)
+        line_keys = np.mod(np.arctan2(-lines2[:, 0], lines2[:, 1]), np.pi)
+        minimum_radius = np.min(np.linalg.norm(offsets2, axis=1))
+        if maximum_distance >= minimum_radius:
+            half_window = np.pi / 2
+        else:
+            half_window = np.arcsin(maximum_distance / minimum_radius) * 1.001
+        period = np.pi
+    else:
+        # Epipole at infinity: the epipolar lines are parallel to (e2x, e2y), and the key is the offset across them
+        normal = np.array([-e2[1], e2[0]]) / np.linalg.norm(e2[0:2])
+        keys2 = points2_arr @ normal
+        line_keys = -lines2[:, 2] * np.sum(lines2[:, 0:2] * normal, axis=1) / np.sum(lines2[:, 0:2]**2, axis=1)
+        half_window = maximum_distance * 1.001
+        period = None
+    order2 = np.argsort(keys2)
+    sorted_keys2 = keys2[order2]
+
+    windows = [(line_keys - half_window, line_keys + half_window)]
+    if period is not None and half_window < period / 2:
+        # The angular windows that cross 0 or pi wrap around
+        windows.append((line_keys - half_window + period, line_keys + half_window + period))
+        windows.append((line_keys - half_window - period, line_keys + half_window - period))
+    elif period is not None:
+        windows = [(np.full(len(line_keys), -np.inf), np.full(len(line_keys), np.inf))]
+    pairs_list = []
+    for window_starts, window_ends in windows:
+        starts = np.searchsorted(sorted_keys2, window_starts, side='left')
+        ends = np.searchsorted(sorted_keys2, window_ends, side='right')
+        counts = ends - starts
+        ndxs1 = np.repeat(np.arange(len(points1_arr)), counts)
+        # Position within each window: arange over the total count, minus the start of the window of each element
+        positions = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        pairs_list.append(np.column_stack([ndxs1, order2[positions]]))
+    return np.unique(np.vstack(pairs_list), axis=0)
+
+def MatchPoints(F, points1_arr, points2_arr, maximum_distance=2.0, assignment='greedy'):
+    """
+    One-to-one matching of the points of image 1 and image 2, with the cost of a pair being the mean of its two
+    epipolar distances. The pairs whose epipolar distance in either image is above maximum_distance are not considered.
+    assignment: 'greedy' takes the pairs by increasing cost, skipping the points already matched. 'optimal' minimizes
+    the total cost of the matches with scipy.optimize.linear_sum_assignment() (requires scipy).
+    Returns the (K, 2) index pairs (i, j) and the (K,) costs, sorted by increasing cost.
+    """
+    points1_arr = np.asarray(points1_arr, dtype=float).reshape(-1, 2)
+    points2_arr = np.asarray(points2_arr, dtype=float).reshape(-1, 2)
+    pairs = CandidatePairs(F, points1_arr, points2_arr, maximum_distance)
+    distances1, distances2 = EpipolarDistances(F, points1_arr[pairs[:, 0]], points2_arr[pairs[:, 1]])
+    is_close = (distances1 <= maximum_distance) & (distances2 <= maximum_distance)
+    pairs = pairs[is_close]
+    costs = (distances1[is_close] + distances2[is_close]) / 2
+
+    if assignment == 'greedy':
+        order = np.argsort(costs, kind='stable')
+        is_matched1 = np.zeros(len(points1_arr), dtype=bool)
+        is_matched2 = np.zeros(len(points2_arr), dtype=bool)
+        match_ndxs = []
+        for pair_ndx in order:
+            i, j = pairs[pair_ndx]
+            if not is_matched1[i] and not is_matched2[j]:
+                is_matched1[i] = True
+                is_matched2[j] = True
+                match_ndxs.append(pair_ndx)
+        match_ndxs = np.array(match_ndxs, dtype=int)
+    elif assignment == 'optimal':
+        from scipy.optimize import linear_sum_assignment
+        # Each point can stay unmatched, at the cost of maximum_distance, through a dummy row or column
+        number1 = len(points1_arr)
+        number2 = len(points2_arr)
+        unmatched_cost = maximum_distance
+        forbidden_cost = 1e6 * (maximum_distance + 1)
+        cost_matrix = np.full((number1 + number2, number2 + number1), forbidden_cost)
+        cost_matrix[pairs[:, 0], pairs[:, 1]] = costs
+        cost_matrix[np.arange(number1), number2 + np.arange(number1)] = unmatched_cost
+        cost_matrix[number1 + np.arange(number2), np.arange(number2)] = unmatched_cost
+        cost_matrix[number1:, number2:] = 0
+        rows, columns = linear_sum_assignment(cost_matrix)
+        is_real = (rows < number1) & (columns < number2)
+        pair_ndx_matrix = np.full((number1, number2), -1, dtype=int)
+        pair_ndx_matrix[pairs[:, 0], pairs[:, 1]] = np.arange(len(pairs))
+        match_ndxs = pair_ndx_matrix[rows[is_real], columns[is_real]]
+        match_ndxs = match_ndxs[match_ndxs >= 0]
+        match_ndxs = match_ndxs[np.argsort(costs[match_ndxs], kind='stable')]
+    else:
+        raise ValueError(f"MatchPoints(): Unknown assignment '{assignment}'")
+    return pairs[match_ndxs], costs[match_ndxs]
+
+def MatchedCoordinates(points1_arr, points2_arr, matches):
+    # The (K, 2, 2) coordinates of the matched pairs, in the layout of StereoVisionSystem.SolveXYZBatch()
+    points1_arr = np.asarray(points1_arr, dtype=float).reshape(-1, 2)
+    points2_arr = np.asarray(points2_arr, dtype=float).reshape(-1, 2)
+    return np.stack([points1_arr[matches[:, 0]], points2_arr[matches[:, 1]]], axis=1)
@@ -1,8 +1,11 @@
 import numpy as np
+import time
+from stereo_vision import instrumentation
 
 class ProjectionMatrix:
     def __init__(self, xy_XYZ_tuples=None):
         self.matrix = np.eye(3, 4, dtype=float)
+        self.depth_sign = None  # The sign of w for the points in front of the camera, set by the calibration. None if unknown
         if xy_XYZ_tuples is not None:
             self.Create(xy_XYZ_tuples)
 
@@ -63,6 +66,7 @@ class ProjectionMatrix:
         self.matrix[2, 1] = z[9]
         self.matrix[2, 2] = z[10]
         self.matrix[2, 3] = z[11]
+        self.depth_sign = DepthSign(self.matrix, CorrespondenceArrays(xy_XYZ_tuples)[1])
 
     def Create2(self, xy_XYZ_tuples):
         if len(xy_XYZ_tuples) < 6:
@@ -119,6 +123,136 @@ class ProjectionMatrix:
         self.matrix[2, 1] = z[9]
         self.matrix[2, 2] = z[10]
         self.matrix[2, 3] = z[11]
+        self.depth_sign = DepthSign(self.matrix, CorrespondenceArrays(xy_XYZ_tuples)[1])
+
+    def CreateNormalizedDLT(self, xy_XYZ_tuples):
+        if len(xy_XYZ_tuples) < 6:
+            raise ValueError(f"ProjectionMatrix.CreateNormalizedDLT(): len(xy_XYZ_tuples) ({len(xy_XYZ_tuples)}) < 6")
+        """
+        Same system as Create(), built in one vectorized step on Hartley-normalized points: the image points are centered
+        and scaled to an average distance of sqrt(2) to the origin, the 3D points to an average distance of sqrt(3).
+        The solution is the right singular vector of A associated with the smallest singular value, which avoids squaring
+        the condition number with A^T A. Returns the reprojection error statistics.
+        """
+        xy_arr, XYZ_arr = CorrespondenceArrays(xy_XYZ_tuples)
+        self.matrix = NormalizedDLT(xy_arr, XYZ_arr)
+        self.depth_sign = DepthSign(self.matrix, XYZ_arr)
+        return self.ReprojectionStatistics(xy_XYZ_tuples)
+
+    def CreateRobust(self, xy_XYZ_tuples, inlier_threshold=2.0, maximum_number_of_iterations=2000, time_budget=None,
+                     confidence=0.999, batch_size=64, number_of_local_optimizations=3, seed=None):
+        if len(xy_XYZ_tuples) < 6:
+            raise ValueError(f"ProjectionMatrix.CreateRobust(): len(xy_XYZ_tuples) ({len(xy_XYZ_tuples)}) < 6")
+        """
+        LO-RANSAC: hypotheses are fitted on random minimal samples of 6 correspondences, batch_size at a time, and scored
+        together by projecting all the 3D points with every hypothesis. Whenever a hypothesis gets more inliers than the
+        best one so far, it is refined by fitting CreateNormalizedDLT() on its inliers. The search stops after
+        maximum_number_of_iterations hypotheses, after time_budget seconds, or when the probability to have missed a
+        better sample falls below 1 - confidence. The random generator is seeded with seed, for reproducibility.
+        Returns the reprojection statistics of the inliers, with the inlier mask and the number of iterations.
+        """
+        start_time = time.monotonic()
+        rng = np.random.default_rng(seed)
+        xy_arr, XYZ_arr = CorrespondenceArrays(xy_XYZ_tuples)
+        number_of_correspondences = len(xy_arr)
+        # Minimal samples are solved in normalized coordinates
+        T = NormalizationTransform(xy_arr)
+        U = NormalizationTransform(XYZ_arr)
+        normalized_xy_arr = xy_arr * T[0, 0] + T[0:2, 2]
+        XYZ1_arr = np.hstack([XYZ_arr * U[0, 0] + U[0:3, 3], np.ones((number_of_correspondences, 1))])
+        T_inv = np.linalg.inv(T)
+        homogeneous_XYZ_arr = np.hstack([XYZ_arr, np.ones((number_of_correspondences, 1))])
+
+        best_inlier_mask = np.zeros(number_of_correspondences, dtype=bool)
+        best_matrix = None
+        required_number_of_iterations = maximum_number_of_iterations
+        number_of_iterations = 0
+        while number_of_iterations < min(required_number_of_iterations, maximum_number_of_iterations):
+            if time_budget is not None and number_of_iterations > 0 and time.monotonic() - start_time > time_budget:
+                break
+            number_of_hypotheses = min(batch_size, maximum_number_of_iterations - number_of_iterations)
+            # (H, 6) sample indices, without repetition within a sample
+            sample_ndxs = np.argsort(rng.random((number_of_hypotheses, number_of_correspondences)), axis=1)[:, 0:6]
+            sample_XYZ1 = XYZ1_arr[sample_ndxs]  # (H, 6, 4)
+            sample_xy = normalized_xy_arr[sample_ndxs]  # (H, 6, 2)
+            zeros_arr = np.zeros_like(sample_XYZ1)
+            A = np.empty((number_of_hypotheses, 12, 12))
+            A[:, 0::2] = np.concatenate([sample_XYZ1, zeros_arr, -sample_xy[:, :, 0:1] * sample_XYZ1], axis=2)
+            A[:, 1::2] = np.concatenate([zeros_arr, sample_XYZ1, -sample_xy[:, :, 1:2] * sample_XYZ1], axis=2)
+            _, _, Vt = np.linalg.svd(A)
+            matrices = T_inv @ Vt[:, -1].reshape(-1, 3, 4) @ U  # (H, 3, 4)
+            # Score all the hypotheses at once
+            projections = np.einsum('hij,nj->hni', matrices, homogeneous_XYZ_arr)  # (H, N, 3)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                errors = np.linalg.norm(projections[:, :, 0:2] / projections[:, :, 2:3] - xy_arr, axis=2)
+            inlier_masks = errors < inlier_threshold  # NaN errors are outliers
+            inlier_counts = np.count_nonzero(inlier_masks, axis=1)
+            number_of_iterations += number_of_hypotheses
+            best_hypothesis_ndx = int(np.argmax(inlier_counts))
+            if inlier_counts[best_hypothesis_ndx] <= np.count_nonzero(best_inlier_mask) or inlier_counts[best_hypothesis_ndx] < 6:
+                continue
+            best_matrix = matrices[best_hypothesis_ndx]
+            best_inlier_mask = inlier_masks[best_hypothesis_ndx]
+            # Local optimization
+            for optimization_ndx in range(number_of_local_optimizations):
+                refined_matrix = NormalizedDLT(xy_arr[best_inlier_mask], XYZ_arr[best_inlier_mask])
+                refined_inlier_mask = ReprojectionErrors(refined_matrix, xy_arr, XYZ_arr) < inlier_threshold
+                if np.count_nonzero(refined_inlier_mask) < np.count_nonzero(best_inlier_mask):
+                    break
+                best_matrix = refined_matrix
+                best_inlier_mask = refined_inlier_mask
+            inlier_ratio = np.count_nonzero(best_inlier_mask) / number_of_correspondences
+            # log1p() keeps the precision of 1 - inlier_ratio**6 when the inlier ratio is low. If it still rounds to 1,
+            # no number of iterations reaches the confidence
+            log_miss_probability = np.log1p(-inlier_ratio**6)
+            if inlier_ratio >= 1.0:
+                required_number_of_iterations = 0
+            elif log_miss_probability == 0 or not np.isfinite(log_miss_probability):
+                required_number_of_iterations = maximum_number_of_iterations
+            else:
+                required_number_of_iterations = min(int(np.ceil(np.log(1 - confidence) / log_miss_probability)),
+                                                    maximum_number_of_iterations)
+        if best_matrix is None:
+            raise ValueError(f"ProjectionMatrix.CreateRobust(): No hypothesis has 6 inliers or more, after {number_of_iterations} iterations")
+        # Final fit on the inliers
+        self.matrix = NormalizedDLT(xy_arr[best_inlier_mask], XYZ_arr[best_inlier_mask])
+        inlier_mask = ReprojectionErrors(self.matrix, xy_arr, XYZ_arr) < inlier_threshold
+        if np.count_nonzero(inlier_mask) < 6:
+            raise ValueError(f"ProjectionMatrix.CreateRobust(): The final fit has {np.count_nonzero(inlier_mask)} inliers < 6, after {number_of_iterations} iterations")
+        self.depth_sign = DepthSign(self.matrix, XYZ_arr[inlier_mask])
+        inlier_errors = ReprojectionErrors(self.matrix, xy_arr[inlier_mask], XYZ_arr[inlier_mask])
+        return {'rms': float(np.sqrt(np.mean(inlier_errors**2))), 'mean': float(np.mean(inlier_errors)),
+                'median': float(np.median(inlier_errors)), 'max': float(np.max(inlier_errors)),
+                'inlier_mask': inlier_mask, 'number_of_inliers': int(np.count_nonzero(inlier_mask)),
+                'number_of_iterations': number_of_iterations}
+
+    def Refine(self, xy_XYZ_tuples, maximum_number_of_iterations=100, tolerance=1e-12):
+        if len(xy_XYZ_tuples) < 6:
+            raise ValueError(f"ProjectionMatrix.Refine(): len(xy_XYZ_tuples) ({len(xy_XYZ_tuples)}) < 6")
+        """
+        Levenberg-Marquardt minimization of the sum of the squared reprojection errors, in pixels, starting from the
+        current matrix (typically the result of CreateNormalizedDLT() or CreateRobust()). Returns the reprojection
+        statistics, with the per-point errors and the convergence statistics.
+        """
+        xy_arr, XYZ_arr = CorrespondenceArrays(xy_XYZ_tuples)
+        self.matrix, convergence_statistics = RefineProjectionMatrix(self.matrix, xy_arr, XYZ_arr,
+                                                                     maximum_number_of_iterations, tolerance)
+        self.depth_sign = DepthSign(self.matrix, XYZ_arr)
+        errors = ReprojectionErrors(self.matrix, xy_arr, XYZ_arr)
+        statistics = {'rms': float(np.sqrt(np.mean(errors**2))), 'mean': float(np.mean(errors)),
+                      'median': float(np.median(errors)), 'max': float(np.max(errors)), 'reprojection_errors': errors}
+        statistics.update(convergence_statistics)
+        return statistics
+
+    def ReprojectionErrors(self, xy_XYZ_tuples):
+        # The (N,) distances, in pixels, between the image points and the projection of the 3D points
+        xy_arr, XYZ_arr = CorrespondenceArrays(xy_XYZ_tuples)
+        return ReprojectionErrors(self.matrix, xy_arr, XYZ_arr)
+
+    def ReprojectionStatistics(self, xy_XYZ_tuples):
+        errors = self.ReprojectionErrors(xy_XYZ_tuples)
+        return {'rms': float(np.sqrt(np.mean(errors**2))), 'mean': float(np.mean(errors)),
+                'median': float(np.median(errors)), 'max': float(np.max(errors))}
 
     def Project(self, point3D, must_round=False, zero_threshold=1e-9):
         if len(point3D) != 3:
@@ -137,12 +271,174 @@ class ProjectionMatrix:
             xy[1] = round(xy[1])
         return xy
 
+    def ProjectPoints(self, points_arr, must_round=False, zero_threshold=1e-9, out=None, valid_mask_out=None):
+        """
+        Projects N 3D points with a single matrix product. Returns the (N, 2) image points and the (N,) validity mask.
+        Instead of raising like Project(), the points whose depth is within zero_threshold of the camera plane are
+        flagged as invalid, and their image points are NaN (or (-1, -1) if must_round). If the calibration set
+        depth_sign, the points that are behind the camera are also invalid.
+        With must_round, the image points are integers. The results can be written in preallocated (N, 2) and (N,)
+        buffers out and valid_mask_out.
+        """
+        points_arr = np.asarray(points_arr, dtype=float)
+        if points_arr.ndim != 2 or points_arr.shape[1] != 3:
+            raise ValueError(f"ProjectionMatrix.ProjectPoints(): points_arr.shape ({points_arr.shape}) != (N, 3)")
+        number_of_points = points_arr.shape[0]
+        projections = points_arr @ self.matrix[:, 0:3].T
+        projections += self.matrix[:, 3]
+        if valid_mask_out is None:
+            valid_mask_out = np.empty(number_of_points, dtype=bool)
+        # The matrix is defined up to a scale factor, whose sign can't be told from the matrix alone: the sign of det(M)
+        # depends on the handedness of the world frame. The matrices that were unpickled from older versions have no depth_sign
+        depth_sign = getattr(self, 'depth_sign', None)
+        if depth_sign is None:
+            np.greater(np.abs(projections[:, 2]), zero_threshold, out=valid_mask_out)
+        else:
+            np.greater(depth_sign * projections[:, 2], zero_threshold, out=valid_mask_out)
+        if out is None:
+            out = np.empty((number_of_points, 2), dtype=int if must_round else float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(projections[:, 0:2], projections[:, 2:3], out=projections[:, 0:2])
+        if must_round:
+            np.rint(projections[:, 0:2], out=projections[:, 0:2])
+            projections[~valid_mask_out, 0:2] = -1
+        else:
+            projections[~valid_mask_out, 0:2] = np.nan
+        np.copyto(out, projections[:, 0:2], casting='unsafe')
+        return out, valid_mask_out
+
+def CorrespondenceArrays(xy_XYZ_tuples):
+    # [((x, y), (X, Y, Z)), ...] -> (N, 2) array, (N, 3) array
+    xy_arr = np.array([xy for xy, XYZ in xy_XYZ_tuples], dtype=float).reshape(-1, 2)
+    XYZ_arr = np.array([XYZ for xy, XYZ in xy_XYZ_tuples], dtype=float).reshape(-1, 3)
+    return xy_arr, XYZ_arr
+
+def DepthSign(matrix, XYZ_arr):
+    # The majority sign of w over the calibration points, which are in front of the camera
+    w_arr = XYZ_arr @ matrix[2, 0:3] + matrix[2, 3]
+    return 1.0 if np.count_nonzero(w_arr > 0) >= np.count_nonzero(w_arr < 0) else -1.0
+
+def NormalizedDLT(xy_arr, XYZ_arr):
+    # Returns the (3, 4) projection matrix, with matrix[2, 3] = 1, from (N, 2) image points and (N, 3) 3D points
+    T = NormalizationTransform(xy_arr)  # (3, 3)
+    U = NormalizationTransform(XYZ_arr)  # (4, 4)
+    normalized_xy_arr = xy_arr * T[0, 0] + T[0:2, 2]
+    normalized_XYZ_arr = XYZ_arr * U[0, 0] + U[0:3, 3]
+
+    number_of_correspondences = len(xy_arr)
+    XYZ1_arr = np.hstack([normalized_XYZ_arr, np.ones((number_of_correspondences, 1))])  # (N, 4)
+    zeros_arr = np.zeros((number_of_correspondences, 4))
+    A = np.empty((2 * number_of_correspondences, 12), dtype=float)
+    A[0::2] = np.hstack([XYZ1_arr, zeros_arr, -normalized_xy_arr[:, 0:1] * XYZ1_arr])
+    A[1::2] = np.hstack([zeros_arr, XYZ1_arr, -normalized_xy_arr[:, 1:2] * XYZ1_arr])
+    _, singular_values, Vt = np.linalg.svd(A, full_matrices=False)
+    normalized_matrix = Vt[-1].reshape(3, 4)
+    # Denormalize: x = T P_norm U X  =>  P = T^-1 P_norm U
+    matrix = np.linalg.inv(T) @ normalized_matrix @ U
+    return matrix / matrix[2, 3]
+
+def ReprojectionErrors(matrix, xy_arr, XYZ_arr):
+    projections = np.hstack([XYZ_arr, np.ones((len(XYZ_arr), 1))]) @ matrix.T
+    projected_xy_arr = projections[:, 0:2] / projections[:, 2:3]
+    return np.linalg.norm(projected_xy_arr - xy_arr, axis=1)
+
+def RefineProjectionMatrix(matrix, xy_arr, XYZ_arr, maximum_number_of_iterations=100, tolerance=1e-12, initial_damping=1e-3):
+    """
+    Levenberg-Marquardt on the 11 degrees of freedom of the matrix. The problem is expressed in Hartley-normalized
+    coordinates, where the parameters have comparable scales. The image normalization is a similarity, so the
+    normalized reprojection errors are the pixel errors times a constant. The element [2, 3] of the normalized matrix
+    is the depth of the 3D points centroid: it is kept fixed.
+    Returns the refined matrix, with matrix[2, 3] = 1, and the convergence statistics.
+    """
+    T = NormalizationTransform(xy_arr)
+    U = NormalizationTransform(XYZ_arr)
+    normalized_xy_arr = xy_arr * T[0, 0] + T[0:2, 2]
+    XYZ1_arr = np.hstack([XYZ_arr * U[0, 0] + U[0:3, 3], np.ones((len(XYZ_arr), 1))])  # (N, 4)
+    normalized_matrix = T @ matrix @ np.linalg.inv(U)
+    normalized_matrix /= normalized_matrix[2, 3]
+
+    def Residuals(normalized_matrix):
+        projections = XYZ1_arr @ normalized_matrix.T  # (N, 3)
+        projected_xy_arr = projections[:, 0:2] / projections[:, 2:3]
+        return (projected_xy_arr - normalized_xy_arr).ravel(), projections, projected_xy_arr
+
+    residuals, projections, projected_xy_arr = Residuals(normalized_matrix)
+    initial_cost = cost = float(residuals @ residuals)
+    damping = initial_damping
+    converged = False
+    iteration_ndx = 0
+    for iteration_ndx in range(1, maximum_number_of_iterations + 1):
+        """
+        x = p0 . X / w, y = p1 . X / w, with w = p2 . X
+        dx/dp0 = X / w     dx/dp2 = -x X / w
+        dy/dp1 = X / w     dy/dp2 = -y X / w
+        The last column of dx/dp2 and dy/dp2 is dropped, since p23 is fixed.
+        """
+        XYZ1_over_w = XYZ1_arr / projections[:, 2:3]  # (N, 4)
+        J = np.zeros((2 * len(XYZ1_arr), 11))
+        J[0::2, 0:4] = XYZ1_over_w
+        J[1::2, 4:8] = XYZ1_over_w
+        J[0::2, 8:11] = -projected_xy_arr[:, 0:1] * XYZ1_over_w[:, 0:3]
+        J[1::2, 8:11] = -projected_xy_arr[:, 1:2] * XYZ1_over_w[:, 0:3]
+        JtJ = J.T @ J
+        Jtr = J.T @ residuals
+        # Retry with a larger damping until the cost decreases
+        step_is_accepted = False
+        while not step_is_accepted and damping < 1e12:
+            delta = SolveNormalEquations(JtJ + damping * np.diag(np.diag(JtJ)), -Jtr)
+            candidate_matrix = normalized_matrix + np.append(delta, 0).reshape(3, 4)
+            candidate_residuals, candidate_projections, candidate_projected_xy_arr = Residuals(candidate_matrix)
+            candidate_cost = float(candidate_residuals @ candidate_residuals)
+            if np.isfinite(candidate_cost) and candidate_cost <= cost:
+                step_is_accepted = True
+                damping = max(damping / 10, 1e-12)
+            else:
+                damping *= 10
+        if not step_is_accepted:
+            converged = True  # No descent direction: we are at a minimum, up to the numerical precision
+            break
+        relative_decrease = (cost - candidate_cost) / max(cost, np.finfo(float).tiny)
+        normalized_matrix = candidate_matrix
+        residuals, projections, projected_xy_arr = candidate_residuals, candidate_projections, candidate_projected_xy_arr
+        cost = candidate_cost
+        if relative_decrease < tolerance:
+            converged = True
+            break
+    matrix = np.linalg.inv(T) @ normalized_matrix @ U
+    pixels_per_normalized_unit = 1.0 / T[0, 0]
+    convergence_statistics = {'number_of_iterations': iteration_ndx, 'converged': converged,
+                              'initial_rms': float(np.sqrt(initial_cost / len(xy_arr)) * pixels_per_normalized_unit),
+                              'final_rms': float(np.sqrt(cost / len(xy_arr)) * pixels_per_normalized_unit)}
+    return matrix / matrix[2, 3], convergence_statistics
+
+def SolveNormalEquations(A, b):
+    # Solves A x = b, or the stack of systems A[n] x[n] = b[n]. The Levenberg-Marquardt damping scales the diagonal,
+    # so a singular block stays singular, e.g. if a coordinate has no effect on the residuals: all the blocks are then
+    # solved with the pseudo-inverse, which gives the minimum-norm step of the singular ones
+    try:
+        return np.linalg.solve(A, b)
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(A) @ b
+
+def NormalizationTransform(points_arr):
+    # Similarity transform, in homogeneous coordinates, that brings the centroid of the (N, d) points to the origin
+    # and their average distance to the origin to sqrt(d)
+    dimension = points_arr.shape[1]
+    centroid = np.mean(points_arr, axis=0)
+    average_distance = np.mean(np.linalg.norm(points_arr - centroid, axis=1))
+    scale = np.sqrt(dimension) / average_distance if average_distance > 0 else 1.0
+    transform = np.eye(dimension + 1)
+    transform[0:dimension, 0:dimension] *= scale
+    transform[0:dimension, dimension] = -scale * centroid
+    return transform
+
 class StereoVisionSystem:
     def __init__(self, projection_matrices_list):
         if len(projection_matrices_list) < 2:
             raise ValueError(f"StereoVisionSystem.__init__(): len(projection_matrices_list) ({len(projection_matrices_list)}) < 2")
         self.projection_matrices_list = projection_matrices_list
 
+    @instrumentation.Timed()
     def SolveXYZ(self, coordinates_list):
         if len(coordinates_list) != len(self.projection_matrices_list):
             raise ValueError(f"StereoVisionSystem.SolveXYZ(): len(coordinates_list) ({len(coordinates_list)}) != len(self.projection_matrices_list) ({len(self.projection_matrices_list)})")
@@ -170,4 +466,117 @@ class StereoVisionSystem:
             b[2 * proj_mtx_ndx + 1] = P.matrix[1, 3] - v * P.matrix[2, 3]
         # Least-square solve
         XYZ, residuals, rank, singular_values = np.linalg.lstsq(A, b, rcond=None)
-        return XYZ
\ No newline at end of file
+        return XYZ
+
+    @instrumentation.Timed()
+    def SolveXYZBatch(self, coordinates_arr, return_diagnostics=False, maximum_condition_number=1e8):
+        coordinates_arr = np.asarray(coordinates_arr, dtype=float)
+        if coordinates_arr.ndim != 3 or coordinates_arr.shape[1] != len(self.projection_matrices_list) or coordinates_arr.shape[2] != 2:
+            raise ValueError(f"StereoVisionSystem.SolveXYZBatch(): coordinates_arr.shape ({coordinates_arr.shape}) != (N, {len(self.projection_matrices_list)}, 2)")
+        """
+        Same system as SolveXYZ(), assembled for N points at once:
+        A: (N, 2 * n_cameras, 3), b: (N, 2 * n_cameras)
+        The N normal equations (A^T A) XYZ = A^T b are solved with a single stacked eigendecomposition of the 3x3
+        symmetric matrices, which also gives the rank and the condition number of each system.
+        """
+        P_arr = np.stack([P.matrix for P in self.projection_matrices_list])  # (n_cameras, 3, 4)
+        u = coordinates_arr[:, :, 0:1]  # (N, n_cameras, 1)
+        v = coordinates_arr[:, :, 1:2]
+        A_u = u * P_arr[None, :, 2, 0:3] - P_arr[None, :, 0, 0:3]  # (N, n_cameras, 3)
+        A_v = v * P_arr[None, :, 2, 0:3] - P_arr[None, :, 1, 0:3]
+        b_u = P_arr[None, :, 0, 3] - u[:, :, 0] * P_arr[None, :, 2, 3]  # (N, n_cameras)
+        b_v = P_arr[None, :, 1, 3] - v[:, :, 0] * P_arr[None, :, 2, 3]
+        number_of_points = coordinates_arr.shape[0]
+        A = np.stack([A_u, A_v], axis=2).reshape(number_of_points, -1, 3)  # Rows in the same order as SolveXYZ()
+        b = np.stack([b_u, b_v], axis=2).reshape(number_of_points, -1)
+
+        AtA = np.einsum('nki,nkj->nij', A, A)
+        Atb = np.einsum('nki,nk->ni', A, b)
+        e_vals, e_vecs = np.linalg.eigh(AtA)  # Ascending eigenvalues
+        # The singular values of A are the square roots of the eigenvalues of A^T A. Use the same cutoff as lstsq(rcond=None)
+        singular_values = np.sqrt(np.clip(e_vals, 0, None))
+        cutoff = np.finfo(float).eps * max(A.shape[1], 3) * singular_values[:, -1:]
+        is_nonzero = singular_values > cutoff
+        rank = np.count_nonzero(is_nonzero, axis=1)
+        inverse_e_vals = np.zeros_like(e_vals)
+        inverse_e_vals[is_nonzero] = 1.0 / e_vals[is_nonzero]
+        # Pseudo-inverse solve: XYZ = V diag(1/lambda) V^T A^T b
+        XYZ_arr = np.einsum('nij,nj->ni', e_vecs, inverse_e_vals * np.einsum('nji,nj->ni', e_vecs, Atb))
+        if not return_diagnostics:
+            return XYZ_arr
+
+        residuals_arr = np.sum((np.einsum('nki,ni->nk', A, XYZ_arr) - b)**2, axis=1)
+        with np.errstate(divide='ignore'):
+            condition_numbers = np.where(singular_values[:, 0] > 0, singular_values[:, -1] / singular_values[:, 0], np.inf)
+        is_well_conditioned_arr = (rank == 3) & (condition_numbers <= maximum_condition_number)
+        return XYZ_arr, residuals_arr, is_well_conditioned_arr
+
+    @instrumentation.Timed()
+    def RefineXYZBatch(self, coordinates_arr, XYZ_arr=None, maximum_number_of_iterations=20, tolerance=1e-12, initial_damping=1e-3):
+        coordinates_arr = np.asarray(coordinates_arr, dtype=float)
+        if coordinates_arr.ndim != 3 or coordinates_arr.shape[1] != len(self.projection_matrices_list) or coordinates_arr.shape[2] != 2:
+            raise ValueError(f"StereoVisionSystem.RefineXYZBatch(): coordinates_arr.shape ({coordinates_arr.shape}) != (N, {len(self.projection_matrices_list)}, 2)")
+        """
+        Levenberg-Marquardt minimization of the pixel reprojection errors of each point, starting from XYZ_arr
+        (by default, the algebraic solution of SolveXYZBatch()). The points are independent, so the normal equations are
+        N 3x3 blocks, solved together with a stacked solve (cf. SolveNormalEquations()). Each point has its own damping, and stops once its cost
+        decreases by less than the relative tolerance.
+        Returns the (N, 3) refined points, the (N, n_cameras) reprojection errors in pixels, and the convergence statistics.
+        """
+        if XYZ_arr is None:
+            XYZ_arr = self.SolveXYZBatch(coordinates_arr)
+        XYZ_arr = np.array(XYZ_arr, dtype=float)
+        P_arr = np.stack([P.matrix for P in self.projection_matrices_list])  # (n_cameras, 3, 4)
+        number_of_points = coordinates_arr.shape[0]
+
+        def Residuals(XYZ_arr, point_ndxs):
+            projections = np.einsum('cij,nj->nci', P_arr[:, :, 0:3], XYZ_arr) + P_arr[None, :, :, 3]  # (n, n_cameras, 3)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                projected_xy_arr = projections[:, :, 0:2] / projections[:, :, 2:3]
+            residuals = projected_xy_arr - coordinates_arr[point_ndxs]  # (n, n_cameras, 2)
+            return residuals, projections, projected_xy_arr
+
+        residuals, projections, projected_xy_arr = Residuals(XYZ_arr, slice(None))
+        costs = np.sum(residuals**2, axis=(1, 2))
+        initial_costs = costs.copy()
+        dampings = np.full(number_of_points, initial_damping)
+        is_active = np.isfinite(costs)
+        number_of_iterations = np.zeros(number_of_points, dtype=int)
+        for iteration_ndx in range(maximum_number_of_iterations):
+            active_ndxs = np.flatnonzero(is_active)
+            if len(active_ndxs) == 0:
+                break
+            # dx_c/dXYZ = (P_c[0, 0:3] - x_c P_c[2, 0:3]) / w_c, and likewise for y_c
+            J = (P_arr[None, :, 0:2, 0:3] - projected_xy_arr[active_ndxs, :, :, None] * P_arr[None, :, 2:3, 0:3]) / \
+                projections[active_ndxs, :, 2, None, None]  # (n_active, n_cameras, 2, 3)
+            J = J.reshape(len(active_ndxs), -1, 3)
+            JtJ = np.einsum('nki,nkj->nij', J, J)
+            Jtr = np.einsum('nki,nk->ni', J, residuals[active_ndxs].reshape(len(active_ndxs), -1))
+            diagonals = np.einsum('nii->ni', JtJ)
+            damped_JtJ = JtJ.copy()
+            damped_JtJ[:, [0, 1, 2], [0, 1, 2]] += dampings[active_ndxs, None] * diagonals
+            delta = SolveNormalEquations(damped_JtJ, -Jtr[:, :, None])[:, :, 0]
+            candidate_residuals, candidate_projections, candidate_projected_xy_arr = Residuals(XYZ_arr[active_ndxs] + delta, active_ndxs)
+            candidate_costs = np.sum(candidate_residuals**2, axis=(1, 2))
+            is_accepted = np.isfinite(candidate_costs) & (candidate_costs <= costs[active_ndxs])
+            accepted_ndxs = active_ndxs[is_accepted]
+            relative_decreases = (costs[accepted_ndxs] - candidate_costs[is_accepted]) / np.maximum(costs[accepted_ndxs], np.finfo(float).tiny)
+            XYZ_arr[accepted_ndxs] += delta[is_accepted]
+            residuals[accepted_ndxs] = candidate_residuals[is_accepted]
+            projections[accepted_ndxs] = candidate_projections[is_accepted]
+            projected_xy_arr[accepted_ndxs] = candidate_projected_xy_arr[is_accepted]
+            costs[accepted_ndxs] = candidate_costs[is_accepted]
+            number_of_iterations[active_ndxs] += 1
+            dampings[accepted_ndxs] = np.maximum(dampings[accepted_ndxs] / 10, 1e-12)
+            rejected_ndxs = active_ndxs[~is_accepted]
+            dampings[rejected_ndxs] *= 10
+            is_active[accepted_ndxs[relative_decreases < tolerance]] = False
+            is_active[rejected_ndxs[dampings[rejected_ndxs] >= 1e12]] = False  # No descent direction
+        reprojection_errors_arr = np.linalg.norm(residuals, axis=2)  # (N, n_cameras)
+        is_finite = np.isfinite(costs)
+        convergence_statistics = {'number_of_points': number_of_points,
+                                  'number_of_converged_points': int(np.count_nonzero(~is_active & is_finite)),
+                                  'maximum_number_of_iterations': int(np.max(number_of_iterations, initial=0)),
+                                  'initial_rms': float(np.sqrt(np.mean(initial_costs[is_finite] / (2 * len(P_arr))))) if np.any(is_finite) else np.nan,
+                                  'final_rms': float(np.sqrt(np.mean(costs[is_finite] / (2 * len(P_arr))))) if np.any(is_finite) else np.nan}
+        return XYZ_arr, reprojection_errors_arr, convergence_statistics
@@ -0,0 +1,219 @@
+import cv2
+from datetime import datetime
+import json
+import numpy as np
+import os
+
+format_version = 1
+header_filename = "sequence.json"
+timestamps_filename = "timestamps.raw"
+timestamp_label_formats = ["%Y-%m-%d_%H%M%S.%f", "%Y-%m-%d_%H%M%S"]
+
+def IsRawSequence(directory):
+    return os.path.isfile(os.path.join(directory, header_filename))
+
+def TimestampLabel(timestamp):
+    # Same label as the png filenames written by record.py: str(datetime) with ' ' -> '_' and ':' removed
+    return str(datetime.fromtimestamp(timestamp)).replace(' ', '_').replace(':', '')
+
+def ParseTimestampLabel(timestamp_label):
+    for label_format in timestamp_label_formats:
+        try:
+            return datetime.strptime(timestamp_label, label_format).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"ParseTimestampLabel(): Could not parse timestamp label '{timestamp_label}'")
+
+class RawSequenceWriter():
+    """
+    Writes a raw stereo sequence, a directory holding
+        sequence.json: The header (format version, camera names, image shape and dtype, number of frames)
+        <camera_name>.raw: The frames of one camera, back to back, uncompressed
+        timestamps.raw: The capture time of each frame of each camera, float64 seconds since the epoch, (n_frames, n_cameras)
+    The frame and timestamp files are memory-mapped, for writing and, by RawSequenceReader, for reading.
+    """
+    def __init__(self, directory, camera_names, image_shapeHWC, initial_capacity=256, dtype=np.uint8):
+        if len(camera_names) < 1:
+            raise ValueError(f"RawSequenceWriter.__init__(): len(camera_names) ({len(camera_names)}) < 1")
+        if initial_capacity < 1:
+            raise ValueError(f"RawSequenceWriter.__init__(): initial_capacity ({initial_capacity}) < 1")
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.camera_names = list(camera_names)
+        self.image_shapeHWC = tuple(image_shapeHWC)
+        self.dtype = np.dtype(dtype)
+        self.number_of_frames = 0
+        self.capacity = 0
+        self.frames_memmaps = None
+        self.timestamps_memmap = None
+        self._Allocate(initial_capacity)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+    def _FramesFilepath(self, camera_name):
+        return os.path.join(self.directory, camera_name + ".raw")
+
+    def _Allocate(self, capacity):
+        self._ReleaseMemmaps()
+        frame_nbytes = int(np.prod(self.image_shapeHWC)) * self.dtype.itemsize
+        filepaths_nbytes = [(self._FramesFilepath(camera_name), capacity * frame_nbytes) for camera_name in self.camera_names]
+        filepaths_nbytes.append((os.path.join(self.directory, timestamps_filename), capacity * len(self.camera_names) * 8))
+        for filepath, nbytes in filepaths_nbytes:
+            with open(filepath, 'ab') as raw_file:
+                raw_file.truncate(nbytes)
+        self.capacity = capacity
+        self.frames_memmaps = [np.memmap(self._FramesFilepath(camera_name), dtype=self.dtype, mode='r+',
+                                         shape=(capacity,) + self.image_shapeHWC) for camera_name in self.camera_names]
+        self.timestamps_memmap = np.memmap(os.path.join(self.directory, timestamps_filename), dtype=np.float64,
+                                           mode='r+', shape=(capacity, len(self.camera_names)))
+        self._WriteHeader()
+
+    def _ReleaseMemmaps(self):
+        if self.frames_memmaps is not None:
+            for frames_memmap in self.frames_memmaps:
+                frames_memmap.flush()
+            self.timestamps_memmap.flush()
+        self.frames_memmaps = None
+        self.timestamps_memmap = None
+
+    def _WriteHeader(self):
+        header = {
+            'format_version': format_version,
+            'camera_names': self.camera_names,
+            'image_shapeHWC': list(self.image_shapeHWC),
+            'dtype': self.dtype.str,
+            'number_of_frames': self.number_of_frames
+        }
+        # Replaced atomically, so that a recording killed during a flush keeps the previous header
+        temporary_filepath = os.path.join(self.directory, header_filename + ".tmp")
+        with open(temporary_filepath, 'w') as header_file:
+            json.dump(header, header_file, indent=2)
+        os.replace(temporary_filepath, os.path.join(self.directory, header_filename))
+
+    def Append(self, images, timestamps):
+        # timestamps: a list of datetime objects or epoch seconds, one per camera, or a single one for all the cameras
+        if len(images) != len(self.camera_names):
+            raise ValueError(f"RawSequenceWriter.Append(): len(images) ({len(images)}) != len(self.camera_names) ({len(self.camera_names)})")
+        if not isinstance(timestamps, (list, tuple)):
+            timestamps = [timestamps] * len(self.camera_names)
+        if self.frames_memmaps is None:
+            raise RuntimeError("RawSequenceWriter.Append(): The writer is closed")
+        if self.number_of_frames == self.capacity:
+            self._Allocate(2 * self.capacity)
+        for camera_ndx in range(len(images)):
+            if images[camera_ndx].shape != self.image_shapeHWC:
+                raise ValueError(f"RawSequenceWriter.Append(): images[{camera_ndx}].shape ({images[camera_ndx].shape}) != self.image_shapeHWC ({self.image_shapeHWC})")
+            self.frames_memmaps[camera_ndx][self.number_of_frames] = images[camera_ndx]
+            timestamp = timestamps[camera_ndx]
+            if isinstance(timestamp, datetime):
+                timestamp = timestamp.timestamp()
+            self.timestamps_memmap[self.number_of_frames, camera_ndx] = timestamp
+        self.number_of_frames += 1
+
+    def Flush(self):
+        for frames_memmap in self.frames_memmaps:
+            frames_memmap.flush()
+        self.timestamps_memmap.flush()
+        self._WriteHeader()
+
+    def Close(self):
+        if self.frames_memmaps is None:
+            return
+        self._ReleaseMemmaps()
+        # Trim the preallocated space
+        frame_nbytes = int(np.prod(self.image_shapeHWC)) * self.dtype.itemsize
+        for camera_name in self.camera_names:
+            with open(self._FramesFilepath(camera_name), 'r+b') as raw_file:
+                raw_file.truncate(self.number_of_frames * frame_nbytes)
+        with open(os.path.join(self.directory, timestamps_filename), 'r+b') as raw_file:
+            raw_file.truncate(self.number_of_frames * len(self.camera_names) * 8)
+        self.capacity = self.number_of_frames
+        self._WriteHeader()
+
+class RawSequenceReader():
+    def __init__(self, directory):
+        with open(os.path.join(directory, header_filename), 'r') as header_file:
+            header = json.load(header_file)
+        if header['format_version'] > format_version:
+            raise ValueError(f"RawSequenceReader.__init__(): The sequence format version ({header['format_version']}) is more recent than the supported version ({format_version})")
+        self.directory = directory
+        self.camera_names = header['camera_names']
+        self.image_shapeHWC = tuple(header['image_shapeHWC'])
+        self.dtype = np.dtype(header['dtype'])
+        self.number_of_frames = header['number_of_frames']
+        # np.asarray() drops the np.memmap subclass, but keeps the views on the mapped files
+        self.frames_arrs = []
+        self.timestamps_arr = np.zeros((0, len(self.camera_names)), dtype=np.float64)
+        if self.number_of_frames > 0:
+            self.frames_arrs = [np.asarray(np.memmap(os.path.join(directory, camera_name + ".raw"), dtype=self.dtype, mode='r',
+                                                     shape=(self.number_of_frames,) + self.image_shapeHWC))
+                                for camera_name in self.camera_names]
+            self.timestamps_arr = np.asarray(np.memmap(os.path.join(directory, timestamps_filename), dtype=np.float64, mode='r',
+                                                       shape=(self.number_of_frames, len(self.camera_names))))
+
+    def __len__(self):
+        return self.number_of_frames
+
+    def CameraIndex(self, camera_name):
+        if not camera_name in self.camera_names:
+            raise ValueError(f"RawSequenceReader.CameraIndex(): Camera '{camera_name}' is not in {self.camera_names}")
+        return self.camera_names.index(camera_name)
+
+    def Frame(self, camera_ndx, frame_ndx):
+        if frame_ndx < 0 or frame_ndx >= self.number_of_frames:
+            raise IndexError(f"RawSequenceReader.Frame(): frame_ndx ({frame_ndx}) is out of [0, {self.number_of_frames})")
+        return self.frames_arrs[camera_ndx][frame_ndx]
+
+    def Frames(self, frame_ndx):
+        return [self.Frame(camera_ndx, frame_ndx) for camera_ndx in range(len(self.camera_names))]
+
+    def Timestamps(self):
+        return self.timestamps_arr
+
+    def TimestampLabel(self, frame_ndx, camera_ndx=0):
+        return TimestampLabel(self.timestamps_arr[frame_ndx, camera_ndx])
+
+    def FrameIndexOfTimestamp(self, timestamp, camera_ndx=0):
+        # Index of the frame nearest to timestamp. The frames are in increasing timestamp order
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        elif isinstance(timestamp, str):
+            timestamp = ParseTimestampLabel(timestamp)
+        if self.number_of_frames == 0:
+            raise IndexError("RawSequenceReader.FrameIndexOfTimestamp(): The sequence is empty")
+        camera_timestamps_arr = self.timestamps_arr[:, camera_ndx]
+        ndx = int(np.searchsorted(camera_timestamps_arr, timestamp))
+        if ndx == self.number_of_frames or \
+                (ndx > 0 and timestamp - camera_timestamps_arr[ndx - 1] <= camera_timestamps_arr[ndx] - timestamp):
+            ndx -= 1
+        return ndx
+
+def ConvertPngSequence(images_filepath_prefix, camera_ID_list, output_directory):
+    # Convert the png files written by record.py, <images_filepath_prefix><camera_ID>_<timestamp>.png, to a raw sequence
+    images_directory = os.path.dirname(images_filepath_prefix)
+    first_camera_prefix = os.path.basename(images_filepath_prefix) + str(camera_ID_list[0]) + '_'
+    timestamp_labels = sorted([filename[len(first_camera_prefix): -4] for filename in os.listdir(images_directory)
+                               if filename.startswith(first_camera_prefix) and filename.upper().endswith('.PNG')],
+                              key=ParseTimestampLabel)
+    camera_names = [os.path.basename(images_filepath_prefix) + str(camera_ID) for camera_ID in camera_ID_list]
+    writer = None
+    for timestamp_label in timestamp_labels:
+        images = []
+        for camera_ID in camera_ID_list:
+            image_filepath = images_filepath_prefix + str(camera_ID) + '_' + timestamp_label + '.png'
+            image = cv2.imread(image_filepath)
+            if image is None:
+                raise FileNotFoundError(f"ConvertPngSequence(): Could not read file '{image_filepath}'")
+            images.append(image)
+        if writer is None:
+            writer = RawSequenceWriter(output_directory, camera_names, images[0].shape,
+                                       initial_capacity=max(len(timestamp_labels), 1))
+        writer.Append(images, ParseTimestampLabel(timestamp_label))
+    if writer is not None:
+        writer.Close()
+    return len(timestamp_labels)
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+
+manifest_version = 2
+extensions = ['.PNG']
+
+class SequenceIndex():
+    """
+    Index of an image sequence written as <images_filepath_prefix><camera_ID>_<timestamp>.png, one file per camera and
+    timestamp, as record.py does. With camera_ID_list = None, the files are <images_filepath_prefix><timestamp>.png.
+    It is built with a single os.scandir() pass, and can be saved as a json manifest, by default next to the images.
+    """
+    def __init__(self, images_filepath_prefix, camera_ID_list, timestamp_to_filenames):
+        self.images_filepath_prefix = images_filepath_prefix
+        self.camera_ID_list = list(camera_ID_list) if camera_ID_list is not None else None
+        # timestamp -> [filename of each camera, or None if missing]
+        self.timestamp_to_filenames = timestamp_to_filenames
+        self.images_directory = os.path.dirname(images_filepath_prefix)
+
+    def __len__(self):
+        return len(self.CompleteTimestamps())
+
+    def NumberOfCameras(self):
+        return 1 if self.camera_ID_list is None else len(self.camera_ID_list)
+
+    def CompleteTimestamps(self):
+        # The sorted timestamps for which every camera has a frame
+        return sorted([timestamp for timestamp, filenames in self.timestamp_to_filenames.items() if not None in filenames])
+
+    def Filepaths(self, timestamp):
+        return [os.path.join(self.images_directory, filename) if filename is not None else None
+                for filename in self.timestamp_to_filenames[timestamp]]
+
+    def TimestampToFilepaths(self):
+        return {timestamp: self.Filepaths(timestamp) for timestamp in self.CompleteTimestamps()}
+
+    def MissingFrames(self):
+        # timestamp -> list of the camera IDs whose frame is missing
+        camera_IDs = self.camera_ID_list if self.camera_ID_list is not None else [None]
+        return {timestamp: [camera_IDs[camera_ndx] for camera_ndx in range(len(filenames)) if filenames[camera_ndx] is None]
+                for timestamp, filenames in self.timestamp_to_filenames.items() if None in filenames}
+
+    def OrphanFilepaths(self):
+        # The frames whose timestamp is missing in at least one other camera
+        orphan_filepaths = []
+        for timestamp in sorted(self.MissingFrames().keys()):
+            orphan_filepaths += [filepath for filepath in self.Filepaths(timestamp) if filepath is not None]
+        return orphan_filepaths
+
+    def NewestFilesModificationTime(self):
+        # The latest modification time of the files of the newest timestamp, complete or not, or None if there is no file
+        if len(self.timestamp_to_filenames) == 0:
+            return None
+        return max(os.stat(filepath).st_mtime_ns for filepath in self.Filepaths(max(self.timestamp_to_filenames.keys()))
+                   if filepath is not None)
+
+    def Save(self, manifest_filepath=None):
+        if manifest_filepath is None:
+            manifest_filepath = DefaultManifestFilepath(self.images_filepath_prefix)
+        manifest = {
+            'manifest_version': manifest_version,
+            'images_directory': os.path.abspath(self.images_directory or '.'),
+            'images_filepath_prefix': os.path.basename(self.images_filepath_prefix),
+            'camera_ID_list': self.camera_ID_list,
+            'directory_mtime_ns': None,
+            'number_of_image_entries': _NumberOfImageEntries(self.images_filepath_prefix, self.camera_ID_list),
+            'newest_files_mtime_ns': self.NewestFilesModificationTime(),
+            'timestamp_to_filenames': self.timestamp_to_filenames
+        }
+        # Creating the manifest file changes the directory modification time, so it is recorded after the creation,
+        # and the file is rewritten in place
+        with open(manifest_filepath, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        manifest['directory_mtime_ns'] = os.stat(self.images_directory or '.').st_mtime_ns
+        with open(manifest_filepath, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+def DefaultManifestFilepath(images_filepath_prefix):
+    return images_filepath_prefix + "manifest.json"
+
+def BuildSequenceIndex(images_filepath_prefix, camera_ID_list=None):
+    camera_prefixes = _CameraPrefixes(images_filepath_prefix, camera_ID_list)
+    timestamp_to_filenames = {}
+    for filename, camera_ndx in _ScanImageFiles(images_filepath_prefix, camera_prefixes):
+        timestamp = filename[len(camera_prefixes[camera_ndx]): -4]
+        if not timestamp in timestamp_to_filenames:
+            timestamp_to_filenames[timestamp] = [None] * len(camera_prefixes)
+        timestamp_to_filenames[timestamp][camera_ndx] = filename
+    return SequenceIndex(images_filepath_prefix, camera_ID_list, timestamp_to_filenames)
+
+def _CameraPrefixes(images_filepath_prefix, camera_ID_list):
+    filename_prefix = os.path.basename(images_filepath_prefix)
+    if camera_ID_list is None:
+        return [filename_prefix]
+    return [filename_prefix + str(camera_ID) + '_' for camera_ID in camera_ID_list]
+
+def _ScanImageFiles(images_filepath_prefix, camera_prefixes):
+    # Yields (filename, camera index) for each image file of the sequence, with a single os.scandir() pass
+    filename_prefix = os.path.basename(images_filepath_prefix)
+    with os.scandir(os.path.dirname(images_filepath_prefix) or '.') as directory_entries:
+        for directory_entry in directory_entries:
+            filename = directory_entry.name
+            if not filename.upper()[-4:] in extensions or not filename.startswith(filename_prefix):
+                continue
+            for camera_ndx in range(len(camera_prefixes)):
+                if filename.startswith(camera_prefixes[camera_ndx]) and directory_entry.is_file():
+                    yield filename, camera_ndx
+                    break
+
+def _NumberOfImageEntries(images_filepath_prefix, camera_ID_list):
+    # The number of directory entries named like the images. It only costs a directory listing, without the file type
+    # checks and the parsing of a build
+    camera_prefixes = tuple(_CameraPrefixes(images_filepath_prefix, camera_ID_list))
+    return sum(1 for filename in os.listdir(os.path.dirname(images_filepath_prefix) or '.')
+               if filename.startswith(camera_prefixes) and filename[-4:].upper() in extensions)
+
+def LoadSequenceIndex(manifest_filepath, images_filepath_prefix, camera_ID_list=None):
+    """
+    Returns None if the manifest does not exist, does not match the request, or is stale. The directory modification
+    time changes whenever a file is added or removed. The number of entries named like the images catches the changes
+    hidden by a restored or coarse directory modification time, and the modification time of the files of the newest
+    timestamp catches their overwriting.
+    """
+    if not os.path.isfile(manifest_filepath):
+        return None
+    with open(manifest_filepath, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    images_directory = os.path.dirname(images_filepath_prefix)
+    if manifest.get('manifest_version') != manifest_version or \
+            manifest['images_directory'] != os.path.abspath(images_directory or '.') or \
+            manifest['images_filepath_prefix'] != os.path.basename(images_filepath_prefix) or \
+            manifest['camera_ID_list'] != (list(camera_ID_list) if camera_ID_list is not None else None) or \
+            manifest['directory_mtime_ns'] != os.stat(images_directory or '.').st_mtime_ns:
+        return None
+    sequence_index = SequenceIndex(images_filepath_prefix, camera_ID_list, manifest['timestamp_to_filenames'])
+    if _NumberOfImageEntries(images_filepath_prefix, camera_ID_list) != manifest['number_of_image_entries']:
+        return None
+    try:
+        if sequence_index.NewestFilesModificationTime() != manifest['newest_files_mtime_ns']:
+            return None
+    except FileNotFoundError:
+        return None
+    return sequence_index
+
+def LoadOrBuildSequenceIndex(images_filepath_prefix, camera_ID_list=None, manifest_filepath=None, save_manifest=True, rebuild=False):
+    # The manifest is written at manifest_filepath, by default next to the images. With rebuild, the manifest is not read
+    if manifest_filepath is None:
+        manifest_filepath = DefaultManifestFilepath(images_filepath_prefix)
+    if not rebuild:
+        sequence_index = LoadSequenceIndex(manifest_filepath, images_filepath_prefix, camera_ID_list)
+        if sequence_index is not None:
+            return sequence_index
+    sequence_index = BuildSequenceIndex(images_filepath_prefix, camera_ID_list)
+    if save_manifest:
+        try:
+            sequence_index.Save(manifest_filepath)
+        except OSError as error:
+            logging.warning(f"LoadOrBuildSequenceIndex(): Could not save the manifest '{manifest_filepath}': {error}")
+    return sequence_index
@@ -0,0 +1,98 @@
+import collections
+import numpy as np
+
+class FrameSynchronizer():
+    """
+    Pairs frames across cameras by nearest capture timestamp.
+    Frames are pushed per camera, in increasing timestamp order. Pop() returns a set of frames, one per camera, whose
+    timestamps are all within tolerance of each other. A frame that cannot be part of such a set is dropped.
+    timestamp_offsets, if given, are subtracted from each camera's timestamps before matching, to compensate for
+    known differences in camera latency.
+    """
+    def __init__(self, number_of_cameras, tolerance=0.010, maximum_queue_length=30, skew_history_length=10000,
+                 timestamp_offsets=None):
+        if number_of_cameras < 2:
+            raise ValueError(f"FrameSynchronizer.__init__(): number_of_cameras ({number_of_cameras}) < 2")
+        if tolerance < 0:
+            raise ValueError(f"FrameSynchronizer.__init__(): tolerance ({tolerance}) < 0")
+        if timestamp_offsets is not None and len(timestamp_offsets) != number_of_cameras:
+            raise ValueError(f"FrameSynchronizer.__init__(): len(timestamp_offsets) ({len(timestamp_offsets)}) != number_of_cameras ({number_of_cameras})")
+        self.number_of_cameras = number_of_cameras
+        self.timestamp_offsets = timestamp_offsets if timestamp_offsets is not None else [0.0] * number_of_cameras
+        self.tolerance = tolerance
+        self.maximum_queue_length = maximum_queue_length
+        self.queues = [collections.deque() for _ in range(number_of_cameras)]
+        self.matched_count = 0
+        self.dropped_counts = [0] * number_of_cameras
+        self.skews = collections.deque(maxlen=skew_history_length)
+
+    def Push(self, camera_ndx, timestamp, image):
+        queue = self.queues[camera_ndx]
+        timestamp = timestamp - self.timestamp_offsets[camera_ndx]
+        if len(queue) > 0 and timestamp < queue[-1][0]:
+            raise ValueError(f"FrameSynchronizer.Push(): timestamp ({timestamp}) < last timestamp of camera {camera_ndx} ({queue[-1][0]})")
+        queue.append((timestamp, image))
+        if len(queue) > self.maximum_queue_length:
+            queue.popleft()
+            self.dropped_counts[camera_ndx] += 1
+
+    def PushFrames(self, timestampImage_lists):
+        for camera_ndx in range(len(timestampImage_lists)):
+            for timestamp, image in timestampImage_lists[camera_ndx]:
+                self.Push(camera_ndx, timestamp, image)
+
+    def Pop(self):
+        """
+        Returns (timestamps, images) for the next synchronized set, or None if no set can be decided yet.
+        The latest queue head is the pivot: every camera advances to its frame nearest to the pivot. A camera whose
+        head precedes the pivot and has no next frame yet may still receive a nearer frame, so the decision waits.
+        """
+        while True:
+            if any(len(queue) == 0 for queue in self.queues):
+                return None
+            pivot = max(queue[0][0] for queue in self.queues)
+            has_advanced = False
+            for camera_ndx in range(self.number_of_cameras):
+                queue = self.queues[camera_ndx]
+                while len(queue) > 1 and abs(queue[1][0] - pivot) <= abs(queue[0][0] - pivot):
+                    queue.popleft()
+                    self.dropped_counts[camera_ndx] += 1
+                    has_advanced = True
+            if has_advanced:
+                continue
+            if any(len(queue) == 1 and queue[0][0] < pivot for queue in self.queues):
+                return None
+            heads = [queue[0][0] for queue in self.queues]
+            earliest_camera_ndx = int(np.argmin(heads))
+            skew = pivot - heads[earliest_camera_ndx]
+            if skew <= self.tolerance:
+                timestamps = []
+                images = []
+                for camera_ndx in range(self.number_of_cameras):
+                    timestamp, image = self.queues[camera_ndx].popleft()
+                    timestamps.append(timestamp + self.timestamp_offsets[camera_ndx])
+                    images.append(image)
+                self.matched_count += 1
+                self.skews.append(skew)
+                return timestamps, images
+            # The earliest frame has no counterpart within tolerance in the other cameras
+            self.queues[earliest_camera_ndx].popleft()
+            self.dropped_counts[earliest_camera_ndx] += 1
+
+    def PopAll(self):
+        synchronized_sets = []
+        synchronized_set = self.Pop()
+        while synchronized_set is not None:
+            synchronized_sets.append(synchronized_set)
+            synchronized_set = self.Pop()
+        return synchronized_sets
+
+    def Statistics(self):
+        statistics = {'matched': self.matched_count, 'dropped': list(self.dropped_counts)}
+        if len(self.skews) > 0:
+            skews_arr = np.array(self.skews)
+            statistics['skew_mean'] = float(np.mean(skews_arr))
+            statistics['skew_median'] = float(np.median(skews_arr))
+            statistics['skew_p95'] = float(np.percentile(skews_arr, 95))
+            statistics['skew_max'] = float(np.max(skews_arr))
+        return statistics
@@ -0,0 +1,189 @@
+import cv2
+import numpy as np
+import time
+from stereo_vision.projection import ProjectionMatrix
+
+class SyntheticCamera():
+    """
+    Stand-in for cv2.VideoCapture, without hardware. Frames are produced at a nominal rate, each one delayed by a
+    fixed latency plus a random jitter. grab() blocks until the next frame is available, like a real camera.
+    The frame number is drawn in the image, and the nominal exposure time of the last grabbed frame is kept in
+    last_exposure_time (time.monotonic() clock), to measure the true synchronization error.
+    """
+    def __init__(self, image_sizeHW=(480, 640), fps=30.0, latency=0.0, jitter_std=0.0, phase=0.0, seed=None):
+        if fps <= 0:
+            raise ValueError(f"SyntheticCamera.__init__(): fps ({fps}) <= 0")
+        self.image_sizeHW = image_sizeHW
+        self.fps = fps
+        self.latency = latency
+        self.jitter_std = jitter_std
+        self.phase = phase
+        self.rng = np.random.default_rng(seed)
+        self.start_time = time.monotonic()
+        self.frame_number = -1
+        self.last_exposure_time = None
+        self.is_opened = True
+
+    def isOpened(self):
+        return self.is_opened
+
+    def release(self):
+        self.is_opened = False
+
+    def set(self, property_id, value):
+        if property_id == cv2.CAP_PROP_FPS:
+            self.fps = value
+            return True
+        return False
+
+    def get(self, property_id):
+        if property_id == cv2.CAP_PROP_FPS:
+            return self.fps
+        elif property_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.image_sizeHW[0]
+        elif property_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.image_sizeHW[1]
+        return 0
+
+    def grab(self):
+        if not self.is_opened:
+            return False
+        now = time.monotonic()
+        # Skip the frames whose exposure time is already past, like a camera with a buffer size of 1
+        next_frame_number = max(self.frame_number + 1, int(np.floor((now - self.start_time - self.phase) * self.fps)))
+        exposure_time = self.start_time + self.phase + next_frame_number / self.fps
+        jitter = abs(self.rng.normal(0, self.jitter_std)) if self.jitter_std > 0 else 0.0
+        delivery_time = exposure_time + self.latency + jitter
+        if delivery_time > now:
+            time.sleep(delivery_time - now)
+        self.frame_number = next_frame_number
+        self.last_exposure_time = exposure_time
+        return True
+
+    def retrieve(self, image=None, flag=0):
+        if not self.is_opened or self.frame_number < 0:
+            return False, None
+        image = np.full((self.image_sizeHW[0], self.image_sizeHW[1], 3), (self.frame_number * 7) % 256, dtype=np.uint8)
+        cv2.putText(image, str(self.frame_number), (10, self.image_sizeHW[0] // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0, (0, 0, 255), thickness=2)
+        return True, image
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+class FileCamera():
+    """
+    Stand-in for cv2.VideoCapture, that plays back recorded frames: a list of image filepaths, or one camera of a
+    raw_sequence.RawSequenceReader. The frames are delivered at fps frames per second, or as fast as they are requested
+    if fps is None. At the end of the recording, grab() fails, like a video file, unless loop is True.
+    With preload, the image files are decoded once in the constructor, so that the playback does not include the
+    decoding time.
+    """
+    def __init__(self, image_filepaths=None, sequence_reader=None, camera_ndx=0, fps=30.0, loop=False, preload=True):
+        if (image_filepaths is None) == (sequence_reader is None):
+            raise ValueError("FileCamera.__init__(): Exactly one of image_filepaths and sequence_reader must be specified")
+        if fps is not None and fps <= 0:
+            raise ValueError(f"FileCamera.__init__(): fps ({fps}) <= 0")
+        self.image_filepaths = image_filepaths
+        self.sequence_reader = sequence_reader
+        self.camera_ndx = camera_ndx
+        self.fps = fps
+        self.loop = loop
+        self.images = None
+        if image_filepaths is not None:
+            self.number_of_frames = len(image_filepaths)
+            if preload:
+                self.images = [cv2.imread(image_filepath) for image_filepath in image_filepaths]
+        else:
+            self.number_of_frames = len(sequence_reader)
+        if self.number_of_frames == 0:
+            raise ValueError("FileCamera.__init__(): The recording has no frame")
+        self.start_time = None
+        self.frame_number = -1
+        self.has_frame = False
+        self.last_exposure_time = None
+        self.is_opened = True
+
+    def isOpened(self):
+        return self.is_opened
+
+    def release(self):
+        self.is_opened = False
+
+    def set(self, property_id, value):
+        if property_id == cv2.CAP_PROP_FPS:
+            self.fps = value
+            return True
+        return False
+
+    def get(self, property_id):
+        if property_id == cv2.CAP_PROP_FPS:
+            return self.fps if self.fps is not None else 0
+        elif property_id == cv2.CAP_PROP_FRAME_COUNT:
+            return self.number_of_frames
+        elif property_id == cv2.CAP_PROP_POS_FRAMES:
+            return self.frame_number + 1
+        return 0
+
+    def grab(self):
+        if not self.is_opened:
+            return False
+        if self.frame_number + 1 >= self.number_of_frames and not self.loop:
+            self.has_frame = False  # Like a video file, nothing can be retrieved after the end
+            return False
+        now = time.monotonic()
+        if self.start_time is None:
+            self.start_time = now
+        self.frame_number += 1
+        if self.fps is not None:
+            # Paced playback: the frames are not skipped, so a slow reader gets behind the nominal rate
+            exposure_time = self.start_time + self.frame_number / self.fps
+            if exposure_time > now:
+                time.sleep(exposure_time - now)
+            self.last_exposure_time = exposure_time
+        else:
+            self.last_exposure_time = now
+        self.has_frame = True
+        return True
+
+    def retrieve(self, image=None, flag=0):
+        if not self.is_opened or not self.has_frame:
+            return False, None
+        frame_ndx = self.frame_number % self.number_of_frames
+        if self.images is not None:
+            return True, self.images[frame_ndx]
+        if self.sequence_reader is not None:
+            return True, self.sequence_reader.Frame(self.camera_ndx, frame_ndx)
+        return True, cv2.imread(self.image_filepaths[frame_ndx])
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+def SyntheticProjectionMatrix(focal_length=800.0, image_sizeHW=(480, 640), camera_position=(5.0, -3.0, 10.0),
+                              rotation_vector=(0.05, -0.03, 0.02)):
+    # Pinhole camera looking along -Z, like in the calibration setup where the pattern is at negative Z.
+    # The matrix is scaled so that matrix[2, 3] = 1, like ProjectionMatrix.Create()
+    K = np.array([[focal_length, 0, image_sizeHW[1] / 2], [0, focal_length, image_sizeHW[0] / 2], [0, 0, 1]])
+    rotation_vector = np.array(rotation_vector)
+    angle = np.linalg.norm(rotation_vector)
+    axis_cross = np.array([[0, -rotation_vector[2], rotation_vector[1]], [rotation_vector[2], 0, -rotation_vector[0]],
+                           [-rotation_vector[1], rotation_vector[0], 0]]) / angle
+    R = (np.eye(3) + np.sin(angle) * axis_cross + (1 - np.cos(angle)) * axis_cross @ axis_cross) @ np.diag([1.0, -1.0, -1.0])
+    t = -R @ np.array(camera_position)
+    matrix = K @ np.hstack([R, t[:, None]])
+    projection_matrix = ProjectionMatrix()
+    projection_matrix.matrix = matrix / matrix[2, 3]
+    return projection_matrix
+
+def SyntheticCorrespondences(projection_matrix, number_of_correspondences, noise_std, rng, Z_range=(-120, -60), XY_half_range=30):
+    # 3D points in front of the camera, and their noisy projections, as [((x, y), (X, Y, Z)), ...]
+    XYZ_arr = np.column_stack([rng.uniform(-XY_half_range, XY_half_range, number_of_correspondences),
+                               rng.uniform(-XY_half_range, XY_half_range, number_of_correspondences),
+                               rng.uniform(Z_range[0], Z_range[1], number_of_correspondences)])
+    projections = np.hstack([XYZ_arr, np.ones((number_of_correspondences, 1))]) @ projection_matrix.matrix.T
+    xy_arr = projections[:, 0:2] / projections[:, 2:3] + rng.normal(0, noise_std, (number_of_correspondences, 2))
+    return [(tuple(xy_arr[ndx]), tuple(XYZ_arr[ndx])) for ndx in range(number_of_correspondences)]
@@ -0,0 +1,138 @@
+import numpy as np
+
+class TrajectoryFilter():
+    def __init__(self, number_of_targets=1, model='constant_velocity', process_noise=1000.0, measurement_noise=1.0,
+                 gating_threshold=16.27, maximum_number_of_predicted_frames=10, initial_velocity_std=100.0):
+        """
+        Kalman filter of the 3D positions of number_of_targets targets, all updated together with stacked matrix products.
+        model: 'constant_velocity' (state: position, velocity) or 'constant_acceleration' (state: position, velocity,
+        acceleration). process_noise: The spectral density of the white noise on the highest derivative of the state, in
+        (length unit)^2 / s^3 for the velocity model, or / s^5 for the acceleration model. measurement_noise: The standard
+        deviation of the triangulated positions, in length unit.
+        A measurement whose squared Mahalanobis distance to the prediction is above gating_threshold (default: chi-square,
+        3 degrees of freedom, 99.9 %) is rejected as an outlier. Without an accepted measurement, a target coasts on its
+        prediction for up to maximum_number_of_predicted_frames frames, after which it is reset, and re-initialized by
+        its next measurement.
+        """
+        if model == 'constant_velocity':
+            self.number_of_derivatives = 2
+        elif model == 'constant_acceleration':
+            self.number_of_derivatives = 3
+        else:
+            raise ValueError(f"TrajectoryFilter.__init__(): Unknown model '{model}'")
+        self.number_of_targets = number_of_targets
+        self.model = model
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.gating_threshold = gating_threshold
+        self.maximum_number_of_predicted_frames = maximum_number_of_predicted_frames
+        self.initial_velocity_std = initial_velocity_std
+        self.state_dimension = 3 * self.number_of_derivatives
+        self.H = np.zeros((3, self.state_dimension))
+        self.H[:, 0:3] = np.eye(3)
+        self.R = measurement_noise**2 * np.eye(3)
+        self.Reset()
+
+    def Reset(self):
+        self.states = np.zeros((self.number_of_targets, self.state_dimension))
+        self.covariances = np.tile(np.eye(self.state_dimension), (self.number_of_targets, 1, 1))
+        self.is_initialized = np.zeros(self.number_of_targets, dtype=bool)
+        self.number_of_predicted_frames = np.zeros(self.number_of_targets, dtype=int)
+        self.last_timestamp = None
+        self.accepted_count = 0
+        self.rejected_count = 0
+        self.predicted_count = 0
+
+    def TransitionMatrices(self, dt):
+        # The state transition F and the process noise covariance Q, for a time step dt
+        F1 = np.eye(self.number_of_derivatives)
+        Q1 = np.zeros((self.number_of_derivatives, self.number_of_derivatives))
+        if self.number_of_derivatives == 2:
+            F1[0, 1] = dt
+            Q1[:] = [[dt**3 / 3, dt**2 / 2], [dt**2 / 2, dt]]
+        else:
+            F1[0, 1] = F1[1, 2] = dt
+            F1[0, 2] = dt**2 / 2
+            Q1[:] = [[dt**5 / 20, dt**4 / 8, dt**3 / 6], [dt**4 / 8, dt**3 / 3, dt**2 / 2], [dt**3 / 6, dt**2 / 2, dt]]
+        # The state is ordered by derivative, then by axis: (X, Y, Z, VX, VY, VZ, ...)
+        return np.kron(F1, np.eye(3)), self.process_noise * np.kron(Q1, np.eye(3))
+
+    def Update(self, timestamp, measurements_arr):
+        """
+        Processes one frame. measurements_arr: The (number_of_targets, 3) triangulated positions, with NaN rows for the
+        targets that were not measured. timestamp: The frame time, in seconds.
+        Returns the (number_of_targets, 3) filtered positions, NaN for the targets that are not tracked, and the
+        (number_of_targets,) mask of the accepted measurements.
+        """
+        measurements_arr = np.asarray(measurements_arr, dtype=float).reshape(self.number_of_targets, 3)
+        dt = 0.0 if self.last_timestamp is None else timestamp - self.last_timestamp
+        self.last_timestamp = timestamp
+        F, Q = self.TransitionMatrices(dt)
+        # Prediction
+        self.states = self.states @ F.T
+        self.covariances = F @ self.covariances @ F.T + Q
+
+        # Gating of the measured, initialized targets
+        is_measured = np.all(np.isfinite(measurements_arr), axis=1)
+        innovations = np.where(is_measured[:, None], measurements_arr, 0) - self.states[:, 0:3]
+        S = self.covariances[:, 0:3, 0:3] + self.R  # H P H^T + R
+        S_inv = np.linalg.inv(S)
+        mahalanobis_distances = np.einsum('ti,tij,tj->t', innovations, S_inv, innovations)
+        is_accepted = is_measured & self.is_initialized & (mahalanobis_distances <= self.gating_threshold)
+        self.rejected_count += int(np.count_nonzero(is_measured & self.is_initialized & ~is_accepted))
+
+        # Correction of the accepted targets: K = P H^T S^-1, x += K y, P = (I - K H) P
+        K = self.covariances[is_accepted][:, :, 0:3] @ S_inv[is_accepted]
+        self.states[is_accepted] += np.einsum('tij,tj->ti', K, innovations[is_accepted])
+        self.covariances[is_accepted] -= K @ self.covariances[is_accepted][:, 0:3, :]
+        self.number_of_predicted_frames[is_accepted] = 0
+        self.accepted_count += int(np.count_nonzero(is_accepted))
+
+        # Coasting, and reset of the targets that were predicted for too long
+        is_coasting = self.is_initialized & ~is_accepted
+        self.number_of_predicted_frames[is_coasting] += 1
+        self.predicted_count += int(np.count_nonzero(is_coasting))
+        self.is_initialized[self.number_of_predicted_frames > self.maximum_number_of_predicted_frames] = False
+
+        # Initialization of the measured targets that are not tracked
+        is_new = is_measured & ~self.is_initialized
+        if np.any(is_new):
+            self.states[is_new] = 0
+            self.states[is_new, 0:3] = measurements_arr[is_new]
+            initial_stds = np.full(self.state_dimension, self.initial_velocity_std)
+            initial_stds[0:3] = self.measurement_noise
+            self.covariances[is_new] = np.diag(initial_stds**2)
+            self.is_initialized[is_new] = True
+            self.number_of_predicted_frames[is_new] = 0
+            is_accepted |= is_new
+        return self.Positions(), is_accepted
+
+    def Positions(self):
+        positions = self.states[:, 0:3].copy()
+        positions[~self.is_initialized] = np.nan
+        return positions
+
+    def PredictedPositions(self, dt):
+        # The (number_of_targets, 3) positions predicted dt seconds after the last update, without changing the state
+        F, _ = self.TransitionMatrices(dt)
+        positions = (self.states @ F.T)[:, 0:3]
+        positions[~self.is_initialized] = np.nan
+        return positions
+
+    def PredictedImagePoints(self, projection_matrices_list, dt):
+        """
+        The predicted image position of the targets in each camera, dt seconds after the last update, to center the
+        detector search windows. Returns a list of (number_of_targets, 2) arrays, one per camera, with NaN for the
+        targets that are not tracked or that are predicted behind the camera.
+        """
+        positions = self.PredictedPositions(dt)
+        is_tracked = self.is_initialized
+        image_points_list = []
+        for projection_matrix in projection_matrices_list:
+            image_points = np.full((self.number_of_targets, 2), np.nan)
+            image_points[is_tracked], _ = projection_matrix.ProjectPoints(positions[is_tracked])
+            image_points_list.append(image_points)
+        return image_points_list
+
+    def Statistics(self):
+        return {'accepted': self.accepted_count, 'rejected': self.rejected_count, 'predicted': self.predicted_count}
@@ -0,0 +1,173 @@
+import cv2
+import hashlib
+import numpy as np
+import os
+from stereo_vision import instrumentation
+
+maps_format_version = 1
+
+@instrumentation.Timed()
+def UndistortPoints(radial_distortion, points_arr, invalid_value=-1):
+    """
+    Undistorts an (N, 2) array of (x, y) points with a radial distortion model, i.e. an object with a
+    UndistortPoint(point) method, like camera_distortion_calibration.radial_distortion.RadialDistortion.
+    Points whose both coordinates are invalid_value, the value written by the detectors when they found nothing,
+    give NaN.
+    """
+    points_arr = np.asarray(points_arr, dtype=float)
+    if points_arr.ndim != 2 or points_arr.shape[1] != 2:
+        raise ValueError(f"UndistortPoints(): points_arr.shape ({points_arr.shape}) != (N, 2)")
+    undistorted_points_arr = np.full(points_arr.shape, np.nan)
+    is_valid = ~np.all(points_arr == invalid_value, axis=1) & np.all(np.isfinite(points_arr), axis=1)
+    for point_ndx in np.flatnonzero(is_valid):
+        undistorted_points_arr[point_ndx] = radial_distortion.UndistortPoint(points_arr[point_ndx])
+    return undistorted_points_arr
+
+class UndistortionMaps():
+    def __init__(self, grid_x, grid_y, stride, image_sizeHW, map_x=None, map_y=None):
+        """
+        grid_x, grid_y: The undistorted coordinates of the distorted pixels (k * stride, l * stride), sampled with the
+        distortion model, (grid_height, grid_width) arrays. The points are undistorted by bilinear interpolation in this
+        grid. map_x, map_y: The (H, W) float32 maps for cv2.remap(), i.e. the distorted position of each undistorted
+        pixel. They are computed on the first call to RemapMaps(), if not provided.
+        """
+        if grid_x.shape != grid_y.shape or grid_x.ndim != 2:
+            raise ValueError(f"UndistortionMaps.__init__(): grid_x.shape ({grid_x.shape}) != grid_y.shape ({grid_y.shape})")
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.stride = stride
+        self.image_sizeHW = tuple(image_sizeHW)
+        self.map_x = map_x
+        self.map_y = map_y
+
+    @instrumentation.Timed()
+    def UndistortPoints(self, points_arr, invalid_value=-1):
+        # Same interface as UndistortPoints(). The points outside the image are linearly extrapolated from the border cells
+        points_arr = np.asarray(points_arr, dtype=float)
+        if points_arr.ndim != 2 or points_arr.shape[1] != 2:
+            raise ValueError(f"UndistortionMaps.UndistortPoints(): points_arr.shape ({points_arr.shape}) != (N, 2)")
+        undistorted_points_arr = np.full(points_arr.shape, np.nan)
+        is_valid = ~np.all(points_arr == invalid_value, axis=1) & np.all(np.isfinite(points_arr), axis=1)
+        undistorted_points_arr[is_valid, 0] = _BilinearLookup(self.grid_x, self.stride, points_arr[is_valid, 0], points_arr[is_valid, 1])
+        undistorted_points_arr[is_valid, 1] = _BilinearLookup(self.grid_y, self.stride, points_arr[is_valid, 0], points_arr[is_valid, 1])
+        return undistorted_points_arr
+
+    def RemapMaps(self, fixed_point=False, number_of_iterations=20, tolerance=0.01):
+        """
+        Returns the maps for cv2.remap(): (map_x, map_y) float32, or the (CV_16SC2, CV_16UC1) pair of cv2.convertMaps()
+        if fixed_point. The distorted position p of an undistorted pixel u solves U(p) = u, with U the interpolated
+        undistortion. It is found by the fixed-point iteration p <- p + u - U(p), for all the pixels at once. The pixels
+        that did not converge within tolerance are mapped outside the source image.
+        """
+        if self.map_x is None:
+            u, v = np.meshgrid(np.arange(self.image_sizeHW[1], dtype=float), np.arange(self.image_sizeHW[0], dtype=float))
+            u = u.ravel()
+            v = v.ravel()
+            x = u.copy()
+            y = v.copy()
+            for iteration_ndx in range(number_of_iterations):
+                delta_x = u - _BilinearLookup(self.grid_x, self.stride, x, y)
+                delta_y = v - _BilinearLookup(self.grid_y, self.stride, x, y)
+                x += delta_x
+                y += delta_y
+                if max(np.max(np.abs(delta_x), initial=0), np.max(np.abs(delta_y), initial=0)) < 1e-3 * tolerance:
+                    break
+            has_converged = (np.abs(delta_x) < tolerance) & (np.abs(delta_y) < tolerance)
+            x[~has_converged] = -1
+            y[~has_converged] = -1
+            self.map_x = x.reshape(self.image_sizeHW).astype(np.float32)
+            self.map_y = y.reshape(self.image_sizeHW).astype(np.float32)
+        if fixed_point:
+            return cv2.convertMaps(self.map_x, self.map_y, cv2.CV_16SC2)
+        return self.map_x, self.map_y
+
+    def UndistortImage(self, image, interpolation=cv2.INTER_LINEAR, fixed_point=False):
+        if image.shape[0:2] != self.image_sizeHW:
+            raise ValueError(f"UndistortionMaps.UndistortImage(): image.shape[0:2] ({image.shape[0:2]}) != self.image_sizeHW ({self.image_sizeHW})")
+        map1, map2 = self.RemapMaps(fixed_point)
+        return cv2.remap(image, map1, map2, interpolation, borderMode=cv2.BORDER_CONSTANT)
+
+    def Save(self, filepath, fingerprint='', include_remap_maps=False):
+        # The remap maps, only needed to undistort images, are saved if they were computed, or computed if include_remap_maps
+        arrays = {'grid_x': self.grid_x, 'grid_y': self.grid_y, 'stride': self.stride, 'image_sizeHW': self.image_sizeHW,
+                  'fingerprint': fingerprint}
+        if include_remap_maps or self.map_x is not None:
+            arrays['map_x'], arrays['map_y'] = self.RemapMaps()
+        temporary_filepath = filepath + ".tmp.npz"
+        np.savez(temporary_filepath, **arrays)
+        os.replace(temporary_filepath, filepath)
+
+def BuildUndistortionMaps(radial_distortion, image_sizeHW, stride=8):
+    # Samples the distortion model on a grid that covers the image, with a node spacing of stride pixels
+    grid_xs = np.arange(0, image_sizeHW[1] - 1 + stride, stride)
+    grid_ys = np.arange(0, image_sizeHW[0] - 1 + stride, stride)
+    grid_x = np.empty((len(grid_ys), len(grid_xs)))
+    grid_y = np.empty((len(grid_ys), len(grid_xs)))
+    for row in range(len(grid_ys)):
+        for column in range(len(grid_xs)):
+            grid_x[row, column], grid_y[row, column] = radial_distortion.UndistortPoint((grid_xs[column], grid_ys[row]))
+    return UndistortionMaps(grid_x, grid_y, stride, image_sizeHW)
+
+def LoadUndistortionMaps(filepath):
+    # Returns the maps and the fingerprint they were saved with
+    with np.load(filepath) as maps_file:
+        has_remap_maps = 'map_x' in maps_file.files
+        return UndistortionMaps(maps_file['grid_x'], maps_file['grid_y'], int(maps_file['stride']), tuple(maps_file['image_sizeHW']),
+                                maps_file['map_x'] if has_remap_maps else None, maps_file['map_y'] if has_remap_maps else None), \
+            str(maps_file['fingerprint'])
+
+def LoadOrBuildUndistortionMaps(radial_distortion, image_sizeHW, cache_directory, stride=8, include_remap_maps=False):
+    """
+    The maps are cached in cache_directory, typically the directory of the calibration, in a file named after the
+    fingerprint of the model parameters, the image size and the stride: a change in any of them builds new maps.
+    The remap maps, for UndistortImage(), take a few seconds to compute for a large image: they are only computed, and
+    cached, with include_remap_maps. Otherwise, they are computed on the first call to RemapMaps().
+    """
+    fingerprint = ModelFingerprint(radial_distortion, image_sizeHW, stride)
+    cache_filepath = os.path.join(cache_directory, f"undistortion_{fingerprint[0:16]}.npz")
+    if os.path.isfile(cache_filepath):
+        undistortion_maps, cached_fingerprint = LoadUndistortionMaps(cache_filepath)
+        if cached_fingerprint == fingerprint:
+            if include_remap_maps and undistortion_maps.map_x is None:
+                undistortion_maps.Save(cache_filepath, fingerprint, include_remap_maps)
+            return undistortion_maps
+    undistortion_maps = BuildUndistortionMaps(radial_distortion, image_sizeHW, stride)
+    if not os.path.exists(cache_directory):
+        os.makedirs(cache_directory)
+    undistortion_maps.Save(cache_filepath, fingerprint, include_remap_maps)
+    return undistortion_maps
+
+def ModelFingerprint(radial_distortion, image_sizeHW, stride):
+    # SHA-1 of the model class and attributes, the image size, the stride and the maps format version
+    hasher = hashlib.sha1()
+    _HashValue(hasher, (maps_format_version, type(radial_distortion).__module__, type(radial_distortion).__qualname__,
+                        vars(radial_distortion), tuple(image_sizeHW), stride))
+    return hasher.hexdigest()
+
+def _HashValue(hasher, value):
+    if isinstance(value, np.ndarray):
+        hasher.update(f"ndarray{value.dtype.str}{value.shape}".encode('utf-8'))
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        hasher.update(b"dict")
+        for key in sorted(value.keys(), key=str):
+            _HashValue(hasher, key)
+            _HashValue(hasher, value[key])
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f"{type(value).__name__}{len(value)}".encode('utf-8'))
+        for element in value:
+            _HashValue(hasher, element)
+    else:
+        hasher.update(repr(value).encode('utf-8'))
+
+def _BilinearLookup(grid, stride, x, y):
+    # Bilinear interpolation of the grid at the pixel coordinates (x, y). Beyond the grid, the border cells extrapolate
+    column_coordinates = x / stride
+    row_coordinates = y / stride
+    columns = np.clip(np.floor(column_coordinates).astype(int), 0, grid.shape[1] - 2)
+    rows = np.clip(np.floor(row_coordinates).astype(int), 0, grid.shape[0] - 2)
+    fx = column_coordinates - columns
+    fy = row_coordinates - rows
+    top = grid[rows, columns] * (1 - fx) + grid[rows, columns + 1] * fx
+    bottom = grid[rows + 1, columns] * (1 - fx) + grid[rows + 1, columns + 1] * fx
+    return top * (1 - fy) + bottom * fy
@@ -0,0 +1,46 @@
+import logging
+import argparse
+import time
+import numpy as np
+from stereo_vision.synthetic_camera import SyntheticProjectionMatrix
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        numberOfPoints,
+        numberOfLoopPoints
+):
+    logging.info("benchmark_project_points.main()")
+
+    projection_matrix = SyntheticProjectionMatrix()
+    rng = np.random.default_rng(0)
+    points_arr = np.column_stack([rng.uniform(-30, 30, numberOfPoints), rng.uniform(-30, 30, numberOfPoints),
+                                  rng.uniform(-120, -60, numberOfPoints)])
+
+    # Project() is timed on a subset, and extrapolated
+    start_time = time.perf_counter()
+    loop_xy_list = [projection_matrix.Project(points_arr[point_ndx]) for point_ndx in range(numberOfLoopPoints)]
+    loop_duration = (time.perf_counter() - start_time) * numberOfPoints / numberOfLoopPoints
+
+    xy_arr = np.empty((numberOfPoints, 2))
+    valid_mask = np.empty(numberOfPoints, dtype=bool)
+    projection_matrix.ProjectPoints(points_arr, out=xy_arr, valid_mask_out=valid_mask)  # Warm up
+    start_time = time.perf_counter()
+    projection_matrix.ProjectPoints(points_arr, out=xy_arr, valid_mask_out=valid_mask)
+    batch_duration = time.perf_counter() - start_time
+
+    maximum_difference = np.max(np.abs(xy_arr[0: numberOfLoopPoints] - np.array(loop_xy_list)))
+    logging.info(f"{numberOfPoints} points: Project() loop {loop_duration:.3f} s (extrapolated from {numberOfLoopPoints} points), "
+                 f"ProjectPoints() {1000 * batch_duration:.1f} ms, speedup x{loop_duration / batch_duration:.0f}. "
+                 f"Maximum difference = {maximum_difference:.2e} px. {np.count_nonzero(~valid_mask)} invalid points")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--numberOfPoints', help="The number of projected 3D points. Default: 1000000", type=int, default=1000000)
+    parser.add_argument('--numberOfLoopPoints', help="The number of points projected one at a time with Project(). Default: 100000", type=int, default=100000)
+    args = parser.parse_args()
+    main(
+        args.numberOfPoints,
+        args.numberOfLoopPoints
+    )
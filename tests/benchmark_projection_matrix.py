@@ -0,0 +1,45 @@
+import logging
+import argparse
+import ast
+import time
+import numpy as np
+from stereo_vision.projection import ProjectionMatrix
+from stereo_vision.synthetic_camera import SyntheticProjectionMatrix, SyntheticCorrespondences
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        numbersOfCorrespondences,
+        noiseStd,
+        numberOfRuns
+):
+    logging.info("benchmark_projection_matrix.main()")
+
+    true_projection_matrix = SyntheticProjectionMatrix()
+    rng = np.random.default_rng(0)
+    for number_of_correspondences in numbersOfCorrespondences:
+        xy_XYZ_tuples = SyntheticCorrespondences(true_projection_matrix, number_of_correspondences, noiseStd, rng)
+        for method_name in ['Create', 'CreateNormalizedDLT']:
+            projection_matrix = ProjectionMatrix()
+            method = getattr(projection_matrix, method_name)
+            start_time = time.perf_counter()
+            for run_ndx in range(numberOfRuns):
+                method(xy_XYZ_tuples)
+            duration = (time.perf_counter() - start_time) / numberOfRuns
+            statistics = projection_matrix.ReprojectionStatistics(xy_XYZ_tuples)
+            logging.info(f"{number_of_correspondences} correspondences, {method_name}(): {1000 * duration:.2f} ms, "
+                         f"reprojection RMS = {statistics['rms']:.4f} px, max = {statistics['max']:.4f} px")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--numbersOfCorrespondences', help="The list of numbers of correspondences. Default: '[36, 252, 1000, 5000]'", default='[36, 252, 1000, 5000]')
+    parser.add_argument('--noiseStd', help="The standard deviation of the pixel noise. Default: 0.5", type=float, default=0.5)
+    parser.add_argument('--numberOfRuns', help="The number of timed runs per measure. Default: 5", type=int, default=5)
+    args = parser.parse_args()
+    numbersOfCorrespondences = ast.literal_eval(args.numbersOfCorrespondences)
+    main(
+        numbersOfCorrespondences,
+        args.noiseStd,
+        args.numberOfRuns
+    )
@@ -0,0 +1,55 @@
+import logging
+import argparse
+import ast
+import time
+import tracemalloc
+import numpy as np
+import red_square
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        imageSizeHW,
+        numberOfRuns
+):
+    logging.info("benchmark_red_square_detector.main()")
+
+    image = red_square.SyntheticImage(imageSizeHW, (imageSizeHW[1] * 0.4, imageSizeHW[0] * 0.6), seed=0)
+    detector = red_square.Detector()
+    fast_detector = red_square.Detector(fast_mode=True)
+
+    # The fast masks must be bit-identical, except for the domination images that are clipped to [0, 255]
+    masks = detector.Masks(image)
+    fast_masks = fast_detector.Masks(image)
+    for mask_ndx in [1, 3, 4]:
+        if not np.array_equal(masks[mask_ndx], fast_masks[mask_ndx]):
+            raise ValueError(f"benchmark_red_square_detector.main(): Mask {mask_ndx} of the fast path differs from the float path")
+
+    float_duration, float_peak_memory = TimeMasks(detector, image, numberOfRuns)
+    fast_duration, fast_peak_memory = TimeMasks(fast_detector, image, numberOfRuns)
+    logging.info(f"Image size {imageSizeHW}: float path {1000 * float_duration:.2f} ms/call ({float_peak_memory / 1e6:.1f} MB allocated), "
+                 f"fast path {1000 * fast_duration:.2f} ms/call ({fast_peak_memory / 1e6:.1f} MB allocated), speedup x{float_duration / fast_duration:.1f}")
+
+def TimeMasks(detector, image, number_of_runs):
+    detector.Masks(image)  # Warm up, and allocate the buffers of the fast path
+    start_time = time.perf_counter()
+    for run_ndx in range(number_of_runs):
+        detector.Masks(image)
+    duration = (time.perf_counter() - start_time) / number_of_runs
+    tracemalloc.start()
+    detector.Masks(image)
+    current_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak_memory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--imageSizeHW', help="The synthetic image size (Height, Width). Default: '(1080, 1920)'", default='(1080, 1920)')
+    parser.add_argument('--numberOfRuns', help="The number of timed calls. Default: 20", type=int, default=20)
+    args = parser.parse_args()
+    imageSizeHW = ast.literal_eval(args.imageSizeHW)
+    main(
+        imageSizeHW,
+        args.numberOfRuns
+    )
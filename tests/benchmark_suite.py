@@ -0,0 +1,194 @@
+import cv2
+import logging
+import argparse
+import ast
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import red_square
+from stereo_vision.projection import ProjectionMatrix, StereoVisionSystem
+import stereo_vision.sequence_index as seq_index
+from stereo_vision.synthetic_camera import SyntheticProjectionMatrix, SyntheticCorrespondences
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+results_format_version = 1
+
+def main(
+        outputFilepath,
+        baselineFilepath,
+        regressionTolerance,
+        numbersOfCorrespondences,
+        numbersOfPoints,
+        maximumNumberOfLoopPoints,
+        imageSizesHW,
+        numbersOfSequenceFrames,
+        numberOfRepeats,
+        minimumRepeatDuration
+):
+    logging.info("benchmark_suite.main()")
+
+    # Each measure is the median and the minimum, over numberOfRepeats repeats, of the duration of one call. A measure
+    # whose median is slower than the baseline median by more than regressionTolerance is a regression
+    measures = {}
+    def Measure(name, size, function):
+        best_duration, median_duration, number_of_calls = TimeCall(function, numberOfRepeats, minimumRepeatDuration)
+        key = f"{name}[{size}]"
+        measures[key] = {'name': name, 'size': size, 'best': best_duration, 'median': median_duration, 'number_of_calls': number_of_calls}
+        logging.info(f"{key}: median {1000 * median_duration:.4f} ms, best {1000 * best_duration:.4f} ms ({number_of_calls} calls per repeat)")
+
+    # Calibration
+    rng = np.random.default_rng(0)
+    true_projection_matrix = SyntheticProjectionMatrix()
+    for number_of_correspondences in numbersOfCorrespondences:
+        xy_XYZ_tuples = SyntheticCorrespondences(true_projection_matrix, number_of_correspondences, 0.5, rng)
+        projection_matrix = ProjectionMatrix()
+        Measure('ProjectionMatrix.Create', number_of_correspondences, lambda: projection_matrix.Create(xy_XYZ_tuples))
+        Measure('ProjectionMatrix.CreateNormalizedDLT', number_of_correspondences, lambda: projection_matrix.CreateNormalizedDLT(xy_XYZ_tuples))
+
+    # Triangulation and projection of random point clouds
+    stereo_system = StereoVisionSystem([SyntheticProjectionMatrix(), SyntheticProjectionMatrix(camera_position=(-5.0, -3.0, 10.0))])
+    for number_of_points in numbersOfPoints:
+        points_arr = np.column_stack([rng.uniform(-30, 30, number_of_points), rng.uniform(-30, 30, number_of_points),
+                                      rng.uniform(-120, -60, number_of_points)])
+        coordinates_arr = np.stack([projection_matrix.ProjectPoints(points_arr)[0] for projection_matrix in stereo_system.projection_matrices_list], axis=1)
+        Measure('StereoVisionSystem.SolveXYZBatch', number_of_points, lambda: stereo_system.SolveXYZBatch(coordinates_arr))
+        Measure('ProjectionMatrix.ProjectPoints', number_of_points, lambda: true_projection_matrix.ProjectPoints(points_arr))
+        if number_of_points > maximumNumberOfLoopPoints:
+            continue
+        # The one-point methods, called in a loop over the points
+        coordinates_lists = coordinates_arr.tolist()
+        Measure('StereoVisionSystem.SolveXYZ', number_of_points, lambda: [stereo_system.SolveXYZ(coordinates_list) for coordinates_list in coordinates_lists])
+        Measure('ProjectionMatrix.Project', number_of_points, lambda: [true_projection_matrix.Project(point) for point in points_arr])
+
+    # Red square detection
+    for imageSizeHW in imageSizesHW:
+        image = red_square.SyntheticImage(imageSizeHW, (imageSizeHW[1] * 0.4, imageSizeHW[0] * 0.6), seed=0)
+        size = f"{imageSizeHW[0]}x{imageSizeHW[1]}"
+        detector = red_square.Detector()
+        Measure('Detector.Detect', size, lambda: detector.Detect(image))
+        fast_detector = red_square.Detector(fast_mode=True)
+        Measure('Detector.Detect(fast_mode)', size, lambda: fast_detector.Detect(image))
+        coarse_to_fine_detector = red_square.Detector(fast_mode=True, coarse_to_fine_factor=4)
+        Measure('Detector.Detect(fast_mode, coarse_to_fine_factor=4)', size, lambda: coarse_to_fine_detector.Detect(image))
+        tracking_detector = red_square.Detector(fast_mode=True)
+        Measure('Detector.Track(fast_mode)', size, lambda: tracking_detector.Track(image))
+
+    # Sequence discovery, on empty files named like the record.py outputs
+    for number_of_frames in numbersOfSequenceFrames:
+        sequence_directory = tempfile.mkdtemp(prefix='benchmark_suite_')
+        try:
+            images_filepath_prefix = os.path.join(sequence_directory, 'camera_')
+            CreateSequenceFiles(images_filepath_prefix, [1, 2], number_of_frames)
+            Measure('BuildSequenceIndex', number_of_frames, lambda: seq_index.BuildSequenceIndex(images_filepath_prefix, [1, 2]))
+            seq_index.BuildSequenceIndex(images_filepath_prefix, [1, 2]).Save()
+            manifest_filepath = seq_index.DefaultManifestFilepath(images_filepath_prefix)
+            Measure('LoadSequenceIndex', number_of_frames, lambda: seq_index.LoadSequenceIndex(manifest_filepath, images_filepath_prefix, [1, 2]))
+        finally:
+            shutil.rmtree(sequence_directory)
+
+    results = {'format_version': results_format_version, 'date': datetime.datetime.now().isoformat(),
+               'environment': Environment(), 'measures': measures}
+    regressions = []
+    if baselineFilepath is not None:
+        with open(baselineFilepath, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        results['comparison'] = CompareWithBaseline(measures, baseline['measures'], regressionTolerance)
+        results['comparison']['baseline_filepath'] = baselineFilepath
+        regressions = results['comparison']['regressions']
+        for key in regressions:
+            ratio = results['comparison']['ratios'][key]
+            logging.warning(f"Regression: {key} is x{ratio:.2f} slower than the baseline ({1000 * baseline['measures'][key]['median']:.4f} ms -> {1000 * measures[key]['median']:.4f} ms)")
+        logging.info(f"{len(results['comparison']['ratios'])} measures compared with '{baselineFilepath}': {len(regressions)} regressions, "
+                     f"{len(results['comparison']['improvements'])} improvements, {len(results['comparison']['missing'])} missing")
+
+    output_directory = os.path.dirname(outputFilepath)
+    if output_directory and not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    with open(outputFilepath, 'w') as output_file:
+        json.dump(results, output_file, indent=1)
+    logging.info(f"The results were written to '{outputFilepath}'")
+    return regressions
+
+def TimeCall(function, number_of_repeats, minimum_repeat_duration):
+    """
+    Like timeit: the number of calls per repeat is doubled until a repeat lasts at least minimum_repeat_duration, so
+    that the fast functions are not dominated by the timer resolution. Returns the minimum and the median durations of
+    one call, in seconds, and the number of calls per repeat.
+    """
+    function()  # Warm up
+    number_of_calls = 1
+    while True:
+        start_time = time.perf_counter()
+        for call_ndx in range(number_of_calls):
+            function()
+        duration = time.perf_counter() - start_time
+        if duration >= minimum_repeat_duration:
+            break
+        number_of_calls *= 2
+    durations = [duration / number_of_calls]
+    for repeat_ndx in range(number_of_repeats - 1):
+        start_time = time.perf_counter()
+        for call_ndx in range(number_of_calls):
+            function()
+        durations.append((time.perf_counter() - start_time) / number_of_calls)
+    return float(np.min(durations)), float(np.median(durations)), number_of_calls
+
+def CompareWithBaseline(measures, baseline_measures, regression_tolerance):
+    # The ratios of the median durations, current / baseline, of the measures found in both
+    ratios = {key: measures[key]['median'] / baseline_measures[key]['median'] for key in measures.keys()
+              if key in baseline_measures and baseline_measures[key]['median'] > 0}
+    return {'regression_tolerance': regression_tolerance, 'ratios': ratios,
+            'regressions': [key for key, ratio in ratios.items() if ratio > 1 + regression_tolerance],
+            'improvements': [key for key, ratio in ratios.items() if ratio < 1 / (1 + regression_tolerance)],
+            'missing': [key for key in baseline_measures.keys() if key not in measures]}
+
+def CreateSequenceFiles(images_filepath_prefix, camera_ID_list, number_of_frames):
+    # Empty files: the sequence index only reads the filenames
+    for frame_ndx in range(number_of_frames):
+        timestamp = f"{1700000000 + frame_ndx / 30:.6f}"
+        for camera_ID in camera_ID_list:
+            open(images_filepath_prefix + str(camera_ID) + '_' + timestamp + '.png', 'w').close()
+
+def Environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(), 'number_of_cpus': os.cpu_count()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--outputFilepath', help="The json file of the results. Default: './output_benchmark_suite/benchmark_results.json'", default='./output_benchmark_suite/benchmark_results.json')
+    parser.add_argument('--baselineFilepath', help="If specified, the results json file to compare with. The script exits with status 1 if there is a regression. Default: None", default=None)
+    parser.add_argument('--regressionTolerance', help="The relative slowdown of the median duration above which a measure is a regression. Default: 0.2", type=float, default=0.2)
+    parser.add_argument('--numbersOfCorrespondences', help="The list of numbers of calibration correspondences. Default: '[36, 252, 1000]'", default='[36, 252, 1000]')
+    parser.add_argument('--numbersOfPoints', help="The list of numbers of triangulated and projected points. Default: '[1, 100, 10000, 1000000]'", default='[1, 100, 10000, 1000000]')
+    parser.add_argument('--maximumNumberOfLoopPoints', help="The maximum number of points for the one-point methods SolveXYZ() and Project(), called in a loop. Default: 10000", type=int, default=10000)
+    parser.add_argument('--imageSizesHW', help="The list of synthetic image sizes (Height, Width). Default: '[(480, 640), (1080, 1920)]'", default='[(480, 640), (1080, 1920)]')
+    parser.add_argument('--numbersOfSequenceFrames', help="The list of numbers of frames per camera of the synthetic sequences. Default: '[100, 10000]'", default='[100, 10000]')
+    parser.add_argument('--numberOfRepeats', help="The number of timed repeats per measure. Default: 5", type=int, default=5)
+    parser.add_argument('--minimumRepeatDuration', help="The minimum duration of a timed repeat, in seconds. Default: 0.05", type=float, default=0.05)
+    args = parser.parse_args()
+    numbersOfCorrespondences = ast.literal_eval(args.numbersOfCorrespondences)
+    numbersOfPoints = ast.literal_eval(args.numbersOfPoints)
+    imageSizesHW = ast.literal_eval(args.imageSizesHW)
+    numbersOfSequenceFrames = ast.literal_eval(args.numbersOfSequenceFrames)
+    regressions = main(
+        args.outputFilepath,
+        args.baselineFilepath,
+        args.regressionTolerance,
+        numbersOfCorrespondences,
+        numbersOfPoints,
+        args.maximumNumberOfLoopPoints,
+        imageSizesHW,
+        numbersOfSequenceFrames,
+        args.numberOfRepeats,
+        args.minimumRepeatDuration
+    )
+    if len(regressions) > 0:
+        sys.exit(1)
@@ -10,8 +10,10 @@ import matplotlib
 import matplotlib.pyplot as plt
 matplotlib.use('TKAgg')
 import math
+import numpy as np
 import pickle
 import pandas as pd
+import stereo_vision.calibration as calibration
 from stereo_vision.projection import ProjectionMatrix
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
@@ -43,6 +45,16 @@ calibration_pattern_xy_filepath = 'calibration_images/calibration_pattern_xy.csv
 
 output_directory = "./output_calibrate_system"
 
+# With robust_calibration, the intersections are not filtered by hand: the bad correspondences are rejected by RANSAC.
+# In the images where intersections are missing or spurious, the complete lines of the grid are kept
+robust_calibration = False
+ransac_inlier_threshold = 2.0  # pixels
+ransac_maximum_number_of_iterations = 2000
+ransac_time_budget = None  # seconds
+ransac_seed = 0
+# Minimize the reprojection error, after the linear fit. Off by default, to keep the matrices of the linear fit
+refine_projection_matrices = False
+
 def main():
     logging.info(f"calibrate_system.main()")
     if not os.path.exists(output_directory):
@@ -55,12 +67,18 @@ def main():
         debug_directory=output_directory
     )
 
-    camera1_imageFilepath_to_intersectionsList = InteractivelyFilterBadPoints(camera1_filepath_to_z, checkerboard_intersections)
+    if robust_calibration:
+        camera1_imageFilepath_to_intersectionsList = FindIntersections(camera1_filepath_to_z, checkerboard_intersections)
+    else:
+        camera1_imageFilepath_to_intersectionsList = InteractivelyFilterBadPoints(camera1_filepath_to_z, checkerboard_intersections)
     with open(os.path.join(output_directory, "camera1_intersections.pkl"), 'wb') as intersections_file:
         pickle.dump(camera1_imageFilepath_to_intersectionsList, intersections_file, pickle.HIGHEST_PROTOCOL)
-    
-    camera2_imageFilepath_to_intersectionsList = InteractivelyFilterBadPoints(camera2_filepath_to_z,
-                                                                              checkerboard_intersections)
+
+    if robust_calibration:
+        camera2_imageFilepath_to_intersectionsList = FindIntersections(camera2_filepath_to_z, checkerboard_intersections)
+    else:
+        camera2_imageFilepath_to_intersectionsList = InteractivelyFilterBadPoints(camera2_filepath_to_z,
+                                                                                  checkerboard_intersections)
     with open(os.path.join(output_directory, "camera2_intersections.pkl"), 'wb') as intersections_file:
         pickle.dump(camera2_imageFilepath_to_intersectionsList, intersections_file, pickle.HIGHEST_PROTOCOL)
 
@@ -88,43 +106,60 @@ def main():
         camera2_imageFilepath_to_intersectionsList, camera2_radial_distortion
     )
 
-    # Sort the points, per lines
-    camera1_imageFilepath_to_undistorted_intersectionsList = \
-        SortPointsPerLine(camera1_imageFilepath_to_undistorted_intersectionsList,
-                          camera1_radial_distortion,
-                          grid_shapeHW)
-    camera2_imageFilepath_to_undistorted_intersectionsList = \
-        SortPointsPerLine(camera2_imageFilepath_to_undistorted_intersectionsList,
-                          camera2_radial_distortion,
-                          grid_shapeHW)
-
     # Load the calibration pattern (x, y) coordinates
     calibration_pattern_xy_df = pd.read_csv(calibration_pattern_xy_filepath)
     #print(f"calibration_patter_xy_df: \n{calibration_pattern_xy_df}")
 
-    # Match the pixel points with the 3D points
-    camera1_xy_XYZ_tuples = MatchPixelsWith3D(
-        camera1_imageFilepath_to_undistorted_intersectionsList, camera1_filepath_to_z,
-        calibration_pattern_xy_df
-    )
-    camera2_xy_XYZ_tuples = MatchPixelsWith3D(
-        camera2_imageFilepath_to_undistorted_intersectionsList, camera2_filepath_to_z,
-        calibration_pattern_xy_df
-    )
+    # Sort the points, per lines, and match the pixel points with the 3D points
+    if robust_calibration:
+        camera1_imageFilepath_to_lines = GroupPointsPerLine(camera1_imageFilepath_to_undistorted_intersectionsList,
+                                                            camera1_radial_distortion, grid_shapeHW)
+        camera2_imageFilepath_to_lines = GroupPointsPerLine(camera2_imageFilepath_to_undistorted_intersectionsList,
+                                                            camera2_radial_distortion, grid_shapeHW)
+        camera1_imageFilepath_to_undistorted_intersectionsList = {image_filepath: sum(lines, []) for image_filepath, lines in camera1_imageFilepath_to_lines.items()}
+        camera2_imageFilepath_to_undistorted_intersectionsList = {image_filepath: sum(lines, []) for image_filepath, lines in camera2_imageFilepath_to_lines.items()}
+        camera1_xy_XYZ_tuples = MatchLinesWith3D(camera1_imageFilepath_to_lines, camera1_filepath_to_z, calibration_pattern_xy_df, grid_shapeHW)
+        camera2_xy_XYZ_tuples = MatchLinesWith3D(camera2_imageFilepath_to_lines, camera2_filepath_to_z, calibration_pattern_xy_df, grid_shapeHW)
+    else:
+        camera1_imageFilepath_to_undistorted_intersectionsList = \
+            SortPointsPerLine(camera1_imageFilepath_to_undistorted_intersectionsList,
+                              camera1_radial_distortion,
+                              grid_shapeHW)
+        camera2_imageFilepath_to_undistorted_intersectionsList = \
+            SortPointsPerLine(camera2_imageFilepath_to_undistorted_intersectionsList,
+                              camera2_radial_distortion,
+                              grid_shapeHW)
+        camera1_xy_XYZ_tuples = MatchPixelsWith3D(
+            camera1_imageFilepath_to_undistorted_intersectionsList, camera1_filepath_to_z,
+            calibration_pattern_xy_df
+        )
+        camera2_xy_XYZ_tuples = MatchPixelsWith3D(
+            camera2_imageFilepath_to_undistorted_intersectionsList, camera2_filepath_to_z,
+            calibration_pattern_xy_df
+        )
     #logging.info(f"camera1_xy_XYZ_tuples = {camera1_xy_XYZ_tuples}")
 
     # Compute the projection matrix
-    projection_mtx1 = ProjectionMatrix(camera1_xy_XYZ_tuples)
-    logging.info(f"projection_mtx1.matrix = \n{projection_mtx1.matrix}")
-    projection_mtx2 = ProjectionMatrix(camera2_xy_XYZ_tuples)
-    logging.info(f"projection_mtx2.matrix = \n{projection_mtx2.matrix}")
+    projection_mtx1 = ProjectionMatrix()
+    reprojection_statistics1 = CreateProjectionMatrix(projection_mtx1, camera1_xy_XYZ_tuples)
+    logging.info(f"projection_mtx1.matrix = \n{projection_mtx1.matrix}\nreprojection_statistics1 = {reprojection_statistics1}")
+    projection_mtx2 = ProjectionMatrix()
+    reprojection_statistics2 = CreateProjectionMatrix(projection_mtx2, camera2_xy_XYZ_tuples)
+    logging.info(f"projection_mtx2.matrix = \n{projection_mtx2.matrix}\nreprojection_statistics2 = {reprojection_statistics2}")
     # Save the projection matrices
     with open(os.path.join(output_directory, "camera1.projmtx"), 'wb') as projection_mtx_file:
         pickle.dump(projection_mtx1, projection_mtx_file, pickle.HIGHEST_PROTOCOL)
     with open(os.path.join(output_directory, "camera2.projmtx"), 'wb') as projection_mtx_file:
         pickle.dump(projection_mtx2, projection_mtx_file, pickle.HIGHEST_PROTOCOL)
+    calibration.SaveCalibrationBundle(os.path.join(output_directory, "calibration.svcal"), [projection_mtx1, projection_mtx2],
+                                      [camera1_radial_distortion, camera2_radial_distortion],
+                                      metadata={'reprojection_statistics': [reprojection_statistics1, reprojection_statistics2],
+                                                'image_sizesHW': [list(cv2.imread(image_filepath).shape[0:2]) for image_filepath in
+                                                                  [next(iter(camera1_filepath_to_z)), next(iter(camera2_filepath_to_z))]]})
 
     # Debug images
+    pattern_XYZ_arr = np.zeros((len(calibration_pattern_xy_df), 3))
+    pattern_XYZ_arr[:, 0:2] = calibration_pattern_xy_df[['x', 'y']].to_numpy()
     for image_filepath, intersections_list in camera1_imageFilepath_to_undistorted_intersectionsList.items():
         annotated_img = cv2.imread(image_filepath)
         for point_ndx in range(len(intersections_list)):
@@ -134,11 +169,10 @@ def main():
                         0.7, (0, 255, 0), thickness=1)
 
         # Projections
-        Z = camera1_filepath_to_z[image_filepath]
-        for point_ndx in range(len(calibration_pattern_xy_df)):
-            XYZ = (calibration_pattern_xy_df.iloc[point_ndx].x, calibration_pattern_xy_df.iloc[point_ndx].y, Z)
-            projected_p = projection_mtx1.Project(XYZ, must_round=True)
-            cv2.circle(annotated_img, projected_p, 6, (0, 255, 255), thickness=2)
+        pattern_XYZ_arr[:, 2] = camera1_filepath_to_z[image_filepath]
+        projected_xy_arr, is_valid = projection_mtx1.ProjectPoints(pattern_XYZ_arr, must_round=True)
+        for projected_p in projected_xy_arr[is_valid]:
+            cv2.circle(annotated_img, (int(projected_p[0]), int(projected_p[1])), 6, (0, 255, 255), thickness=2)
 
         annotated_img_filepath = os.path.join(output_directory, "calibrateSystem_main_" + os.path.basename(
             image_filepath) + "UndistortedIntersections.png")
@@ -153,11 +187,10 @@ def main():
                         0.7, (0, 255, 0), thickness=1)
 
         # Projections
-        Z = camera2_filepath_to_z[image_filepath]
-        for point_ndx in range(len(calibration_pattern_xy_df)):
-            XYZ = (calibration_pattern_xy_df.iloc[point_ndx].x, calibration_pattern_xy_df.iloc[point_ndx].y, Z)
-            projected_p = projection_mtx2.Project(XYZ, must_round=True)
-            cv2.circle(annotated_img, projected_p, 6, (0, 255, 255), thickness=2)
+        pattern_XYZ_arr[:, 2] = camera2_filepath_to_z[image_filepath]
+        projected_xy_arr, is_valid = projection_mtx2.ProjectPoints(pattern_XYZ_arr, must_round=True)
+        for projected_p in projected_xy_arr[is_valid]:
+            cv2.circle(annotated_img, (int(projected_p[0]), int(projected_p[1])), 6, (0, 255, 255), thickness=2)
         annotated_img_filepath = os.path.join(output_directory, "calibrateSystem_main_" + os.path.basename(image_filepath) + "UndistortedIntersections.png")
         cv2.imwrite(annotated_img_filepath, annotated_img)
 
@@ -200,6 +233,40 @@ def InteractivelyFilterBadPoints(cameraFilepath_to_z, checkerboard_intersections
         imageFilepath_to_intersectionsList[image_filepath] = intersections_list
     return imageFilepath_to_intersectionsList
 
+def FindIntersections(cameraFilepath_to_z, checkerboard_intersections):
+    imageFilepath_to_intersectionsList = {}
+    for image_filepath, distance in cameraFilepath_to_z.items():
+        image = cv2.imread(image_filepath)
+        intersections_list = RemoveDuplicates(checkerboard_intersections.FindIntersections(image))
+        logging.info(f"FindIntersections(): '{image_filepath}': len(intersections_list) = {len(intersections_list)}")
+        imageFilepath_to_intersectionsList[image_filepath] = intersections_list
+    return imageFilepath_to_intersectionsList
+
+def CreateProjectionMatrix(projection_mtx, xy_XYZ_tuples):
+    CheckNotCoplanar(xy_XYZ_tuples)
+    if not robust_calibration:
+        reprojection_statistics = projection_mtx.CreateNormalizedDLT(xy_XYZ_tuples)
+        if refine_projection_matrices:
+            reprojection_statistics = RefineProjectionMatrix(projection_mtx, xy_XYZ_tuples)
+        return reprojection_statistics
+    reprojection_statistics = projection_mtx.CreateRobust(xy_XYZ_tuples, inlier_threshold=ransac_inlier_threshold,
+                                                          maximum_number_of_iterations=ransac_maximum_number_of_iterations,
+                                                          time_budget=ransac_time_budget, seed=ransac_seed)
+    inlier_mask = reprojection_statistics.pop('inlier_mask')
+    outliers = [xy_XYZ_tuples[ndx] for ndx in range(len(xy_XYZ_tuples)) if not inlier_mask[ndx]]
+    logging.info(f"CreateProjectionMatrix(): {len(outliers)} outliers were rejected: {outliers}")
+    inlier_xy_XYZ_tuples = [xy_XYZ_tuples[ndx] for ndx in range(len(xy_XYZ_tuples)) if inlier_mask[ndx]]
+    CheckNotCoplanar(inlier_xy_XYZ_tuples)
+    if refine_projection_matrices:
+        reprojection_statistics = RefineProjectionMatrix(projection_mtx, inlier_xy_XYZ_tuples)
+    return reprojection_statistics
+
+def RefineProjectionMatrix(projection_mtx, xy_XYZ_tuples):
+    reprojection_statistics = projection_mtx.Refine(xy_XYZ_tuples)
+    reprojection_errors = reprojection_statistics.pop('reprojection_errors')
+    logging.info(f"RefineProjectionMatrix(): The worst points: {[xy_XYZ_tuples[ndx] for ndx in reprojection_errors.argsort()[-5:]]}")
+    return reprojection_statistics
+
 def RemoveDuplicates(points_list, threshold_in_pixels=5):
     no_duplicates_points_list = []
     duplicate_indices_list = []
@@ -229,17 +296,23 @@ def UndistortIntersections(
 
 def SortPointsPerLine(imageFilepath_to_intersectionsList, radial_distortion, grid_shapeHW):
     imageFilepath_to_sortedIntersectionsList = {}
-    for image_filepath, intersections_list in imageFilepath_to_intersectionsList.items():
-        horizontal_lines, vertical_lines = radial_distortion.GroupCheckerboardPoints(
-            intersections_list, grid_shapeHW
-        )
+    for image_filepath, lines in GroupPointsPerLine(imageFilepath_to_intersectionsList, radial_distortion, grid_shapeHW).items():
         sorted_intersections_list = []
-        for horizontal_line in horizontal_lines:
-            horizontal_line = sorted(horizontal_line, key=lambda xy: xy[0])
+        for horizontal_line in lines:
             sorted_intersections_list += horizontal_line
         imageFilepath_to_sortedIntersectionsList[image_filepath] = sorted_intersections_list
     return imageFilepath_to_sortedIntersectionsList
 
+def GroupPointsPerLine(imageFilepath_to_intersectionsList, radial_distortion, grid_shapeHW):
+    # The horizontal lines of each image, each one sorted by increasing x
+    imageFilepath_to_lines = {}
+    for image_filepath, intersections_list in imageFilepath_to_intersectionsList.items():
+        horizontal_lines, vertical_lines = radial_distortion.GroupCheckerboardPoints(
+            intersections_list, grid_shapeHW
+        )
+        imageFilepath_to_lines[image_filepath] = [sorted(horizontal_line, key=lambda xy: xy[0]) for horizontal_line in horizontal_lines]
+    return imageFilepath_to_lines
+
 def MatchPixelsWith3D(imageFilepath_to_pixelPointsList,
                       imageFilepath_to_z,
                       calibration_pattern_xy_df):
@@ -257,5 +330,36 @@ def MatchPixelsWith3D(imageFilepath_to_pixelPointsList,
 
     return xy_XYZ_tuples
 
+def MatchLinesWith3D(imageFilepath_to_lines, imageFilepath_to_z, calibration_pattern_xy_df, grid_shapeHW):
+    # Like MatchPixelsWith3D(), line by line: the lines that don't have grid_shapeHW[1] points are skipped, since their
+    # points can't be matched with the pattern. If the image doesn't have grid_shapeHW[0] lines, it is skipped
+    if len(calibration_pattern_xy_df) != grid_shapeHW[0] * grid_shapeHW[1]:
+        raise ValueError(f"MatchLinesWith3D(): len(calibration_pattern_xy_df) ({len(calibration_pattern_xy_df)}) != {grid_shapeHW[0]} x {grid_shapeHW[1]}")
+    xy_XYZ_tuples = []
+    for image_filepath, lines in imageFilepath_to_lines.items():
+        if not image_filepath in imageFilepath_to_z:
+            raise ValueError(f"MatchLinesWith3D(): image filepath '{image_filepath}' was not found in imageFilepath_to_z:\n{imageFilepath_to_z}")
+        Z = imageFilepath_to_z[image_filepath]
+        if len(lines) != grid_shapeHW[0]:
+            logging.warning(f"MatchLinesWith3D(): '{image_filepath}': len(lines) ({len(lines)}) != {grid_shapeHW[0]}. The image is skipped")
+            continue
+        for line_ndx in range(len(lines)):
+            if len(lines[line_ndx]) != grid_shapeHW[1]:
+                logging.warning(f"MatchLinesWith3D(): '{image_filepath}': line {line_ndx} has {len(lines[line_ndx])} points instead of {grid_shapeHW[1]}. The line is skipped")
+                continue
+            for column_ndx in range(len(lines[line_ndx])):
+                pattern_point = calibration_pattern_xy_df.iloc[line_ndx * grid_shapeHW[1] + column_ndx]
+                xy_XYZ_tuples.append((lines[line_ndx][column_ndx], (pattern_point.x, pattern_point.y, Z)))
+    return xy_XYZ_tuples
+
+def CheckNotCoplanar(xy_XYZ_tuples, relative_tolerance=1e-6):
+    # The projection matrix is undetermined if the 3D points are on a plane, for example if they all come from one image
+    if len(xy_XYZ_tuples) < 6:
+        raise ValueError(f"CheckNotCoplanar(): len(xy_XYZ_tuples) ({len(xy_XYZ_tuples)}) < 6")
+    XYZ_arr = np.array([XYZ for xy, XYZ in xy_XYZ_tuples], dtype=float)
+    singular_values = np.linalg.svd(XYZ_arr - np.mean(XYZ_arr, axis=0), compute_uv=False)
+    if singular_values[2] <= relative_tolerance * singular_values[0]:
+        raise ValueError(f"CheckNotCoplanar(): The {len(xy_XYZ_tuples)} 3D points are coplanar. The calibration needs points at two depths Z or more")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
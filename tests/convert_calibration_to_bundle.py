@@ -0,0 +1,52 @@
+import logging
+import argparse
+import pickle
+import stereo_vision.calibration as calibration
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        projectionMatrix1Filepath,
+        projectionMatrix2Filepath,
+        radialDistortion1Filepath,
+        radialDistortion2Filepath,
+        outputFilepath
+):
+    logging.info("convert_calibration_to_bundle.main()")
+
+    projection_matrices = []
+    for projection_matrix_filepath in [projectionMatrix1Filepath, projectionMatrix2Filepath]:
+        with open(projection_matrix_filepath, 'rb') as projection_matrix_file:
+            projection_matrices.append(pickle.load(projection_matrix_file))
+    radial_distortions = []
+    for radial_distortion_filepath in [radialDistortion1Filepath, radialDistortion2Filepath]:
+        with open(radial_distortion_filepath, 'rb') as radial_distortion_file:
+            radial_distortions.append(pickle.load(radial_distortion_file))
+
+    calibration.SaveCalibrationBundle(outputFilepath, projection_matrices, radial_distortions,
+                                      metadata={'source_filepaths': [projectionMatrix1Filepath, projectionMatrix2Filepath,
+                                                                     radialDistortion1Filepath, radialDistortion2Filepath]})
+    stereo_system, distortion_models = calibration.LoadStereoVisionSystem(outputFilepath)
+    logging.info(f"Wrote '{outputFilepath}', with {len(stereo_system.projection_matrices_list)} cameras")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--projectionMatrix1Filepath', help="Filepath of the projection matrix 1. Default: './output_calibrate_system/camera1.projmtx'",
+                        default="./output_calibrate_system/camera1.projmtx")
+    parser.add_argument('--projectionMatrix2Filepath', help="Filepath of the projection matrix 2. Default: './output_calibrate_system/camera2.projmtx'",
+                        default="./output_calibrate_system/camera2.projmtx")
+    parser.add_argument('--radialDistortion1Filepath', help="The filepath for the radial distortion compensation model for camera 1. Default: './radial_distortion/calibration_left.pkl'",
+                        default='./radial_distortion/calibration_left.pkl')
+    parser.add_argument('--radialDistortion2Filepath', help="The filepath for the radial distortion compensation model for camera 2. Default: './radial_distortion/calibration_right.pkl'",
+                        default='./radial_distortion/calibration_right.pkl')
+    parser.add_argument('--outputFilepath', help="The calibration bundle filepath. Default: './output_calibrate_system/calibration.svcal'",
+                        default='./output_calibrate_system/calibration.svcal')
+    args = parser.parse_args()
+    main(
+        args.projectionMatrix1Filepath,
+        args.projectionMatrix2Filepath,
+        args.radialDistortion1Filepath,
+        args.radialDistortion2Filepath,
+        args.outputFilepath
+    )
@@ -0,0 +1,30 @@
+import logging
+import argparse
+import ast
+import stereo_vision.raw_sequence as raw_sequence
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        inputImagesFilepathPrefix,
+        outputDirectory,
+        cameraIDList
+):
+    logging.info("convert_to_raw_sequence.main()")
+    number_of_frames = raw_sequence.ConvertPngSequence(inputImagesFilepathPrefix, cameraIDList, outputDirectory)
+    logging.info(f"Converted {number_of_frames} frames to the raw sequence '{outputDirectory}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputImagesFilepathPrefix', help="The filepath prefix of the input png images, e.g. './output_record/camera_'")
+    parser.add_argument('--outputDirectory', help="The output raw sequence directory. Default: './output_convert_to_raw_sequence'",
+                        default='./output_convert_to_raw_sequence')
+    parser.add_argument('--cameraIDList', help="The list of camera ID. Default: '[1, 2]'", default='[1, 2]')
+    args = parser.parse_args()
+    cameraIDList = ast.literal_eval(args.cameraIDList)
+    main(
+        args.inputImagesFilepathPrefix,
+        args.outputDirectory,
+        cameraIDList
+    )
@@ -0,0 +1,169 @@
+import cv2
+import logging
+import argparse
+import ast
+import os
+import time
+import red_square
+import stereo_vision.calibration as calibration
+from stereo_vision.grab import Grabber, ThreadedGrabber
+from stereo_vision.live_pipeline import LiveTrackingPipeline
+import stereo_vision.raw_sequence as raw_sequence
+import stereo_vision.sequence_index as seq_index
+from stereo_vision.synthetic_camera import FileCamera
+from stereo_vision.trajectory_filter import TrajectoryFilter
+import stereo_vision.undistortion as undistortion
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        calibrationBundleFilepath,
+        outputDirectory,
+        cameraIDList,
+        inputImagesFilepathPrefix,
+        playbackFps,
+        duration,
+        exposure,
+        redSquareDetectorBlueDelta,
+        redSquareDetectorBlueDilationSize,
+        redSquareDetectorRedDelta,
+        redSquareDetectorRedDilationSize,
+        redSquareDetectorTracking,
+        undistortionMapsDirectory,
+        filterModel,
+        queueSize,
+        backpressure
+):
+    logging.info("live_track.main()")
+
+    if not os.path.exists(outputDirectory):
+        os.makedirs(outputDirectory)
+
+    calibration_bundle = calibration.CalibrationBundle(calibrationBundleFilepath)
+    stereo_system = calibration_bundle.StereoVisionSystem()
+    distortion_models = calibration_bundle.DistortionModels()
+
+    # The cameras: recorded frames played back by file cameras, or live cameras read by capture threads
+    if inputImagesFilepathPrefix is not None:
+        camera_captures, image_sizeHW = PlaybackCameras(inputImagesFilepathPrefix, cameraIDList, playbackFps)
+        grabber = Grabber([(camera_capture, camera_ID) for camera_capture, camera_ID in zip(camera_captures, cameraIDList)])
+    else:
+        video_captures_id_list = []
+        for camera_id in cameraIDList:
+            video_capture = cv2.VideoCapture(camera_id)
+            if not video_capture.isOpened():
+                raise ValueError(f"live_track.main(): Could not open camera {camera_id}")
+            video_capture.set(cv2.CAP_PROP_FPS, 30)
+            video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            video_capture.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
+            video_capture.set(cv2.CAP_PROP_EXPOSURE, exposure)
+            video_captures_id_list.append((video_capture, camera_id))
+        grabber = ThreadedGrabber(video_captures_id_list)
+        grabber.Start()
+        if not grabber.WaitForFirstImages():
+            grabber.Stop()
+            raise ValueError(f"live_track.main(): The cameras {cameraIDList} did not all deliver an image")
+        image_sizeHW = grabber.Grab()[0].shape[0:2]
+
+    detectors = []
+    for camera_ID in cameraIDList:
+        detector = red_square.Detector(blue_delta=redSquareDetectorBlueDelta, blue_mask_dilation_kernel_size=redSquareDetectorBlueDilationSize,
+                                       red_delta=redSquareDetectorRedDelta, red_mask_dilation_kernel_size=redSquareDetectorRedDilationSize,
+                                       fast_mode=True)
+        detectors.append(detector.Track if redSquareDetectorTracking else detector.Detect)
+
+    if undistortionMapsDirectory is not None:
+        undistorters = [undistortion.LoadOrBuildUndistortionMaps(distortion_model, image_sizeHW, undistortionMapsDirectory)
+                        if distortion_model is not None else None for distortion_model in distortion_models]
+    else:
+        # The models undistort one point at a time
+        undistorters = [ModelUndistorter(distortion_model) if distortion_model is not None else None for distortion_model in distortion_models]
+    trajectory_filter = TrajectoryFilter(model=filterModel) if filterModel is not None else None
+
+    pipeline = LiveTrackingPipeline(grabber, detectors, stereo_system, undistorters, trajectory_filter, queue_size=queueSize,
+                                    backpressure=backpressure)
+    with open(os.path.join(outputDirectory, "trajectory.csv"), 'w') as trajectory_file:
+        trajectory_file.write("timestamp,X,Y,Z,latency\n")
+        pipeline.Start()
+        end_time = time.monotonic() + duration
+        while not pipeline.IsFinished() and time.monotonic() < end_time:
+            result = pipeline.Pop(timeout=0.1)
+            if result is None:
+                continue
+            XYZ = result['filtered_XYZ'] if trajectory_filter is not None else result['XYZ']
+            trajectory_file.write(f"{result['timestamp']},{XYZ[0]},{XYZ[1]},{XYZ[2]},{result['latency']}\n")
+        pipeline.Stop()
+    if isinstance(grabber, ThreadedGrabber):
+        grabber.Stop()
+        logging.info(f"Grabber statistics: {grabber.Statistics()}")
+    statistics = pipeline.Statistics()
+    logging.info(f"Pipeline: {statistics['solved']} frames solved out of {statistics['grabbed']} grabbed ({statistics['dropped']} dropped), "
+                 f"{statistics['fps']:.1f} fps")
+    for stage_name in pipeline.stage_names:
+        logging.info(f"{stage_name} latency (ms): " + ", ".join(f"{key} = {1000 * value:.2f}" for key, value in statistics[stage_name].items()))
+
+class ModelUndistorter():
+    def __init__(self, radial_distortion):
+        self.radial_distortion = radial_distortion
+
+    def UndistortPoints(self, points_arr):
+        return undistortion.UndistortPoints(self.radial_distortion, points_arr)
+
+def PlaybackCameras(images_filepath_prefix, camera_ID_list, fps):
+    # Returns the file cameras, and the image size (Height, Width), known before any frame is grabbed
+    if raw_sequence.IsRawSequence(images_filepath_prefix):
+        sequence_reader = raw_sequence.RawSequenceReader(images_filepath_prefix)
+        camera_captures = [FileCamera(sequence_reader=sequence_reader, camera_ndx=sequence_reader.CameraIndex('camera_' + str(camera_ID)), fps=fps)
+                           for camera_ID in camera_ID_list]
+        return camera_captures, tuple(sequence_reader.image_shapeHWC[0:2])
+    sequence_index = seq_index.LoadOrBuildSequenceIndex(images_filepath_prefix, camera_ID_list)
+    timestamp_to_filepaths = sequence_index.TimestampToFilepaths()
+    timestamps = sorted(timestamp_to_filepaths.keys())
+    if len(timestamps) == 0:
+        raise ValueError(f"PlaybackCameras(): No complete set of images starts with '{images_filepath_prefix}'")
+    camera_captures = [FileCamera(image_filepaths=[timestamp_to_filepaths[timestamp][camera_ndx] for timestamp in timestamps], fps=fps)
+                       for camera_ndx in range(len(camera_ID_list))]
+    first_image = cv2.imread(timestamp_to_filepaths[timestamps[0]][0])
+    if first_image is None:
+        raise ValueError(f"PlaybackCameras(): Could not read the image '{timestamp_to_filepaths[timestamps[0]][0]}'")
+    return camera_captures, first_image.shape[0:2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('calibrationBundleFilepath', help="The calibration bundle of the stereo system (cf. stereo_vision.calibration)")
+    parser.add_argument('--outputDirectory', help="The output directory. Default: './output_live_track'", default='./output_live_track')
+    parser.add_argument('--cameraIDList', help="The list of camera ID. Default: '[1, 2]'", default='[1, 2]')
+    parser.add_argument('--inputImagesFilepathPrefix', help="If specified, the recorded images with this filepath prefix, or the raw sequence in this directory, are played back instead of grabbing from the cameras. Default: None", default=None)
+    parser.add_argument('--playbackFps', help="The playback rate of the recorded images, in frames per second. 0 plays back as fast as possible. Default: 30", type=float, default=30)
+    parser.add_argument('--duration', help="The maximum tracking time, in seconds. Default: 60.0", type=float, default=60.0)
+    parser.add_argument('--exposure', help="The value for the parameter CAP_PROP_EXPOSURE. The meaning depends on the camera model. Default: 400", type=float, default=400)
+    parser.add_argument('--redSquareDetectorBlueDelta', help="For the red square detector, the blue delta. Default: 15", type=int, default=15)
+    parser.add_argument('--redSquareDetectorBlueDilationSize', help="For the red square detector, the blue dilation size. Default: 45", type=int, default=45)
+    parser.add_argument('--redSquareDetectorRedDelta', help="For the red square detector, the red delta. Default: 70", type=int, default=70)
+    parser.add_argument('--redSquareDetectorRedDilationSize', help="For the red square detector, the red dilation size. Default: 13", type=int, default=13)
+    parser.add_argument('--redSquareDetectorTracking', help="For the red square detector, search in a window around the last detection", action='store_true')
+    parser.add_argument('--undistortionMapsDirectory', help="If specified, the points are undistorted by lookup in precomputed maps, cached in this directory. Default: None", default=None)
+    parser.add_argument('--filterModel', help="If specified, the trajectory is smoothed by a Kalman filter: 'constant_velocity' or 'constant_acceleration'. Default: None", default=None)
+    parser.add_argument('--queueSize', help="The number of frames that can wait for each detector. Default: 4", type=int, default=4)
+    parser.add_argument('--backpressure', help="What to do when a detector queue is full: 'drop_oldest' or 'block'. Default: 'drop_oldest'", default='drop_oldest')
+    args = parser.parse_args()
+    cameraIDList = ast.literal_eval(args.cameraIDList)
+    main(
+        args.calibrationBundleFilepath,
+        args.outputDirectory,
+        cameraIDList,
+        args.inputImagesFilepathPrefix,
+        args.playbackFps if args.playbackFps > 0 else None,
+        args.duration,
+        args.exposure,
+        args.redSquareDetectorBlueDelta,
+        args.redSquareDetectorBlueDilationSize,
+        args.redSquareDetectorRedDelta,
+        args.redSquareDetectorRedDilationSize,
+        args.redSquareDetectorTracking,
+        args.undistortionMapsDirectory,
+        args.filterModel,
+        args.queueSize,
+        args.backpressure
+    )
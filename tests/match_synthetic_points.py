@@ -0,0 +1,67 @@
+import logging
+import argparse
+import time
+import numpy as np
+import stereo_vision.matching as matching
+from stereo_vision.projection import StereoVisionSystem
+from stereo_vision.synthetic_camera import SyntheticProjectionMatrix
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        numberOfPoints,
+        noiseStd,
+        dropoutRate,
+        maximumDistance,
+        assignment,
+        seed
+):
+    logging.info("match_synthetic_points.main()")
+
+    rng = np.random.default_rng(seed)
+    projection_matrix1 = SyntheticProjectionMatrix(camera_position=(5.0, -3.0, 10.0))
+    projection_matrix2 = SyntheticProjectionMatrix(camera_position=(-5.0, -3.0, 10.0), rotation_vector=(0.05, 0.03, -0.02))
+    stereo_system = StereoVisionSystem([projection_matrix1, projection_matrix2])
+    F = matching.FundamentalMatrix(projection_matrix1, projection_matrix2)
+
+    XYZ_arr = np.column_stack([rng.uniform(-30, 30, numberOfPoints), rng.uniform(-30, 30, numberOfPoints),
+                               rng.uniform(-120, -60, numberOfPoints)])
+    points1_arr, _ = projection_matrix1.ProjectPoints(XYZ_arr)
+    points2_arr, _ = projection_matrix2.ProjectPoints(XYZ_arr)
+    points1_arr += rng.normal(0, noiseStd, points1_arr.shape)
+    points2_arr += rng.normal(0, noiseStd, points2_arr.shape)
+    # Camera 2 misses some points, and sees them in a different order
+    kept_ndxs2 = rng.permutation(np.flatnonzero(rng.random(numberOfPoints) >= dropoutRate))
+    points2_arr = points2_arr[kept_ndxs2]
+
+    start_time = time.perf_counter()
+    candidate_pairs = matching.CandidatePairs(F, points1_arr, points2_arr, maximumDistance)
+    matches, costs = matching.MatchPoints(F, points1_arr, points2_arr, maximumDistance, assignment)
+    matching_duration = time.perf_counter() - start_time
+    number_of_correct_matches = np.count_nonzero(kept_ndxs2[matches[:, 1]] == matches[:, 0])
+    logging.info(f"{numberOfPoints} points in image 1, {len(points2_arr)} in image 2: {len(candidate_pairs)} candidate pairs "
+                 f"out of {numberOfPoints * len(points2_arr)}. {len(matches)} matches, {number_of_correct_matches} correct, "
+                 f"in {1000 * matching_duration:.1f} ms")
+
+    matched_XYZ_arr = stereo_system.SolveXYZBatch(matching.MatchedCoordinates(points1_arr, points2_arr, matches))
+    errors = np.linalg.norm(matched_XYZ_arr - XYZ_arr[matches[:, 0]], axis=1)
+    logging.info(f"3D error of the matched points: median = {np.median(errors):.3f}, max = {np.max(errors, initial=0):.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--numberOfPoints', help="The number of 3D points. Default: 100", type=int, default=100)
+    parser.add_argument('--noiseStd', help="The standard deviation of the pixel noise. Default: 0.3", type=float, default=0.3)
+    parser.add_argument('--dropoutRate', help="The proportion of points that camera 2 misses. Default: 0.1", type=float, default=0.1)
+    parser.add_argument('--maximumDistance', help="The maximum epipolar distance of a match, in pixels. Default: 1.0", type=float, default=1.0)
+    parser.add_argument('--assignment', help="The assignment method: 'greedy' or 'optimal' (requires scipy). Default: 'greedy'", default='greedy')
+    parser.add_argument('--seed', help="The random seed. Default: 0", type=int, default=0)
+    args = parser.parse_args()
+    main(
+        args.numberOfPoints,
+        args.noiseStd,
+        args.dropoutRate,
+        args.maximumDistance,
+        args.assignment,
+        args.seed
+    )
@@ -4,7 +4,12 @@ import argparse
 import ast
 from datetime import datetime, timedelta
 import os
-from stereo_vision.grab import Grabber
+from stereo_vision.grab import Grabber, ThreadedGrabber
+from stereo_vision.image_writer import AsyncImageWriter
+from stereo_vision import instrumentation
+from stereo_vision.raw_sequence import RawSequenceWriter
+import stereo_vision.sequence_index as seq_index
+from stereo_vision.synchronization import FrameSynchronizer
 import time
 import numpy as np
 
@@ -17,12 +22,23 @@ def main(
     warmupTime,
     grabDelays,
     exposure,
-    display
+    display,
+    threadedGrabber,
+    synchronizationTolerance,
+    writerThreads,
+    writerQueueSize,
+    writerBackpressure,
+    outputFormat,
+    metricsDirectory,
+    traceEvents,
+    rawFlushPeriod
 ):
     logging.info(f"record.main()")
 
     if not os.path.exists(outputDirectory):
         os.makedirs(outputDirectory)
+    if metricsDirectory is not None:
+        instrumentation.Enable(trace=traceEvents)
 
     video_captures_id_list = []
     for camera_id in cameraIDList:
@@ -35,34 +51,106 @@ def main(
             video_capture.set(cv2.CAP_PROP_EXPOSURE, exposure)
             video_captures_id_list.append((video_capture, camera_id))
     logging.debug(f"type(video_captures_id_list) = {type(video_captures_id_list)}")
-    grabber = Grabber(video_captures_id_list, grabDelays)
+    synchronizer = None
+    if synchronizationTolerance is not None:
+        grabber = ThreadedGrabber(video_captures_id_list, buffer_size=8)
+        synchronizer = FrameSynchronizer(len(video_captures_id_list), tolerance=synchronizationTolerance)
+    elif threadedGrabber:
+        grabber = ThreadedGrabber(video_captures_id_list)
+    else:
+        grabber = Grabber(video_captures_id_list, grabDelays)
+    if isinstance(grabber, ThreadedGrabber):
+        grabber.Start()
+        if not grabber.WaitForFirstImages():
+            grabber.Stop()
+            raise ValueError(f"record.main(): The cameras {cameraIDList} did not all deliver an image")
 
     camera_names = []
     for camera_id in cameraIDList:
         camera_names.append('camera_' + str(camera_id))
 
+    image_writer = None
+    sequence_writer = None
+    last_flush_monotonic_time = time.monotonic()
+    if outputFormat == 'png':
+        image_writer = AsyncImageWriter(number_of_threads=writerThreads, queue_size=writerQueueSize,
+                                        backpressure=writerBackpressure)
+    elif outputFormat != 'raw':
+        raise ValueError(f"record.main(): Unknown output format '{outputFormat}'")
+
     warmup_is_over = False
     start_time = datetime.now()
+    start_monotonic_time = time.monotonic()
     logging.debug(f"start_time = {start_time}")
     current_time = datetime.now()
+    last_timestamps = None
     while current_time < start_time + timedelta(seconds=warmupTime) + timedelta(seconds=recordTime):
-        images = grabber.Grab()
+        if synchronizer is not None:
+            with instrumentation.Timer('record.synchronize'):
+                synchronizer.PushFrames(grabber.PopBufferedFrames())
+                time_images_list = [(start_time + timedelta(seconds=timestamps[0] - start_monotonic_time), images)
+                                    for timestamps, images in synchronizer.PopAll()]
+            if len(time_images_list) == 0:
+                time.sleep(0.001)
+        elif isinstance(grabber, ThreadedGrabber):
+            # Grab() returns the newest frame of each camera: a set is only recorded once every camera has a new frame
+            images, timestamps = grabber.GrabWithTimestamps()
+            if last_timestamps is not None and any(timestamp == last_timestamp for timestamp, last_timestamp in zip(timestamps, last_timestamps)):
+                time_images_list = []
+                time.sleep(0.001)
+            else:
+                last_timestamps = timestamps
+                time_images_list = [(start_time + timedelta(seconds=timestamps[0] - start_monotonic_time), images)]
+        else:
+            time_images_list = [(current_time, grabber.Grab())]
         if not warmup_is_over and current_time >= start_time + timedelta(seconds=warmupTime):
             warmup_is_over = True
             logging.info("Warmup is over!")
         if warmup_is_over:
-            for image_ndx in range(len(images)):
-                img_filepath = os.path.join(outputDirectory, camera_names[image_ndx] + "_" + \
-                                            str(current_time).replace(' ', '_').replace(':', '') + '.png')
-                cv2.imwrite(img_filepath, images[image_ndx])
-        if display:
+            instrumentation.Increment('record.frames', len(time_images_list))
+            for images_time, images in time_images_list:
+                with instrumentation.Timer('record.write'):
+                    if outputFormat == 'raw':
+                        if sequence_writer is None:
+                            sequence_writer = RawSequenceWriter(outputDirectory, camera_names, images[0].shape)
+                        sequence_writer.Append(images, images_time)
+                        # The header holds the number of frames: if the recording is killed, the frames after the last
+                        # flush are lost
+                        if time.monotonic() - last_flush_monotonic_time >= rawFlushPeriod:
+                            with instrumentation.Timer('record.flush'):
+                                sequence_writer.Flush()
+                            last_flush_monotonic_time = time.monotonic()
+                        continue
+                    for image_ndx in range(len(images)):
+                        img_filepath = os.path.join(outputDirectory, camera_names[image_ndx] + "_" + \
+                                                    str(images_time).replace(' ', '_').replace(':', '') + '.png')
+                        image_writer.Write(img_filepath, images[image_ndx])
+        if display and len(time_images_list) > 0:
+            images = time_images_list[-1][1]
             width = images[0].shape[1]
             composite_img = np.zeros((images[0].shape[0], len(images) * images[0].shape[1], 3), dtype=np.uint8)
             for image_ndx in range(len(images)):
                 composite_img[:, image_ndx * width: (image_ndx + 1) * width, :] = images[image_ndx]
-            cv2.imshow("Stereo images", composite_img)
-            cv2.waitKey(1)
+            with instrumentation.Timer('record.display'):
+                cv2.imshow("Stereo images", composite_img)
+                cv2.waitKey(1)
         current_time = datetime.now()
+    if image_writer is not None:
+        image_writer.Close()
+        logging.info(f"Image writer statistics: {image_writer.Statistics()}")
+        # Manifest of the recorded sequence, for a fast start-up of track_red_square.py
+        seq_index.BuildSequenceIndex(os.path.join(outputDirectory, 'camera_'), cameraIDList).Save()
+    if sequence_writer is not None:
+        sequence_writer.Close()
+        logging.info(f"Recorded {sequence_writer.number_of_frames} frames in the raw sequence '{outputDirectory}'")
+    if isinstance(grabber, ThreadedGrabber):
+        grabber.Stop()
+        logging.info(f"Grabber statistics: {grabber.Statistics()}")
+    if synchronizer is not None:
+        logging.info(f"Synchronizer statistics: {synchronizer.Statistics()}")
+    if metricsDirectory is not None:
+        instrumentation.SaveReports(metricsDirectory)
+        logging.info(f"The metrics were written to '{metricsDirectory}'")
 
 
 if __name__ == '__main__':
@@ -72,13 +160,22 @@ if __name__ == '__main__':
                         default='./output_record')
     parser.add_argument('--recordTime', help="Record time, in seconds. Default: 15.0", type=float, default=15.0)
     parser.add_argument('--warmupTime', help="Warmup time, in seconds, where no images are recorded. Default: 5.0", type=float, default=5.0)
-    parser.add_argument('--grabDelays', help="The delays, in seconds, to compensate for cameras grab speed differences. The first camera grabs without delay, and the other ones are delayed. Default: '[0]'", default='[0]')
+    parser.add_argument('--grabDelays', help="The delays, in seconds, to compensate for cameras grab speed differences. The first camera grabs without delay, and the other ones are delayed. Default: 'None'", default='None')
     parser.add_argument('--exposure', help="The value for the parameter CAP_PROP_EXPOSURE. The meaning depends on the camera model. Default: 400", type=float, default=400)
     parser.add_argument('--display', help="Display the images", action='store_true')
+    parser.add_argument('--threadedGrabber', help="Grab with one free-running capture thread per camera. The grab delays are ignored", action='store_true')
+    parser.add_argument('--synchronizationTolerance', help="If specified, the frames of a threaded grabber are paired by nearest timestamp, within this tolerance in seconds. The grab delays are ignored. Default: None", type=float, default=None)
+    parser.add_argument('--writerThreads', help="The number of image encoding threads. Default: 2", type=int, default=2)
+    parser.add_argument('--writerQueueSize', help="The maximum number of images waiting to be written. Default: 64", type=int, default=64)
+    parser.add_argument('--writerBackpressure', help="What to do when the image writer queue is full: 'block' or 'drop_oldest'. Default: 'block'", default='block')
+    parser.add_argument('--outputFormat', help="The recording format: 'png' (one file per image) or 'raw' (one memory-mapped file per camera, cf. stereo_vision.raw_sequence). Default: 'png'", default='png')
+    parser.add_argument('--metricsDirectory', help="If specified, the stage timings and counters are collected, and written to this directory as metrics.json and metrics.prom (cf. stereo_vision.instrumentation). Default: None", default=None)
+    parser.add_argument('--traceEvents', help="With --metricsDirectory, also write the timeline of the timed stages as a Chrome trace, trace.json", action='store_true')
+    parser.add_argument('--rawFlushPeriod', help="With the raw output format, the period, in seconds, of the flushes of the frames and of the header with their number. If the recording is killed, the frames after the last flush are lost. Default: 1.0", type=float, default=1.0)
     args = parser.parse_args()
     cameraIDList = ast.literal_eval(args.cameraIDList)
     grabDelays = ast.literal_eval(args.grabDelays)
-    if len(grabDelays) != len(cameraIDList) - 1:
+    if grabDelays is not None and len(grabDelays) != len(cameraIDList) - 1:
         raise ValueError(f"len(grabDelays) ({len(grabDelays)}) != len(cameraIDList) - 1 ({len(cameraIDList) - 1})")
     main(
         cameraIDList,
@@ -87,5 +184,14 @@ if __name__ == '__main__':
         args.warmupTime,
         grabDelays,
         args.exposure,
-        args.display
+        args.display,
+        args.threadedGrabber,
+        args.synchronizationTolerance,
+        args.writerThreads,
+        args.writerQueueSize,
+        args.writerBackpressure,
+        args.outputFormat,
+        args.metricsDirectory,
+        args.traceEvents,
+        args.rawFlushPeriod
     )
\ No newline at end of file
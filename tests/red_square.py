@@ -1,31 +1,203 @@
 import cv2
 import numpy as np
 import os
-import utilities.blob_analysis as blob_analysis
+from stereo_vision import instrumentation
 
 class Detector():
     def __init__(self, blue_delta=15,
                  blue_mask_dilation_kernel_size=45,
                  red_delta=50,
                  red_mask_dilation_kernel_size=13,
-                 debug_directory=None):
+                 debug_directory=None,
+                 fast_mode=False,
+                 tracking_window_half_size=60,
+                 tracking_motion_factor=2.0,
+                 minimum_blob_area=1,
+                 maximum_blob_aspect_ratio=None,
+                 blob_connectivity=8,
+                 coarse_to_fine_factor=1):
         self.blue_delta = blue_delta
         self.blue_mask_dilation_kernel_size = blue_mask_dilation_kernel_size
         self.red_delta = red_delta
         self.red_mask_dilation_kernel_size = red_mask_dilation_kernel_size
         self.debug_directory = debug_directory
-        self.blob_detector = blob_analysis.BinaryBlobDetector()
+        self.fast_mode = fast_mode
+        self.minimum_blob_area = minimum_blob_area
+        self.maximum_blob_aspect_ratio = maximum_blob_aspect_ratio
+        self.blob_connectivity = blob_connectivity
+        self.blue_dilation_erosion_kernel = np.ones((self.blue_mask_dilation_kernel_size, self.blue_mask_dilation_kernel_size), dtype=np.uint8)
+        self.red_dilation_erosion_kernel = np.ones((self.red_mask_dilation_kernel_size, self.red_mask_dilation_kernel_size), dtype=np.uint8)
+        self.buffers_capacityHW = (0, 0)
+        self.buffers = None
+        self.tracking_window_half_size = tracking_window_half_size
+        self.tracking_motion_factor = tracking_motion_factor
+        self.coarse_to_fine_factor = coarse_to_fine_factor
+        self.coarse_detector = None
+        if coarse_to_fine_factor > 1:
+            # Area averaging preserves the channel differences of uniform regions: the deltas are kept, and the kernel
+            # sizes and the minimum area are scaled to the coarse resolution
+            self.coarse_detector = Detector(blue_delta=blue_delta,
+                                            blue_mask_dilation_kernel_size=max(round(blue_mask_dilation_kernel_size / coarse_to_fine_factor), 1),
+                                            red_delta=red_delta,
+                                            red_mask_dilation_kernel_size=max(round(red_mask_dilation_kernel_size / coarse_to_fine_factor), 1),
+                                            fast_mode=fast_mode,
+                                            minimum_blob_area=max(minimum_blob_area // coarse_to_fine_factor**2, 1),
+                                            maximum_blob_aspect_ratio=maximum_blob_aspect_ratio,
+                                            blob_connectivity=blob_connectivity)
+        self.ResetTracking()
 
+    @instrumentation.Timed()
     def Detect(self, image):
+        if self.coarse_detector is not None:
+            return self._CoarseToFineDetect(image)
+        center_of_mass, bounding_box = self._DetectLargestBlob(image)
+        return center_of_mass
+
+    def _CoarseToFineDetect(self, image):
+        """
+        The largest blob is found in the image downsampled by coarse_to_fine_factor, then its center is computed at full
+        resolution, in a window around the upsampled coarse bounding box, with some slack and a margin of one morphology
+        kernel size, like the tracking window. If the full resolution blob is too close to the window edges, the full frame is
+        searched. A blob that is too small to survive the downsampling is not found.
+        """
+        factor = self.coarse_to_fine_factor
+        with instrumentation.Timer('Detector.Downsample'):
+            coarse_image = DownsampledImage(image, factor)
+        coarse_center, coarse_bounding_box = self.coarse_detector._DetectLargestBlob(coarse_image)
+        if coarse_bounding_box is None:
+            return (-1, -1)
+        # The coarse blob can be smaller than the full resolution blob: its edge pixels, averaged with the background,
+        # fall below the delta, and the scaled kernel sizes are rounded. The window gets some slack for that
+        margin = max(self.blue_mask_dilation_kernel_size, self.red_mask_dilation_kernel_size)
+        slack = 2 * factor + self.red_mask_dilation_kernel_size
+        x0 = max(coarse_bounding_box[0] * factor - slack - margin, 0)
+        y0 = max(coarse_bounding_box[1] * factor - slack - margin, 0)
+        x1 = min((coarse_bounding_box[2] + 1) * factor + slack + margin, image.shape[1])
+        y1 = min((coarse_bounding_box[3] + 1) * factor + slack + margin, image.shape[0])
+        center = self._DetectLargestBlobInWindow(image, x0, y0, x1, y1)
+        if center is None:
+            center, bounding_box = self._DetectLargestBlob(image)
+        return center
+
+    @instrumentation.Timed()
+    def DetectAll(self, image):
+        # Returns the areas (N,), the centroids (N, 2) as (x, y) and the bounding boxes (N, 4) as (x_min, y_min, x_max, y_max)
+        # of all the blobs that pass the area and aspect ratio filters, by decreasing area
+        areas, centroids, bounding_boxes = self._DetectBlobs(image)
+        order = np.argsort(-areas, kind='stable')
+        return areas[order], centroids[order], bounding_boxes[order]
+
+    def _DetectLargestBlob(self, image):
+        # Returns the center of mass (x, y) and the bounding box (x_min, y_min, x_max, y_max) of the largest blob
+        areas, centroids, bounding_boxes = self._DetectBlobs(image)
+        if len(areas) == 0:
+            return (-1, -1), None
+        largest_ndx = np.argmax(areas)
+        center_of_mass = (float(centroids[largest_ndx, 0]), float(centroids[largest_ndx, 1]))
+        bounding_box = tuple(int(coord) for coord in bounding_boxes[largest_ndx])
+        return center_of_mass, bounding_box
+
+    def _DetectBlobs(self, image):
+        blue_domination_img, blue_domination_mask, red_domination_img, red_domination_mask, red_square_mask = self.Masks(image)
+
+        # Blob analysis
+        areas, centroids, bounding_boxes = BlobStatistics(red_square_mask, self.minimum_blob_area,
+                                                          self.maximum_blob_aspect_ratio, self.blob_connectivity)
+
+        if self.debug_directory is not None:
+            blue_domination_img_filepath = os.path.join(self.debug_directory, "Detector_detect_blueDomination.png")
+            cv2.imwrite(blue_domination_img_filepath, blue_domination_img)
+            blue_domination_mask_filepath = os.path.join(self.debug_directory, "Detector_detect_blueDominationMask.png")
+            cv2.imwrite(blue_domination_mask_filepath, blue_domination_mask)
+            red_domination_img_filepath = os.path.join(self.debug_directory, "Detector_detect_redDomination.png")
+            cv2.imwrite(red_domination_img_filepath, red_domination_img)
+            red_domination_mask_filepath = os.path.join(self.debug_directory, "Detector_detect_redDominationMask.png")
+            cv2.imwrite(red_domination_mask_filepath, red_domination_mask)
+            red_square_mask_filepath = os.path.join(self.debug_directory, "Detector_detect_redMask.png")
+            cv2.imwrite(red_square_mask_filepath, red_square_mask)
+
+        return areas, centroids, bounding_boxes
+
+    @instrumentation.Timed()
+    def Track(self, image, predicted_center=None):
+        """
+        Stateful version of Detect(), for a sequence of images from the same camera. The detection runs in a window
+        centered on the position predicted from the last two detections, whose size grows with the recent motion.
+        An external prediction, e.g. the projection of a stereo_vision.trajectory_filter.TrajectoryFilter prediction,
+        can be given as predicted_center instead.
+        The window has a margin of one morphology kernel size around the area where the blob is accepted, so an accepted
+        blob gets the same center as a full-frame detection. If the blob is not found or is too close to the window
+        edges, the full frame is searched.
+        """
+        if predicted_center is not None and not np.all(np.isfinite(predicted_center)):
+            predicted_center = None  # E.g. a target that the trajectory filter does not track
+        if predicted_center is None and self.last_center is not None:
+            predicted_center = (self.last_center[0] + self.last_velocity[0], self.last_center[1] + self.last_velocity[1])
+        if predicted_center is not None:
+            margin = max(self.blue_mask_dilation_kernel_size, self.red_mask_dilation_kernel_size)
+            half_size = self.tracking_window_half_size + self.tracking_motion_factor * max(abs(self.last_velocity[0]), abs(self.last_velocity[1]))
+            x0 = max(round(predicted_center[0] - half_size - margin), 0)
+            y0 = max(round(predicted_center[1] - half_size - margin), 0)
+            x1 = min(round(predicted_center[0] + half_size + margin) + 1, image.shape[1])
+            y1 = min(round(predicted_center[1] + half_size + margin) + 1, image.shape[0])
+            center = self._DetectLargestBlobInWindow(image, x0, y0, x1, y1)
+            if center is not None:
+                self.tracking_window_hit_count += 1
+                self._UpdateTracking(center)
+                return center
+            self.tracking_window_miss_count += 1
+        self.full_frame_search_count += 1
+        center = self.Detect(image)
+        if center == (-1, -1):
+            self.lost_count += 1
+            self.last_center = None
+            self.last_velocity = (0, 0)
+        else:
+            self._UpdateTracking(center)
+        return center
+
+    def _DetectLargestBlobInWindow(self, image, x0, y0, x1, y1):
+        # The center, in image coordinates, of the largest blob in image[y0: y1, x0: x1], or None if there is no blob,
+        # or if it is closer than one morphology kernel size to a window edge, where the masks differ from the full frame
+        margin = max(self.blue_mask_dilation_kernel_size, self.red_mask_dilation_kernel_size)
+        center, bounding_box = self._DetectLargestBlob(image[y0: y1, x0: x1])
+        # The margin is not needed along the image borders
+        if bounding_box is not None and \
+                (x0 == 0 or bounding_box[0] >= margin) and (y0 == 0 or bounding_box[1] >= margin) and \
+                (x1 == image.shape[1] or bounding_box[2] < x1 - x0 - margin) and \
+                (y1 == image.shape[0] or bounding_box[3] < y1 - y0 - margin):
+            return (center[0] + x0, center[1] + y0)
+        return None
+
+    def _UpdateTracking(self, center):
+        if self.last_center is not None:
+            self.last_velocity = (center[0] - self.last_center[0], center[1] - self.last_center[1])
+        self.last_center = center
+
+    def ResetTracking(self):
+        self.last_center = None
+        self.last_velocity = (0, 0)
+        self.tracking_window_hit_count = 0
+        self.tracking_window_miss_count = 0
+        self.full_frame_search_count = 0
+        self.lost_count = 0
+
+    def TrackingStatistics(self):
+        return {'window_hits': self.tracking_window_hit_count, 'window_misses': self.tracking_window_miss_count,
+                'full_frame_searches': self.full_frame_search_count, 'lost': self.lost_count}
+
+    @instrumentation.Timed()
+    def Masks(self, image):
+        if self.fast_mode:
+            return self._FastMasks(image)
         blue_minus_green_img = image[:, :, 0].astype(float) - image[:, :, 1].astype(float)
         blue_minus_red_img = image[:, :, 0].astype(float) - image[:, :, 2].astype(float)
         blue_domination_img = np.minimum(blue_minus_red_img, blue_minus_green_img)
         _, blue_domination_mask = cv2.threshold(np.clip(blue_domination_img, 0, 255).astype(np.uint8), \
                                                  self.blue_delta, 255, cv2.THRESH_BINARY)
         # Dilate and erode
-        blue_dilation_erosion_kernel = np.ones((self.blue_mask_dilation_kernel_size, self.blue_mask_dilation_kernel_size), dtype=np.uint8)
-        blue_domination_mask = cv2.dilate(blue_domination_mask, blue_dilation_erosion_kernel)
-        blue_domination_mask = cv2.erode(blue_domination_mask, blue_dilation_erosion_kernel)
+        blue_domination_mask = cv2.dilate(blue_domination_mask, self.blue_dilation_erosion_kernel)
+        blue_domination_mask = cv2.erode(blue_domination_mask, self.blue_dilation_erosion_kernel)
 
         red_minus_green_img = image[:, :, 2].astype(float) - image[:, :, 1].astype(float)
         red_minus_blue_img = -blue_minus_red_img
@@ -33,41 +205,155 @@ class Detector():
         _, red_domination_mask = cv2.threshold(np.clip(red_domination_img, 0, 255).astype(np.uint8), \
                                                self.red_delta, 255, cv2.THRESH_BINARY)
         # Dilate and erode
-        red_dilation_erosion_kernel = np.ones((self.red_mask_dilation_kernel_size, self.red_mask_dilation_kernel_size), dtype=np.uint8)
-        red_domination_mask = cv2.dilate(red_domination_mask, red_dilation_erosion_kernel)
-        red_domination_mask = cv2.erode(red_domination_mask, red_dilation_erosion_kernel)
+        red_domination_mask = cv2.dilate(red_domination_mask, self.red_dilation_erosion_kernel)
+        red_domination_mask = cv2.erode(red_domination_mask, self.red_dilation_erosion_kernel)
 
         # Masks intersection
         red_square_mask = np.minimum(blue_domination_mask, red_domination_mask)
+        return blue_domination_img, blue_domination_mask, red_domination_img, red_domination_mask, red_square_mask
 
-        # Blob analysis
-        seedPoint_boundingBox_list, annotated_img = self.blob_detector.DetectBlobs(red_square_mask)
-        largest_points_list = None
-        highest_number_of_pixels = 0
-        for seed_point, bounding_box in seedPoint_boundingBox_list:
-            points_list = blob_analysis.PointsOfBlob(red_square_mask, seed_point, bounding_box)
-            if points_list is None:
-                number_of_pixels = 0
-            else:
-                number_of_pixels = len(points_list)
-                if number_of_pixels > highest_number_of_pixels:
-                    highest_number_of_pixels = number_of_pixels
-                    largest_points_list = points_list
-        if largest_points_list is None:
-            center_of_mass = (-1, -1)
-        else:
-            center_of_mass = blob_analysis.CenterOfMass(largest_points_list)
+    def _FastMasks(self, image):
+        """
+        Same masks as the float path, computed in uint8 with saturating subtractions into buffers that are reused
+        from one call to the next: clip(min(a - b, a - c), 0, 255) == min(sat(a - b), sat(a - c)).
+        The buffers only grow, to the largest image seen, and an image is processed in their top-left views: the tracking
+        windows, whose size changes with the motion, fit in the buffers of the first full frame.
+        The domination images are returned clipped to [0, 255]. The returned arrays are overwritten by the next call.
+        """
+        height, width = image.shape[0:2]
+        if height > self.buffers_capacityHW[0] or width > self.buffers_capacityHW[1]:
+            self.buffers_capacityHW = (max(height, self.buffers_capacityHW[0]), max(width, self.buffers_capacityHW[1]))
+            self.buffers = [np.empty(self.buffers_capacityHW, dtype=np.uint8) for _ in range(11)]
+        blue_img, green_img, red_img, difference1_img, difference2_img, blue_domination_img, red_domination_img, \
+            morphology_img, blue_domination_mask, red_domination_mask, red_square_mask = [buffer[0: height, 0: width] for buffer in self.buffers]
+        cv2.extractChannel(image, 0, dst=blue_img)
+        cv2.extractChannel(image, 1, dst=green_img)
+        cv2.extractChannel(image, 2, dst=red_img)
 
-        if self.debug_directory is not None:
-            blue_domination_img_filepath = os.path.join(self.debug_directory, "Detector_detect_blueDomination.png")
-            cv2.imwrite(blue_domination_img_filepath, blue_domination_img)
-            blue_domination_mask_filepath = os.path.join(self.debug_directory, "Detector_detect_blueDominationMask.png")
-            cv2.imwrite(blue_domination_mask_filepath, blue_domination_mask)
-            red_domination_img_filepath = os.path.join(self.debug_directory, "Detector_detect_redDomination.png")
-            cv2.imwrite(red_domination_img_filepath, red_domination_img)
-            red_domination_mask_filepath = os.path.join(self.debug_directory, "Detector_detect_redDominationMask.png")
-            cv2.imwrite(red_domination_mask_filepath, red_domination_mask)
-            red_square_mask_filepath = os.path.join(self.debug_directory, "Detector_detect_redMask.png")
-            cv2.imwrite(red_square_mask_filepath, red_square_mask)
+        cv2.subtract(blue_img, green_img, dst=difference1_img)
+        cv2.subtract(blue_img, red_img, dst=difference2_img)
+        cv2.min(difference1_img, difference2_img, dst=blue_domination_img)
+        cv2.threshold(blue_domination_img, self.blue_delta, 255, cv2.THRESH_BINARY, dst=blue_domination_mask)
+        cv2.dilate(blue_domination_mask, self.blue_dilation_erosion_kernel, dst=morphology_img)
+        cv2.erode(morphology_img, self.blue_dilation_erosion_kernel, dst=blue_domination_mask)
+
+        cv2.subtract(red_img, green_img, dst=difference1_img)
+        cv2.subtract(red_img, blue_img, dst=difference2_img)
+        cv2.min(difference1_img, difference2_img, dst=red_domination_img)
+        cv2.threshold(red_domination_img, self.red_delta, 255, cv2.THRESH_BINARY, dst=red_domination_mask)
+        cv2.dilate(red_domination_mask, self.red_dilation_erosion_kernel, dst=morphology_img)
+        cv2.erode(morphology_img, self.red_dilation_erosion_kernel, dst=red_domination_mask)
+
+        cv2.min(blue_domination_mask, red_domination_mask, dst=red_square_mask)
+        return blue_domination_img, blue_domination_mask, red_domination_img, red_domination_mask, red_square_mask
+
+class MultiTargetTracker():
+    def __init__(self, maximum_distance=50, maximum_number_of_missed_frames=5):
+        """
+        Gives stable IDs to the blobs of a sequence of images from the same camera. Each target has a position predicted
+        from its last two positions. The detections of a frame are associated with the targets by increasing distance to
+        the predictions, up to maximum_distance pixels. The unassociated detections start new targets, and a target that
+        is not seen for more than maximum_number_of_missed_frames frames is dropped. The IDs start at 1 and are never reused.
+        """
+        self.maximum_distance = maximum_distance
+        self.maximum_number_of_missed_frames = maximum_number_of_missed_frames
+        self.Reset()
+
+    def Reset(self):
+        self.target_ids = np.zeros(0, dtype=int)
+        self.positions = np.zeros((0, 2))
+        self.velocities = np.zeros((0, 2))
+        self.missed_frames = np.zeros(0, dtype=int)
+        self.next_target_id = 1
+
+    def Update(self, centroids):
+        # Returns the (N,) target IDs of the (N, 2) centroids
+        centroids = np.asarray(centroids, dtype=float).reshape(-1, 2)
+        detection_target_ids = np.zeros(len(centroids), dtype=int)
+        predictions = self.positions + self.velocities
+        # (n_targets, N) distances; the pairs are taken by increasing distance
+        distances = np.linalg.norm(predictions[:, None, :] - centroids[None, :, :], axis=2)
+        target_ndxs, detection_ndxs = np.nonzero(distances <= self.maximum_distance)
+        order = np.argsort(distances[target_ndxs, detection_ndxs], kind='stable')
+        is_target_associated = np.zeros(len(self.target_ids), dtype=bool)
+        for target_ndx, detection_ndx in zip(target_ndxs[order], detection_ndxs[order]):
+            if not is_target_associated[target_ndx] and detection_target_ids[detection_ndx] == 0:
+                is_target_associated[target_ndx] = True
+                detection_target_ids[detection_ndx] = self.target_ids[target_ndx]
+                # The velocity is only known once a target was seen in two consecutive frames
+                self.velocities[target_ndx] = centroids[detection_ndx] - self.positions[target_ndx] if self.missed_frames[target_ndx] == 0 else 0
+                self.positions[target_ndx] = centroids[detection_ndx]
+        self.missed_frames[is_target_associated] = 0
+        self.missed_frames[~is_target_associated] += 1
+        self.velocities[~is_target_associated] = 0
+        is_kept = self.missed_frames <= self.maximum_number_of_missed_frames
+        new_detection_ndxs = np.flatnonzero(detection_target_ids == 0)
+        new_target_ids = np.arange(self.next_target_id, self.next_target_id + len(new_detection_ndxs))
+        self.next_target_id += len(new_detection_ndxs)
+        detection_target_ids[new_detection_ndxs] = new_target_ids
+        self.target_ids = np.concatenate([self.target_ids[is_kept], new_target_ids])
+        self.positions = np.concatenate([self.positions[is_kept], centroids[new_detection_ndxs]])
+        self.velocities = np.concatenate([self.velocities[is_kept], np.zeros((len(new_detection_ndxs), 2))])
+        self.missed_frames = np.concatenate([self.missed_frames[is_kept], np.zeros(len(new_detection_ndxs), dtype=int)])
+        return detection_target_ids
+
+@instrumentation.Timed()
+def BlobStatistics(mask, minimum_area=1, maximum_aspect_ratio=None, connectivity=8):
+    """
+    Labels the connected components of a binary mask in a single pass.
+    Returns the areas (N,), the centroids (N, 2) as (x, y), and the bounding boxes (N, 4) as inclusive
+    (x_min, y_min, x_max, y_max) of the blobs that have at least minimum_area pixels and, if maximum_aspect_ratio is
+    not None, a bounding box aspect ratio (long side / short side) not above maximum_aspect_ratio.
+    """
+    number_of_labels, labels_img, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=connectivity)
+    # Label 0 is the background
+    stats = stats[1:]
+    centroids = centroids[1:]
+    areas = stats[:, cv2.CC_STAT_AREA]
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    is_kept = areas >= minimum_area
+    if maximum_aspect_ratio is not None:
+        is_kept &= np.maximum(widths, heights) <= maximum_aspect_ratio * np.minimum(widths, heights)
+    bounding_boxes = np.stack([stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP],
+                               stats[:, cv2.CC_STAT_LEFT] + widths - 1, stats[:, cv2.CC_STAT_TOP] + heights - 1], axis=1)
+    return areas[is_kept], centroids[is_kept], bounding_boxes[is_kept]
+
+def DownsampledImage(image, factor):
+    # Area averaging by an integer factor, as a pyramid of halvings for the factors of 2, that OpenCV area-averages
+    # much faster than the other factors. The image is first cropped to a multiple of factor: with a non-integer
+    # ratio, the area averaging takes the slow general path. The cropped border is less than factor pixels wide
+    image = image[0: image.shape[0] - image.shape[0] % factor, 0: image.shape[1] - image.shape[1] % factor]
+    remaining_factor = factor
+    while remaining_factor % 2 == 0:
+        image = cv2.resize(image, (image.shape[1] // 2, image.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        remaining_factor //= 2
+    if remaining_factor > 1:
+        image = cv2.resize(image, (image.shape[1] // remaining_factor, image.shape[0] // remaining_factor), interpolation=cv2.INTER_AREA)
+    return image
 
-        return center_of_mass
\ No newline at end of file
+def SyntheticImage(image_sizeHW, center, red_square_side=30, blue_square_side=150, noise_std=8.0, supersampling=8, seed=None):
+    """
+    Grey noisy image with a blue square holding a red square, both centered on the sub-pixel center (x, y).
+    The squares are rendered on a supersampled patch that is then area-averaged, so the red square center of mass
+    is center, up to the noise.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.clip(rng.normal(110, noise_std, (image_sizeHW[0], image_sizeHW[1], 3)), 0, 255).astype(np.uint8)
+    half_patch_side = blue_square_side // 2 + 2
+    patch_x0 = int(np.floor(center[0])) - half_patch_side
+    patch_y0 = int(np.floor(center[1])) - half_patch_side
+    patch_side = 2 * half_patch_side + 1
+    if patch_x0 < 0 or patch_y0 < 0 or patch_x0 + patch_side > image_sizeHW[1] or patch_y0 + patch_side > image_sizeHW[0]:
+        raise ValueError(f"SyntheticImage(): The blue square around center {center} does not fit in the image")
+    patch = np.zeros((patch_side * supersampling, patch_side * supersampling, 3), dtype=np.uint8)
+    patch[:, :] = (110, 110, 110)
+    center_in_patch = ((center[0] - patch_x0 + 0.5) * supersampling, (center[1] - patch_y0 + 0.5) * supersampling)
+    for side, color in [(blue_square_side, (200, 60, 40)), (red_square_side, (60, 40, 220))]:
+        half_side = side * supersampling / 2
+        cv2.rectangle(patch, (round(center_in_patch[0] - half_side), round(center_in_patch[1] - half_side)),
+                      (round(center_in_patch[0] + half_side) - 1, round(center_in_patch[1] + half_side) - 1), color, thickness=-1)
+    patch = cv2.resize(patch, (patch_side, patch_side), interpolation=cv2.INTER_AREA)
+    noise = rng.normal(0, noise_std, patch.shape)
+    image[patch_y0: patch_y0 + patch_side, patch_x0: patch_x0 + patch_side] = np.clip(patch + noise, 0, 255).astype(np.uint8)
+    return image
\ No newline at end of file
@@ -3,10 +3,17 @@ import cv2
 import logging
 import argparse
 import os
+import stereo_vision.calibration as calibration
+import stereo_vision.matching as matching
 import stereo_vision.projection as proj
+import stereo_vision.raw_sequence as raw_sequence
+import stereo_vision.sequence_index as seq_index
+from stereo_vision.trajectory_filter import TrajectoryFilter
+import stereo_vision.undistortion as undistortion
 import pickle
 import pandas as pd
 import imageio
+import numpy as np
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
 
@@ -17,75 +24,296 @@ def main(
     projectionMatrix2Filepath,
     coordinatesFilepath,
     radialDistortion1Filepath,
-    radialDistortion2Filepath
+    radialDistortion2Filepath,
+    inputSequenceDirectory,
+    skipAnnotation,
+    animationFormat,
+    animationDecimation,
+    animationScale,
+    refineTriangulation,
+    calibrationBundleFilepath,
+    undistortionMapsDirectory,
+    filterModel,
+    filterProcessNoise,
+    filterMeasurementNoise,
+    animationFps,
+    animationGifChunkLength,
+    targetMatchingMaximumDistance
 ):
     logging.info("solve_tracked_coords.main()")
 
     if not os.path.exists(outputDirectory):
         os.makedirs(outputDirectory)
 
-    timestamp_imageFilepath_list = TimestampAndImageFilepaths(inputImagesFilepathPrefix)
-
-    # Load the projection matrices
-    P1 = None
-    P2 = None
-    with open(projectionMatrix1Filepath, 'rb') as P1_file:
-        P1 = pickle.load(P1_file)
-    with open(projectionMatrix2Filepath, 'rb') as P2_file:
-        P2 = pickle.load(P2_file)
-    projection_matrices = [P1, P2]
-    stereo_system = proj.StereoVisionSystem(projection_matrices)
-
-    # Load the coordinates
-    coords_df = pd.read_csv(coordinatesFilepath)
-
-    # Load the radial distortion compensation models
-    radial_dDistortion1 = None
-    radial_dDistortion2 = None
-    with open(radialDistortion1Filepath, 'rb') as radial_dist1_file:
-        radial_dDistortion1 = pickle.load(radial_dist1_file)
-    with open(radialDistortion2Filepath, 'rb') as radial_dist2_file:
-        radial_dDistortion2 = pickle.load(radial_dist2_file)
-
-    annotated_images_list = []
-    for timestamp, image_filepath in timestamp_imageFilepath_list:
-        row = coords_df[coords_df['timestamp'] == timestamp]
-        if len(row) != 1:
-            raise ValueError(f"len(row) ({len(row)}) != 1 for timestamp '{timestamp}'")
-        #logging.debug(f"row: {row}")
-        coords = [(row.iloc[0]['x_1'], row.iloc[0]['y_1']), (row.iloc[0]['x_2'], row.iloc[0]['y_2'])]
-        # Compensate the radial distortion
-        coords_1 = radial_dDistortion1.UndistortPoint(coords[0])
-        coords_2 = radial_dDistortion2.UndistortPoint(coords[1])
-        coords = [coords_1, coords_2]
-        XYZ = stereo_system.SolveXYZ(coords)
+    calibration_metadata = {}
+    if calibrationBundleFilepath is not None:
+        calibration_bundle = calibration.CalibrationBundle(calibrationBundleFilepath)
+        stereo_system = calibration_bundle.StereoVisionSystem()
+        radial_dDistortion1, radial_dDistortion2 = calibration_bundle.DistortionModels()
+        calibration_metadata = calibration_bundle.metadata
+    else:
+        # Load the projection matrices
+        P1 = None
+        P2 = None
+        with open(projectionMatrix1Filepath, 'rb') as P1_file:
+            P1 = pickle.load(P1_file)
+        with open(projectionMatrix2Filepath, 'rb') as P2_file:
+            P2 = pickle.load(P2_file)
+        projection_matrices = [P1, P2]
+        stereo_system = proj.StereoVisionSystem(projection_matrices)
+
+        # Load the radial distortion compensation models
+        radial_dDistortion1 = None
+        radial_dDistortion2 = None
+        with open(radialDistortion1Filepath, 'rb') as radial_dist1_file:
+            radial_dDistortion1 = pickle.load(radial_dist1_file)
+        with open(radialDistortion2Filepath, 'rb') as radial_dist2_file:
+            radial_dDistortion2 = pickle.load(radial_dist2_file)
+
+    # Load the coordinates, and triangulate all the rows at once
+    coords_df = pd.read_csv(coordinatesFilepath, dtype={'timestamp': str})
+    undistortion_maps = None
+    if undistortionMapsDirectory is not None:
+        image_sizesHW = CameraImageSizesHW(inputImagesFilepathPrefix, inputSequenceDirectory, calibration_metadata, 2)
+        undistortion_maps = [undistortion.LoadOrBuildUndistortionMaps(radial_distortion, image_sizeHW, undistortionMapsDirectory)
+                             for radial_distortion, image_sizeHW in zip([radial_dDistortion1, radial_dDistortion2], image_sizesHW)]
+    if 'target_id' in coords_df.columns:
+        # The long format of track_red_square.py --multiTarget: one trajectory is solved per pair of camera targets
+        coords_df = PairTargets(coords_df, [radial_dDistortion1, radial_dDistortion2], stereo_system,
+                                targetMatchingMaximumDistance, undistortion_maps)
+    undistorted_coords_arr, XYZ_arr, reprojection_errors_arr = SolveTrajectory(coords_df, [radial_dDistortion1, radial_dDistortion2],
+                                                                               stereo_system, refineTriangulation, undistortion_maps)
+    trajectory_df = pd.DataFrame({'timestamp': coords_df['timestamp'], 'X': XYZ_arr[:, 0], 'Y': XYZ_arr[:, 1], 'Z': XYZ_arr[:, 2]})
+    if 'target_id' in coords_df.columns:
+        trajectory_df.insert(1, 'target_id', coords_df['target_id'].to_numpy())
+    if reprojection_errors_arr is not None:
+        trajectory_df['reprojection_error'] = reprojection_errors_arr
+    if filterModel is not None:
+        # One filter per target
+        filtered_XYZ_arr = np.full(XYZ_arr.shape, np.nan)
+        target_ids_arr = coords_df['target_id'].to_numpy() if 'target_id' in coords_df.columns else np.zeros(len(coords_df), dtype=int)
+        for target_id in np.unique(target_ids_arr):
+            row_ndxs = np.flatnonzero(target_ids_arr == target_id)
+            trajectory_filter = TrajectoryFilter(model=filterModel, process_noise=filterProcessNoise, measurement_noise=filterMeasurementNoise)
+            filtered_XYZ_arr[row_ndxs] = FilterTrajectory(coords_df['timestamp'].iloc[row_ndxs], XYZ_arr[row_ndxs], trajectory_filter)
+            logging.info(f"Trajectory filter statistics of the target {target_id}: {trajectory_filter.Statistics()}")
+        trajectory_df['X_filtered'] = filtered_XYZ_arr[:, 0]
+        trajectory_df['Y_filtered'] = filtered_XYZ_arr[:, 1]
+        trajectory_df['Z_filtered'] = filtered_XYZ_arr[:, 2]
+    trajectory_df.to_csv(os.path.join(outputDirectory, "trajectory.csv"), index=False)
+
+    if skipAnnotation:
+        return
+    if animationDecimation < 1:
+        raise ValueError(f"animationDecimation ({animationDecimation}) < 1")
+    sequence_reader = None
+    if inputSequenceDirectory is not None:
+        # The images to annotate are the camera 1 frames of the raw sequence
+        sequence_reader = raw_sequence.RawSequenceReader(inputSequenceDirectory)
+        timestamp_imageFilepath_list = [(sequence_reader.TimestampLabel(frame_ndx), frame_ndx) for frame_ndx in range(len(sequence_reader))]
+    else:
+        timestamp_imageFilepath_list = TimestampAndImageFilepaths(inputImagesFilepathPrefix)
+    # A timestamp has one row per target in multi-target mode
+    timestamp_to_rowNdxs = {}
+    for row_ndx, timestamp in enumerate(coords_df['timestamp']):
+        timestamp_to_rowNdxs.setdefault(timestamp, []).append(row_ndx)
+    if not 'target_id' in coords_df.columns and len(timestamp_to_rowNdxs) < len(coords_df):
+        raise ValueError(f"The coordinates file '{coordinatesFilepath}' has duplicate timestamps")
+    # The mp4 frames are encoded as they are produced, while the gif frames are kept in memory until the file is
+    # written. With animationGifChunkLength, the memory is bounded by this number of frames
+    with AnimationWriter(os.path.join(outputDirectory, "animation"), animationFormat, animationFps, animationGifChunkLength) as animation_writer:
+        for image_ndx in range(len(timestamp_imageFilepath_list)):
+            timestamp, image_filepath = timestamp_imageFilepath_list[image_ndx]
+            annotated_img = AnnotateImage(timestamp, image_filepath, sequence_reader, timestamp_to_rowNdxs,
+                                          coordinatesFilepath, XYZ_arr, undistorted_coords_arr)
+            cv2.imwrite(os.path.join(outputDirectory, timestamp + ".png"), annotated_img)
+            if image_ndx % animationDecimation == 0:
+                if animationScale != 1.0:
+                    annotated_img = cv2.resize(annotated_img, None, fx=animationScale, fy=animationScale, interpolation=cv2.INTER_AREA)
+                animation_writer.Append(annotated_img)
+
+class AnimationWriter():
+    """
+    Writes the BGR images of an animation. 'gif' writes all the frames to animation_filepath_prefix + '.gif' when it
+    is closed, since imageio buffers them anyway. With gif_chunk_length, a file of at most gif_chunk_length frames is
+    written at a time instead: animation_filepath_prefix + '_000.gif', '_001.gif', ... 'mp4' streams the frames to
+    animation_filepath_prefix + '.mp4' with cv2.VideoWriter. With fps = None, the gif frames have the imageio default
+    duration, and the video is at 10 fps.
+    """
+    def __init__(self, animation_filepath_prefix, animation_format='gif', fps=None, gif_chunk_length=None):
+        if animation_format not in ['mp4', 'gif']:
+            raise ValueError(f"AnimationWriter.__init__(): Unsupported animation format '{animation_format}'. The supported formats are 'mp4' and 'gif'")
+        if fps is not None and fps <= 0:
+            raise ValueError(f"AnimationWriter.__init__(): fps ({fps}) <= 0")
+        if gif_chunk_length is not None and gif_chunk_length < 1:
+            raise ValueError(f"AnimationWriter.__init__(): gif_chunk_length ({gif_chunk_length}) < 1")
+        self.animation_filepath_prefix = animation_filepath_prefix
+        self.animation_format = animation_format
+        self.fps = fps
+        self.gif_chunk_length = gif_chunk_length
+        self.video_writer = None
+        self.gif_frames = []
+        self.number_of_gif_chunks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+        return False
+
+    def Append(self, image):
+        if self.animation_format == 'mp4':
+            if self.video_writer is None:
+                # The frame size is fixed by the first image
+                self.video_sizeWH = (image.shape[1], image.shape[0])
+                self.video_writer = cv2.VideoWriter(self.animation_filepath_prefix + ".mp4", cv2.VideoWriter_fourcc(*'mp4v'),
+                                                    self.fps if self.fps is not None else 10.0, self.video_sizeWH)
+                if not self.video_writer.isOpened():
+                    raise ValueError(f"AnimationWriter.Append(): Could not open '{self.animation_filepath_prefix}.mp4' for writing")
+            if (image.shape[1], image.shape[0]) != self.video_sizeWH:
+                raise ValueError(f"AnimationWriter.Append(): The image size {image.shape[1]}x{image.shape[0]} is not the video size {self.video_sizeWH[0]}x{self.video_sizeWH[1]}")
+            self.video_writer.write(image)
+        else:
+            self.gif_frames.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))  # imageio expects RGB images
+            if self.gif_chunk_length is not None and len(self.gif_frames) >= self.gif_chunk_length:
+                self._WriteGifChunk()
+
+    def Close(self):
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+        if len(self.gif_frames) > 0:
+            self._WriteGifChunk()
+
+    def _WriteGifChunk(self):
+        if self.gif_chunk_length is None:
+            gif_filepath = self.animation_filepath_prefix + ".gif"
+        else:
+            gif_filepath = f"{self.animation_filepath_prefix}_{self.number_of_gif_chunks:03d}.gif"
+        if self.fps is None:
+            imageio.mimsave(gif_filepath, self.gif_frames)
+        else:
+            imageio.mimsave(gif_filepath, self.gif_frames, duration=1000 / self.fps)
+        self.number_of_gif_chunks += 1
+        self.gif_frames = []
+
+def AnnotateImage(timestamp, image_filepath, sequence_reader, timestamp_to_rowNdxs, coordinatesFilepath, XYZ_arr, undistorted_coords_arr):
+    if not timestamp in timestamp_to_rowNdxs:
+        raise ValueError(f"Timestamp '{timestamp}' was not found in the coordinates file '{coordinatesFilepath}'")
+    if sequence_reader is not None:
+        image = sequence_reader.Frame(0, image_filepath)
+    else:
         image = cv2.imread(image_filepath)
-        annotated_img = copy.deepcopy(image)
-        uv = coords[0]
-        cv2.putText(annotated_img, "({:.1f}, {:.1f}, {:.1f})".format(XYZ[0], XYZ[1], XYZ[2]), (round(uv[0]) + 10, round(uv[1]) - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), thickness=2)
-        cv2.imwrite(os.path.join(outputDirectory, timestamp + ".png"), annotated_img)
-        annotated_images_list.append(cv2.cvtColor(annotated_img, cv2.COLOR_BGR2RGB))  # imageio expects RGB images
+    annotated_img = copy.deepcopy(image)
+    for row_ndx in timestamp_to_rowNdxs[timestamp]:
+        XYZ = XYZ_arr[row_ndx]
+        uv = undistorted_coords_arr[row_ndx, 0]
+        if np.all(np.isfinite(XYZ)):
+            cv2.putText(annotated_img, "({:.1f}, {:.1f}, {:.1f})".format(XYZ[0], XYZ[1], XYZ[2]), (round(uv[0]) + 10, round(uv[1]) - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), thickness=2)
+    return annotated_img
+
+def SolveTrajectory(coords_df, radial_distortions, stereo_system, refine=False, undistortion_maps=None):
+    # Returns the undistorted coordinates (N, n_cameras, 2) and the 3D points (N, 3) of the rows of coords_df.
+    # The rows where a camera did not detect the target give NaN. With refine, the 3D points minimize the reprojection
+    # error, which is returned as the (N,) maximum over the cameras, in pixels. Otherwise, the returned errors are None.
+    # If undistortion_maps is not None, the points are undistorted by lookup in the maps instead of with the models
+    undistorted_coords_arr = np.stack([UndistortCameraPoints(coords_df[[f"x_{camera_ndx + 1}", f"y_{camera_ndx + 1}"]].to_numpy(),
+                                                             camera_ndx, radial_distortions, undistortion_maps)
+                                       for camera_ndx in range(len(radial_distortions))], axis=1)
+    is_valid = np.all(np.isfinite(undistorted_coords_arr), axis=(1, 2))
+    XYZ_arr = np.full((len(coords_df), 3), np.nan)
+    XYZ_arr[is_valid] = stereo_system.SolveXYZBatch(undistorted_coords_arr[is_valid])
+    if not refine:
+        return undistorted_coords_arr, XYZ_arr, None
+    reprojection_errors_arr = np.full(len(coords_df), np.nan)
+    XYZ_arr[is_valid], camera_reprojection_errors_arr, convergence_statistics = stereo_system.RefineXYZBatch(
+        undistorted_coords_arr[is_valid], XYZ_arr[is_valid])
+    reprojection_errors_arr[is_valid] = np.max(camera_reprojection_errors_arr, axis=1)
+    logging.info(f"SolveTrajectory(): Refinement statistics: {convergence_statistics}")
+    return undistorted_coords_arr, XYZ_arr, reprojection_errors_arr
+
+def UndistortCameraPoints(coords_arr, camera_ndx, radial_distortions, undistortion_maps=None):
+    if undistortion_maps is not None:
+        return undistortion_maps[camera_ndx].UndistortPoints(coords_arr)
+    return undistortion.UndistortPoints(radial_distortions[camera_ndx], coords_arr)
+
+def PairTargets(targets_df, radial_distortions, stereo_system, maximum_distance, undistortion_maps=None):
+    """
+    Converts the long format coordinates of two cameras, with the columns timestamp, camera, target_id, x, y, to one
+    row per pair of targets and timestamp, with the columns timestamp, target_id, x_1, y_1, x_2, y_2. The target IDs
+    are per camera, so the targets of camera 1 and camera 2 are paired by a vote: at each timestamp, the undistorted
+    blobs are matched with the epipolar constraint (cf. stereo_vision.matching.MatchPoints()), and each match is a vote
+    for the pair of their IDs. The pairs are then taken by decreasing number of votes, each target in one pair at most.
+    The pairs are numbered from 0, and the coordinates at a timestamp where a target was not detected are NaN.
+    """
+    camera_numbers = sorted(targets_df['camera'].unique().tolist())
+    if not set(camera_numbers) <= {1, 2}:
+        raise ValueError(f"PairTargets(): The camera numbers {camera_numbers} are not in [1, 2]")
+    targets_df = targets_df.reset_index(drop=True)
+    cameras_arr = targets_df['camera'].to_numpy()
+    target_ids_arr = targets_df['target_id'].to_numpy()
+    undistorted_xy_arr = np.full((len(targets_df), 2), np.nan)
+    for camera_ndx in range(2):
+        row_ndxs = np.flatnonzero(cameras_arr == camera_ndx + 1)
+        undistorted_xy_arr[row_ndxs] = UndistortCameraPoints(targets_df[['x', 'y']].to_numpy()[row_ndxs], camera_ndx,
+                                                             radial_distortions, undistortion_maps)
+    F = matching.FundamentalMatrix(stereo_system.projection_matrices_list[0], stereo_system.projection_matrices_list[1])
+    pair_to_votes = {}
+    for timestamp, row_ndxs in targets_df.groupby('timestamp', sort=False).indices.items():
+        camera_row_ndxs = [row_ndxs[cameras_arr[row_ndxs] == camera_ndx + 1] for camera_ndx in range(2)]
+        if len(camera_row_ndxs[0]) == 0 or len(camera_row_ndxs[1]) == 0:
+            continue
+        matches, costs = matching.MatchPoints(F, undistorted_xy_arr[camera_row_ndxs[0]], undistorted_xy_arr[camera_row_ndxs[1]], maximum_distance)
+        for i, j in matches.tolist():
+            pair = (int(target_ids_arr[camera_row_ndxs[0][i]]), int(target_ids_arr[camera_row_ndxs[1][j]]))
+            pair_to_votes[pair] = pair_to_votes.get(pair, 0) + 1
+    pairs = []
+    for pair in sorted(pair_to_votes.keys(), key=lambda pair: (-pair_to_votes[pair], pair)):
+        if all(pair[0] != other_pair[0] and pair[1] != other_pair[1] for other_pair in pairs):
+            pairs.append(pair)
+    logging.info(f"PairTargets(): {len(pairs)} pairs of targets (camera 1 ID, camera 2 ID): {pairs}, with {[pair_to_votes[pair] for pair in pairs]} votes")
+
+    pair_dfs = [pd.DataFrame({'timestamp': pd.Series(dtype=str), 'target_id': pd.Series(dtype=int)})]
+    for target_id, camera_target_ids in enumerate(pairs):
+        camera_dfs = []
+        for camera_ndx in range(2):
+            camera_df = targets_df[(cameras_arr == camera_ndx + 1) & (target_ids_arr == camera_target_ids[camera_ndx])]
+            camera_dfs.append(camera_df[['timestamp', 'x', 'y']].rename(columns={'x': f"x_{camera_ndx + 1}", 'y': f"y_{camera_ndx + 1}"}))
+        pair_df = camera_dfs[0].merge(camera_dfs[1], on='timestamp', how='outer').sort_values('timestamp')
+        pair_df.insert(1, 'target_id', target_id)
+        pair_dfs.append(pair_df)
+    return pd.concat(pair_dfs, ignore_index=True).reindex(columns=['timestamp', 'target_id', 'x_1', 'y_1', 'x_2', 'y_2'])
+
+def FilterTrajectory(timestamp_labels, XYZ_arr, trajectory_filter):
+    # Runs the filter over the rows of XYZ_arr, in the order of the timestamps. The NaN rows are bridged by the prediction
+    timestamps = np.array([raw_sequence.ParseTimestampLabel(timestamp_label) for timestamp_label in timestamp_labels])
+    filtered_XYZ_arr = np.full(XYZ_arr.shape, np.nan)
+    for row_ndx in np.argsort(timestamps, kind='stable'):
+        positions, is_accepted = trajectory_filter.Update(timestamps[row_ndx], XYZ_arr[row_ndx: row_ndx + 1])
+        filtered_XYZ_arr[row_ndx] = positions[0]
+    return filtered_XYZ_arr
 
-    # Build an animated gif
-    animated_gif_filepath = os.path.join(outputDirectory, "animation.gif")
-    imageio.mimsave(animated_gif_filepath, annotated_images_list)
+def CameraImageSizesHW(images_filepath_prefix, sequence_directory, calibration_metadata, number_of_cameras):
+    # The (Height, Width) of the camera images: from the raw sequence, from the calibration bundle metadata, or else from
+    # the images to annotate, i.e. the track_red_square.py mosaics, where the camera images are side by side
+    if sequence_directory is not None:
+        return [tuple(raw_sequence.RawSequenceReader(sequence_directory).image_shapeHWC[0:2])] * number_of_cameras
+    if 'image_sizesHW' in calibration_metadata:
+        return [tuple(image_sizeHW) for image_sizeHW in calibration_metadata['image_sizesHW']]
+    timestamp_imageFilepath_list = TimestampAndImageFilepaths(images_filepath_prefix)
+    if len(timestamp_imageFilepath_list) == 0:
+        raise ValueError(f"CameraImageSizesHW(): No image starts with '{images_filepath_prefix}'")
+    mosaic_sizeHW = cv2.imread(timestamp_imageFilepath_list[0][1]).shape[0:2]
+    if mosaic_sizeHW[1] % number_of_cameras != 0:
+        raise ValueError(f"CameraImageSizesHW(): The width of the mosaic '{timestamp_imageFilepath_list[0][1]}' ({mosaic_sizeHW[1]}) is not a multiple of the number of cameras ({number_of_cameras})")
+    return [(mosaic_sizeHW[0], mosaic_sizeHW[1] // number_of_cameras)] * number_of_cameras
 
 def TimestampAndImageFilepaths(images_filepath_prefix):
-    extensions = ['.PNG']
-    timestamp_imageFilepath_list = []
-    images_directory = os.path.dirname(images_filepath_prefix)
-    filepaths_in_directory = [os.path.join(images_directory, f) for f in os.listdir(images_directory) \
-                              if os.path.isfile(os.path.join(images_directory, f))]
-
-    image_filepaths = [filepath for filepath in filepaths_in_directory \
-                       if filepath.upper()[-4:] in extensions
-                       and filepath.startswith(images_filepath_prefix)]
-    for filepath in image_filepaths:
-        timestamp = filepath[len(images_filepath_prefix): -4]
-        timestamp_imageFilepath_list.append((timestamp, filepath))
-    # Sort by increasing timestamp
-    timestamp_imageFilepath_list.sort(key=lambda x: x[0])
+    sequence_index = seq_index.LoadOrBuildSequenceIndex(images_filepath_prefix)
+    # Sorted by increasing timestamp
+    timestamp_imageFilepath_list = [(timestamp, sequence_index.Filepaths(timestamp)[0]) for timestamp in sequence_index.CompleteTimestamps()]
     #logging.debug(f"timestamp_imageFilepath_list = {timestamp_imageFilepath_list}")
     return timestamp_imageFilepath_list
 
@@ -106,6 +334,20 @@ if __name__ == '__main__':
                         default='./radial_distortion/calibration_left.pkl')
     parser.add_argument('--radialDistortion2Filepath', help="The filepath for the radial distortion compensation model for camera 2. Default: './radial_distortion/calibration_right.pkl'",
                         default='./radial_distortion/calibration_right.pkl')
+    parser.add_argument('--inputSequenceDirectory', help="If specified, the images are read from this raw sequence directory instead of the png files starting with inputImagesFilepathPrefix. Default: None", default=None)
+    parser.add_argument('--skipAnnotation', help="Only write the 3D trajectory file, without the annotated images and the animation", action='store_true')
+    parser.add_argument('--animationFormat', help="The animation file format: 'gif', written to animation.gif, or 'mp4', streamed to animation.mp4 without keeping the frames in memory. Default: 'gif'", default='gif')
+    parser.add_argument('--animationDecimation', help="Keep one annotated image out of this number in the animation. Default: 1", type=int, default=1)
+    parser.add_argument('--animationScale', help="The scale factor of the animation images. Default: 1.0", type=float, default=1.0)
+    parser.add_argument('--refineTriangulation', help="Refine the 3D points by minimizing their reprojection error. The trajectory file gets a 'reprojection_error' column", action='store_true')
+    parser.add_argument('--calibrationBundleFilepath', help="If specified, the projection matrices and the radial distortion models are loaded from this calibration bundle (cf. stereo_vision.calibration), instead of the pickle files. Default: None", default=None)
+    parser.add_argument('--undistortionMapsDirectory', help="If specified, the points are undistorted by lookup in precomputed maps, cached in this directory (cf. stereo_vision.undistortion.UndistortionMaps). Default: None", default=None)
+    parser.add_argument('--filterModel', help="If specified, the trajectory is also smoothed by a Kalman filter, in the columns X_filtered, Y_filtered, Z_filtered: 'constant_velocity' or 'constant_acceleration'. Default: None", default=None)
+    parser.add_argument('--filterProcessNoise', help="The process noise spectral density of the trajectory filter. Default: 1000.0", type=float, default=1000.0)
+    parser.add_argument('--filterMeasurementNoise', help="The standard deviation of the triangulated positions, for the trajectory filter. Default: 1.0", type=float, default=1.0)
+    parser.add_argument('--animationFps', help="If specified, the frame rate of the animation. Default: None, i.e. the imageio default frame duration for a gif, and 10 fps for an mp4", type=float, default=None)
+    parser.add_argument('--animationGifChunkLength', help="If specified, the gif frames are written in files of at most this number of frames, animation_000.gif, animation_001.gif, ..., to bound the memory. Default: None, i.e. a single animation.gif", type=int, default=None)
+    parser.add_argument('--targetMatchingMaximumDistance', help="For a multi-target coordinates file (track_red_square.py --multiTarget), the maximum epipolar distance, in pixels, of the blobs matched to pair the targets of the two cameras. Default: 5.0", type=float, default=5.0)
     args = parser.parse_args()
 
     main(
@@ -115,5 +357,19 @@ if __name__ == '__main__':
         args.projectionMatrix2Filepath,
         args.coordinatesFilepath,
         args.radialDistortion1Filepath,
-        args.radialDistortion2Filepath
+        args.radialDistortion2Filepath,
+        args.inputSequenceDirectory,
+        args.skipAnnotation,
+        args.animationFormat,
+        args.animationDecimation,
+        args.animationScale,
+        args.refineTriangulation,
+        args.calibrationBundleFilepath,
+        args.undistortionMapsDirectory,
+        args.filterModel,
+        args.filterProcessNoise,
+        args.filterMeasurementNoise,
+        args.animationFps,
+        args.animationGifChunkLength,
+        args.targetMatchingMaximumDistance
     )
\ No newline at end of file
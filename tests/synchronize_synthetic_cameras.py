@@ -0,0 +1,96 @@
+import logging
+import argparse
+import ast
+import time
+import numpy as np
+from stereo_vision.grab import Grabber, ThreadedGrabber
+from stereo_vision.synchronization import FrameSynchronizer
+from stereo_vision.synthetic_camera import SyntheticCamera
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        duration,
+        fps,
+        jitterStd,
+        latencies,
+        phaseOffset,
+        tolerance,
+        compensateLatencies
+):
+    logging.info("synchronize_synthetic_cameras.main()")
+
+    # The skews are the spreads of the exposure times of the frames of a set. The grab timestamps also include the
+    # camera latencies and the jitter
+
+    # Sequential grabber: the frames of a set are paired by grab order
+    cameras = [ExposureTimeCamera(SyntheticCamera(fps=fps, latency=latency, jitter_std=jitterStd, phase=camera_ndx * phaseOffset, seed=camera_ndx))
+               for camera_ndx, latency in enumerate(latencies)]
+    grabber = Grabber([(camera, camera_ndx) for camera_ndx, camera in enumerate(cameras)])
+    sequential_skews = []
+    start_time = time.monotonic()
+    while time.monotonic() < start_time + duration:
+        exposure_times = grabber.Grab()
+        sequential_skews.append(max(exposure_times) - min(exposure_times))
+    sequential_fps = len(sequential_skews) / duration
+    logging.info(f"Sequential grabber: {sequential_fps:.1f} sets/s, exposure skew {SkewSummary(sequential_skews)}")
+
+    # Threaded grabber and timestamp synchronization
+    cameras = [ExposureTimeCamera(SyntheticCamera(fps=fps, latency=latency, jitter_std=jitterStd, phase=camera_ndx * phaseOffset, seed=camera_ndx))
+               for camera_ndx, latency in enumerate(latencies)]
+    threaded_grabber = ThreadedGrabber([(camera, camera_ndx) for camera_ndx, camera in enumerate(cameras)], buffer_size=8)
+    timestamp_offsets = latencies if compensateLatencies else None
+    synchronizer = FrameSynchronizer(len(cameras), tolerance=tolerance, timestamp_offsets=timestamp_offsets)
+    synchronized_skews = []
+    with threaded_grabber:
+        start_time = time.monotonic()
+        while time.monotonic() < start_time + duration:
+            synchronizer.PushFrames(threaded_grabber.PopBufferedFrames())
+            for timestamps, exposure_times in synchronizer.PopAll():
+                synchronized_skews.append(max(exposure_times) - min(exposure_times))
+            time.sleep(0.002)
+    statistics = synchronizer.Statistics()
+    logging.info(f"Synchronized grabber: {statistics['matched'] / duration:.1f} sets/s, "
+                 f"exposure skew {SkewSummary(synchronized_skews) if len(synchronized_skews) > 0 else 'None'}")
+    logging.info(f"Synchronizer statistics (skews of the grab timestamps, minus the timestamp offsets): {statistics}")
+    logging.info(f"Threaded grabber statistics: {threaded_grabber.Statistics()}")
+    if statistics['matched'] < 0.5 * fps * duration:
+        logging.warning(f"Less than half of the frames were synchronized. The latency difference {max(latencies) - min(latencies):.3f} s "
+                        f"must be compensated, or be within the tolerance ({tolerance} s)")
+
+class ExposureTimeCamera():
+    # Wraps a SyntheticCamera, and delivers the exposure time of the frame instead of the image
+    def __init__(self, synthetic_camera):
+        self.synthetic_camera = synthetic_camera
+
+    def grab(self):
+        return self.synthetic_camera.grab()
+
+    def retrieve(self, image=None, flag=0):
+        return True, self.synthetic_camera.last_exposure_time
+
+def SkewSummary(skews):
+    skews_arr = np.array(skews)
+    return f"mean = {np.mean(skews_arr):.4f}, median = {np.median(skews_arr):.4f}, p95 = {np.percentile(skews_arr, 95):.4f}, max = {np.max(skews_arr):.4f}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', help="The duration of each run, in seconds. Default: 3.0", type=float, default=3.0)
+    parser.add_argument('--fps', help="The synthetic cameras frame rate. Default: 30.0", type=float, default=30.0)
+    parser.add_argument('--jitterStd', help="The standard deviation of the frame delivery jitter, in seconds. Default: 0.004", type=float, default=0.004)
+    parser.add_argument('--latencies', help="The list of camera latencies, in seconds. Default: '[0.010, 0.025]'", default='[0.010, 0.025]')
+    parser.add_argument('--phaseOffset', help="The exposure phase offset between consecutive cameras, in seconds. Default: 0.003", type=float, default=0.003)
+    parser.add_argument('--tolerance', help="The synchronization tolerance, in seconds. Default: 0.010", type=float, default=0.010)
+    parser.add_argument('--ignoreLatencies', help="Do not pass the known camera latencies to the synchronizer as timestamp offsets. With the default latencies, most of the frames are then dropped", action='store_true')
+    args = parser.parse_args()
+    latencies = ast.literal_eval(args.latencies)
+    main(
+        args.duration,
+        args.fps,
+        args.jitterStd,
+        latencies,
+        args.phaseOffset,
+        args.tolerance,
+        not args.ignoreLatencies
+    )
@@ -6,6 +6,10 @@ import os
 import numpy as np
 import red_square
 import copy
+import concurrent.futures
+from stereo_vision import instrumentation
+import stereo_vision.raw_sequence as raw_sequence
+import stereo_vision.sequence_index as seq_index
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
 
@@ -16,93 +20,214 @@ def main(
         redSquareDetectorBlueDelta,
         redSquareDetectorBlueDilationSize,
         redSquareDetectorRedDelta,
-        redSquareDetectorRedDilationSize
+        redSquareDetectorRedDilationSize,
+        redSquareDetectorFastMode,
+        redSquareDetectorCoarseToFineFactor,
+        redSquareDetectorTracking,
+        numberOfWorkers,
+        segmentLength,
+        skipMosaics,
+        multiTarget,
+        trackerMaximumDistance,
+        metricsDirectory,
+        traceEvents,
+        indexManifestFilepath,
+        rebuildIndex
 ):
     logging.info("track_red_square.main()")
 
     if not os.path.exists(outputDirectory):
         os.makedirs(outputDirectory)
+    if metricsDirectory is not None:
+        instrumentation.Enable(trace=traceEvents)
 
-    timestamp_to_imageFilepathsList = TimestampToImageFilepathsList(cameraIDList, inputImagesFilepathPrefix)
-    #logging.debug(f"timestamp_to_imageFilepathsList = {timestamp_to_imageFilepathsList}")
+    # An image source is either an image filepath, or a (camera index, frame index) of a raw sequence
+    sequence_reader = None
+    sequence_directory = None
+    if raw_sequence.IsRawSequence(inputImagesFilepathPrefix):
+        sequence_directory = inputImagesFilepathPrefix
+        sequence_reader = raw_sequence.RawSequenceReader(sequence_directory)
+        camera_ndxs = [sequence_reader.CameraIndex('camera_' + str(camera_ID)) for camera_ID in cameraIDList]
+        timestamp_to_imageSourcesList = {sequence_reader.TimestampLabel(frame_ndx): [(camera_ndx, frame_ndx) for camera_ndx in camera_ndxs]
+                                         for frame_ndx in range(len(sequence_reader))}
+    else:
+        with instrumentation.Timer('TimestampToImageFilepathsList'):
+            timestamp_to_imageSourcesList = TimestampToImageFilepathsList(cameraIDList, inputImagesFilepathPrefix, indexManifestFilepath, rebuildIndex)
+    #logging.debug(f"timestamp_to_imageSourcesList = {timestamp_to_imageSourcesList}")
+    timestamps = list(timestamp_to_imageSourcesList.keys())
+    timestamps.sort()
 
-    red_square_detector = red_square.Detector(
-        blue_delta=redSquareDetectorBlueDelta,
-        blue_mask_dilation_kernel_size=redSquareDetectorBlueDilationSize,
-        red_delta=redSquareDetectorRedDelta,
-        red_mask_dilation_kernel_size=redSquareDetectorRedDilationSize,
-        debug_directory=None
-    )
+    detector_parameters = {
+        'blue_delta': redSquareDetectorBlueDelta,
+        'blue_mask_dilation_kernel_size': redSquareDetectorBlueDilationSize,
+        'red_delta': redSquareDetectorRedDelta,
+        'red_mask_dilation_kernel_size': redSquareDetectorRedDilationSize,
+        'debug_directory': None,
+        'fast_mode': redSquareDetectorFastMode,
+        'coarse_to_fine_factor': redSquareDetectorCoarseToFineFactor
+    }
 
+    # The sequence is cut in segments of consecutive timestamps. Each (segment, camera) is a task for a worker process,
+    # that decodes the images and runs the detector, in tracking mode if requested. The results come back in task order,
+    # so the output does not depend on the number of workers. In tracking mode, it depends on segmentLength: each segment
+    # starts with a full-frame detection, while within a segment the window search keeps the largest blob near the last
+    # detection, which can differ from the largest blob of the frame, e.g. with a distractor.
+    tasks = []
+    for segment_start in range(0, len(timestamps), segmentLength):
+        segment_timestamps = timestamps[segment_start: segment_start + segmentLength]
+        for camera_ndx in range(len(cameraIDList)):
+            tasks.append(([timestamp_to_imageSourcesList[timestamp][camera_ndx] for timestamp in segment_timestamps],
+                          redSquareDetectorTracking, multiTarget))
+
+    if numberOfWorkers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=numberOfWorkers, initializer=InitializeWorker,
+                                                          initargs=(detector_parameters, sequence_directory,
+                                                                    (instrumentation.is_enabled, instrumentation.is_tracing)))
+        segment_camera_centers_iterator = executor.map(DetectInSegment, tasks)
+    else:
+        executor = None
+        InitializeWorker(detector_parameters, sequence_directory)
+        segment_camera_centers_iterator = map(DetectInSegment, tasks)
+
+    # The mosaics are rendered by threads, while the detection goes on
+    mosaic_executor = None
+    mosaic_futures = []
+    if not skipMosaics:
+        mosaic_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+    camera_tracking_statistics = [{} for camera_ID in cameraIDList]
+    # In multi-target mode, the blobs of each camera get their IDs from a tracker that sees the whole sequence, and the
+    # coordinates file has one row per detected blob: timestamp, camera, target_id, x, y
+    target_trackers = [red_square.MultiTargetTracker(maximum_distance=trackerMaximumDistance) for camera_ID in cameraIDList]
     with open(os.path.join(outputDirectory, "red_square_coordinates.csv"), 'w') as coords_file:
-        header = "timestamp"
-        for camera_ID_ndx in range(1, len(cameraIDList) + 1):
-            header += f",x_{str(camera_ID_ndx)},y_{str(camera_ID_ndx)}"
-        header += "\n"
-        coords_file.write(header)
-        timestamps = list(timestamp_to_imageFilepathsList.keys())
-        #logging.debug(f"timestamps = {timestamps}")
-        timestamps.sort()
-        #for timestamp, image_filepaths_list in timestamp_to_imageFilepathsList.items():
-        for timestamp in timestamps:
-            image_filepaths_list = timestamp_to_imageFilepathsList[timestamp]
-            coords_file.write(timestamp)
-            images = []
-            for image_filepath in image_filepaths_list:
-                image = cv2.imread(image_filepath)
-                images.append(image)
-            img_shapeHWC = images[0].shape
-            mosaic_img = np.zeros((img_shapeHWC[0], len(images) * img_shapeHWC[1], img_shapeHWC[2]), dtype=np.uint8)
-            for image_ndx in range(len(images)):
-                image = images[image_ndx]
-                annotated_img = copy.deepcopy(image)
-                center = red_square_detector.Detect(image)
-                center_rounded = (round(center[0]), round(center[1]))
-                cv2.line(annotated_img, (center_rounded[0] - 5, center_rounded[1]), (center_rounded[0] + 5, center_rounded[1]), (255, 0, 0),
-                         thickness=3)
-                cv2.line(annotated_img, (center_rounded[0], center_rounded[1] - 5),
-                         (center_rounded[0], center_rounded[1] + 5), (255, 0, 0),
-                         thickness=3)
-                mosaic_img[:, image_ndx * img_shapeHWC[1]: (image_ndx + 1) * img_shapeHWC[1], :] = annotated_img
-                #camera_ID = camera_ID[image_ndx]
-                coords_file.write(f",{center[0]},{center[1]}")
-            coords_file.write("\n")
-            mosaic_img_filepath = os.path.join(outputDirectory, 'stereo_' + timestamp + '.png')
-            cv2.imwrite(mosaic_img_filepath, mosaic_img)
-
-def TimestampToImageFilepathsList(camera_ID_list, images_filepath_prefix):
-    extensions = ['.PNG']
-    images_directory = os.path.dirname(images_filepath_prefix)
-    timestamp_to_imageFilepathsList = {}
-    filepaths_in_directory = [os.path.join(images_directory, f) for f in os.listdir(images_directory) \
-                              if os.path.isfile(os.path.join(images_directory, f))]
-
-    image_filepaths = [filepath for filepath in filepaths_in_directory \
-                       if filepath.upper()[-4:] in extensions]
-
-    first_camera_image_filepaths = [filepath for filepath in image_filepaths \
-                                    if filepath.startswith(images_filepath_prefix + str(camera_ID_list[0]) + '_')]
-    first_camera_ID = camera_ID_list[0]
-    first_camera_prefix = images_filepath_prefix + str(first_camera_ID) + '_'
-    #print(f"first_camera_image_filepaths = {first_camera_image_filepaths}")
-    #print(f"len(first_camera_image_filepaths) = {len(first_camera_image_filepaths)}")
-    for filepath in first_camera_image_filepaths:
-        timestamp = filepath[len(first_camera_prefix): -4]
-        #logging.debug(f"timestamp = {timestamp}")
-        image_filepaths_list = [filepath]
-        for other_camera_ID_ndx in range(1, len(camera_ID_list)):
-            other_camera_ID = camera_ID_list[other_camera_ID_ndx]
-            other_camera_filepath = images_filepath_prefix + str(other_camera_ID) + '_' + timestamp + '.png'
-            #logging.debug(f"other_camera_filepath = {other_camera_filepath}")
-            if not os.path.exists(other_camera_filepath):
-                raise FileNotFoundError(f"TimestampToImageFilepathsList(): Could not find file '{other_camera_filepath}'")
-            image_filepaths_list.append(other_camera_filepath)
-        timestamp_to_imageFilepathsList[timestamp] = image_filepaths_list
-    return timestamp_to_imageFilepathsList
+        if multiTarget:
+            coords_file.write("timestamp,camera,target_id,x,y\n")
+        else:
+            header = "timestamp"
+            for camera_ID_ndx in range(1, len(cameraIDList) + 1):
+                header += f",x_{str(camera_ID_ndx)},y_{str(camera_ID_ndx)}"
+            header += "\n"
+            coords_file.write(header)
+        for segment_start in range(0, len(timestamps), segmentLength):
+            segment_timestamps = timestamps[segment_start: segment_start + segmentLength]
+            camera_centers_list = []
+            for camera_ndx in range(len(cameraIDList)):
+                with instrumentation.Timer('track_red_square.wait_for_detections'):
+                    camera_centers, tracking_statistics, worker_metrics = next(segment_camera_centers_iterator)
+                if worker_metrics is not None:
+                    instrumentation.Merge(worker_metrics)
+                camera_centers_list.append(camera_centers)
+                for key, value in tracking_statistics.items():
+                    camera_tracking_statistics[camera_ndx][key] = camera_tracking_statistics[camera_ndx].get(key, 0) + value
+            instrumentation.Increment('track_red_square.frames', len(segment_timestamps))
+            for timestamp_ndx in range(len(segment_timestamps)):
+                timestamp = segment_timestamps[timestamp_ndx]
+                centers = [camera_centers[timestamp_ndx] for camera_centers in camera_centers_list]
+                if multiTarget:
+                    for camera_ndx in range(len(cameraIDList)):
+                        WriteTargetCoordinates(coords_file, timestamp, camera_ndx + 1, target_trackers[camera_ndx].Update(centers[camera_ndx]),
+                                               centers[camera_ndx])
+                else:
+                    coords_file.write(timestamp)
+                    for center in centers:
+                        coords_file.write(f",{center[0]},{center[1]}")
+                    coords_file.write("\n")
+                if mosaic_executor is not None:
+                    mosaic_img_filepath = os.path.join(outputDirectory, 'stereo_' + timestamp + '.png')
+                    mosaic_futures.append(mosaic_executor.submit(WriteMosaic, timestamp_to_imageSourcesList[timestamp],
+                                                                 centers, sequence_reader, mosaic_img_filepath))
+            # Bound the number of pending mosaics
+            with instrumentation.Timer('track_red_square.wait_for_mosaics'):
+                while len(mosaic_futures) > 4 * segmentLength:
+                    mosaic_futures.pop(0).result()
+    for mosaic_future in mosaic_futures:
+        mosaic_future.result()
+    if mosaic_executor is not None:
+        mosaic_executor.shutdown()
+    if executor is not None:
+        executor.shutdown()
+    if redSquareDetectorTracking:
+        for camera_ID, tracking_statistics in zip(cameraIDList, camera_tracking_statistics):
+            logging.info(f"Camera {camera_ID} tracking statistics: {tracking_statistics}")
+    if metricsDirectory is not None:
+        instrumentation.SaveReports(metricsDirectory)
+        logging.info(f"The metrics were written to '{metricsDirectory}'")
+
+worker_state = {}
+
+def InitializeWorker(detector_parameters, sequence_directory, instrumentation_settings=None):
+    # instrumentation_settings: (is_enabled, is_tracing) of the main process, for a worker process. A forked worker
+    # starts with a copy of the main process metrics, that would be counted twice
+    if instrumentation_settings is not None:
+        instrumentation.Reset()
+        if instrumentation_settings[0]:
+            instrumentation.Enable(trace=instrumentation_settings[1])
+    worker_state['detector'] = red_square.Detector(**detector_parameters)
+    worker_state['sequence_reader'] = None
+    if sequence_directory is not None:
+        worker_state['sequence_reader'] = raw_sequence.RawSequenceReader(sequence_directory)
+
+def DetectInSegment(task):
+    # Returns the centers of the segment images, or the (N, 2) centroids of all the blobs in multi-target mode, the
+    # tracking statistics, and the metrics collected by the worker if the instrumentation is enabled
+    image_sources, use_tracking, multi_target = task
+    detector = worker_state['detector']
+    # The segments are independent, so the tracking starts over with a full-frame detection
+    detector.ResetTracking()
+    centers = []
+    for image_source in image_sources:
+        image = LoadImage(image_source, worker_state['sequence_reader'])
+        if multi_target:
+            centers.append(detector.DetectAll(image)[1])
+        elif use_tracking:
+            centers.append(detector.Track(image))
+        else:
+            centers.append(detector.Detect(image))
+    return centers, detector.TrackingStatistics(), instrumentation.Collect() if instrumentation.is_enabled else None
+
+@instrumentation.Timed()
+def LoadImage(image_source, sequence_reader):
+    if sequence_reader is not None:
+        camera_ndx, frame_ndx = image_source
+        return sequence_reader.Frame(camera_ndx, frame_ndx)
+    return cv2.imread(image_source)
+
+@instrumentation.Timed()
+def WriteMosaic(image_sources, centers, sequence_reader, mosaic_img_filepath):
+    images = [LoadImage(image_source, sequence_reader) for image_source in image_sources]
+    img_shapeHWC = images[0].shape
+    mosaic_img = np.zeros((img_shapeHWC[0], len(images) * img_shapeHWC[1], img_shapeHWC[2]), dtype=np.uint8)
+    for image_ndx in range(len(images)):
+        annotated_img = copy.deepcopy(images[image_ndx])
+        # A center (x, y), or an (N, 2) array of centers in multi-target mode
+        for center in np.reshape(centers[image_ndx], (-1, 2)):
+            center_rounded = (round(center[0]), round(center[1]))
+            cv2.line(annotated_img, (center_rounded[0] - 5, center_rounded[1]), (center_rounded[0] + 5, center_rounded[1]), (255, 0, 0),
+                     thickness=3)
+            cv2.line(annotated_img, (center_rounded[0], center_rounded[1] - 5),
+                     (center_rounded[0], center_rounded[1] + 5), (255, 0, 0),
+                     thickness=3)
+        mosaic_img[:, image_ndx * img_shapeHWC[1]: (image_ndx + 1) * img_shapeHWC[1], :] = annotated_img
+    cv2.imwrite(mosaic_img_filepath, mosaic_img)
+
+def WriteTargetCoordinates(coords_file, timestamp, camera, target_ids, centroids):
+    # One row per target. The target IDs are per camera: the same ID in two cameras is not the same physical target
+    for target_id, centroid in zip(target_ids.tolist(), centroids.tolist()):
+        coords_file.write(f"{timestamp},{camera},{target_id},{centroid[0]},{centroid[1]}\n")
+
+def TimestampToImageFilepathsList(camera_ID_list, images_filepath_prefix, manifest_filepath=None, rebuild=False):
+    sequence_index = seq_index.LoadOrBuildSequenceIndex(images_filepath_prefix, camera_ID_list, manifest_filepath, rebuild=rebuild)
+    missing_frames = sequence_index.MissingFrames()
+    if len(missing_frames) > 0:
+        # Only the first orphan frames are listed, so that a sequence with thousands of them does not flood the log
+        orphan_filepaths = sequence_index.OrphanFilepaths()
+        logging.warning(f"TimestampToImageFilepathsList(): {len(missing_frames)} timestamps have missing frames. They are skipped. "
+                        f"{len(orphan_filepaths)} orphan frames, the first ones: {orphan_filepaths[0: 5]}")
+    return sequence_index.TimestampToFilepaths()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('inputImagesFilepathPrefix', help="The filepath prefix of the input images")
+    parser.add_argument('inputImagesFilepathPrefix', help="The filepath prefix of the input images, or the directory of a raw sequence")
     parser.add_argument('--outputDirectory', help="The output directory. Defaut: './output_track_red_square'",
                         default='./output_track_red_square')
     parser.add_argument('--cameraIDList', help="The list of camera ID. Default: '[1, 2]'", default='[1, 2]')
@@ -110,6 +235,18 @@ if __name__ == '__main__':
     parser.add_argument('--redSquareDetectorBlueDilationSize', help="For the red square detector, the blue dilation size. Default: 45", type=int, default=45)
     parser.add_argument('--redSquareDetectorRedDelta', help="For the red square detector, the red delta. Default: 70", type=int, default=70)
     parser.add_argument('--redSquareDetectorRedDilationSize', help="For the red square detector, the red dilation size. Default: 13", type=int, default=13)
+    parser.add_argument('--redSquareDetectorFastMode', help="For the red square detector, compute the masks with the uint8 fast path", action='store_true')
+    parser.add_argument('--redSquareDetectorCoarseToFineFactor', help="For the red square detector, the downsampling factor of a coarse detection, refined at full resolution around the coarse blob. 1 detects at full resolution. Default: 1", type=int, default=1)
+    parser.add_argument('--redSquareDetectorTracking', help="For the red square detector, search in a window around the last detection. The tracking restarts with a full-frame detection at the start of each segment, so the results depend on --segmentLength", action='store_true')
+    parser.add_argument('--numberOfWorkers', help="The number of detection processes. Default: 1", type=int, default=1)
+    parser.add_argument('--segmentLength', help="The number of consecutive timestamps per detection task. With --redSquareDetectorTracking, the tracking state is reset at each segment start. Default: 32", type=int, default=32)
+    parser.add_argument('--skipMosaics', help="Do not write the annotated mosaic images", action='store_true')
+    parser.add_argument('--multiTarget', help="Detect all the blobs, and give them stable IDs per camera. The coordinates file gets one row per timestamp, camera and target: timestamp,camera,target_id,x,y. solve_tracked_coords.py pairs the targets of the two cameras, and solves one trajectory per pair", action='store_true')
+    parser.add_argument('--trackerMaximumDistance', help="In multi-target mode, the maximum distance, in pixels, between a target predicted position and its next detection. Default: 50", type=float, default=50)
+    parser.add_argument('--metricsDirectory', help="If specified, the stage timings and counters are collected, and written to this directory as metrics.json and metrics.prom (cf. stereo_vision.instrumentation). Default: None", default=None)
+    parser.add_argument('--traceEvents', help="With --metricsDirectory, also write the timeline of the timed stages as a Chrome trace, trace.json", action='store_true')
+    parser.add_argument('--indexManifestFilepath', help="The json manifest of the image sequence index, e.g. when the images directory is read-only. Default: None, i.e. '<inputImagesFilepathPrefix>manifest.json'", default=None)
+    parser.add_argument('--rebuildIndex', help="Index the images directory even if the manifest is up to date, and rewrite the manifest", action='store_true')
     args = parser.parse_args()
     cameraIDList = ast.literal_eval(args.cameraIDList)
     main(
@@ -119,5 +256,17 @@ if __name__ == '__main__':
         args.redSquareDetectorBlueDelta,
         args.redSquareDetectorBlueDilationSize,
         args.redSquareDetectorRedDelta,
-        args.redSquareDetectorRedDilationSize
+        args.redSquareDetectorRedDilationSize,
+        args.redSquareDetectorFastMode,
+        args.redSquareDetectorCoarseToFineFactor,
+        args.redSquareDetectorTracking,
+        args.numberOfWorkers,
+        args.segmentLength,
+        args.skipMosaics,
+        args.multiTarget,
+        args.trackerMaximumDistance,
+        args.metricsDirectory,
+        args.traceEvents,
+        args.indexManifestFilepath,
+        args.rebuildIndex
     )
\ No newline at end of file
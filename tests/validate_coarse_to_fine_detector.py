@@ -0,0 +1,65 @@
+import logging
+import argparse
+import ast
+import time
+import numpy as np
+import red_square
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        imageSizesHW,
+        coarseToFineFactors,
+        numberOfImages,
+        fastMode
+):
+    logging.info("validate_coarse_to_fine_detector.main()")
+
+    rng = np.random.default_rng(0)
+    for imageSizeHW in imageSizesHW:
+        # Random sub-pixel centers, far enough from the borders for the blue square to fit
+        centers = [(rng.uniform(100, imageSizeHW[1] - 100), rng.uniform(100, imageSizeHW[0] - 100)) for image_ndx in range(numberOfImages)]
+        images = [red_square.SyntheticImage(imageSizeHW, center, seed=image_ndx) for image_ndx, center in enumerate(centers)]
+        detector = red_square.Detector(fast_mode=fastMode)
+        full_resolution_centers_arr, full_resolution_duration = DetectAll(detector, images)
+        full_resolution_errors = np.linalg.norm(full_resolution_centers_arr - np.array(centers), axis=1)
+        logging.info(f"Image size {imageSizeHW}: full resolution {1000 * full_resolution_duration:.2f} ms/image, "
+                     f"error to the true center: mean {np.mean(full_resolution_errors):.4f} px, max {np.max(full_resolution_errors):.4f} px")
+        for coarseToFineFactor in coarseToFineFactors:
+            coarse_to_fine_detector = red_square.Detector(fast_mode=fastMode, coarse_to_fine_factor=coarseToFineFactor)
+            centers_arr, duration = DetectAll(coarse_to_fine_detector, images)
+            is_found = np.all(centers_arr != -1, axis=1)
+            differences = np.linalg.norm(centers_arr[is_found] - full_resolution_centers_arr[is_found], axis=1)
+            errors = np.linalg.norm(centers_arr[is_found] - np.array(centers)[is_found], axis=1)
+            logging.info(f"    coarse-to-fine factor {coarseToFineFactor}: {1000 * duration:.2f} ms/image, speedup x{full_resolution_duration / duration:.1f}, "
+                         f"{np.count_nonzero(is_found)}/{len(images)} found, "
+                         f"difference with the full resolution center: max {np.max(differences, initial=0):.2e} px, "
+                         f"error to the true center: mean {np.mean(errors):.4f} px, max {np.max(errors, initial=0):.4f} px")
+
+def DetectAll(detector, images):
+    # Returns the (N, 2) centers, and the median duration of a detection
+    detector.Detect(images[0])  # Warm up
+    centers = []
+    durations = []
+    for image in images:
+        start_time = time.perf_counter()
+        centers.append(detector.Detect(image))
+        durations.append(time.perf_counter() - start_time)
+    return np.array(centers, dtype=float), float(np.median(durations))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--imageSizesHW', help="The list of synthetic image sizes (Height, Width). Default: '[(1080, 1920), (2160, 3840)]'", default='[(1080, 1920), (2160, 3840)]')
+    parser.add_argument('--coarseToFineFactors', help="The list of downsampling factors of the coarse detection. Default: '[2, 4]'", default='[2, 4]')
+    parser.add_argument('--numberOfImages', help="The number of synthetic images per size. Default: 20", type=int, default=20)
+    parser.add_argument('--fastMode', help="Compute the masks with the uint8 fast path", action='store_true')
+    args = parser.parse_args()
+    imageSizesHW = ast.literal_eval(args.imageSizesHW)
+    coarseToFineFactors = ast.literal_eval(args.coarseToFineFactors)
+    main(
+        imageSizesHW,
+        coarseToFineFactors,
+        args.numberOfImages,
+        args.fastMode
+    )
@@ -0,0 +1,59 @@
+import logging
+import argparse
+import ast
+import numpy as np
+from stereo_vision.projection import ProjectionMatrix
+from stereo_vision.synthetic_camera import SyntheticProjectionMatrix, SyntheticCorrespondences
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(levelname)s \t%(message)s')
+
+def main(
+        numberOfCorrespondences,
+        outlierRatios,
+        noiseStd,
+        maximumNumberOfIterations
+):
+    logging.info("validate_robust_calibration.main()")
+
+    true_projection_matrix = SyntheticProjectionMatrix()
+    rng = np.random.default_rng(0)
+    for outlier_ratio in outlierRatios:
+        xy_XYZ_tuples = SyntheticCorrespondences(true_projection_matrix, numberOfCorrespondences, noiseStd, rng)
+        # The outliers get random pixel coordinates
+        number_of_outliers = round(outlier_ratio * numberOfCorrespondences)
+        outlier_ndxs = rng.choice(numberOfCorrespondences, number_of_outliers, replace=False)
+        for outlier_ndx in outlier_ndxs:
+            xy_XYZ_tuples[outlier_ndx] = ((rng.uniform(0, 640), rng.uniform(0, 480)), xy_XYZ_tuples[outlier_ndx][1])
+        is_inlier = np.ones(numberOfCorrespondences, dtype=bool)
+        is_inlier[outlier_ndxs] = False
+        projection_matrix = ProjectionMatrix()
+        try:
+            statistics = projection_matrix.CreateRobust(xy_XYZ_tuples, maximum_number_of_iterations=maximumNumberOfIterations, seed=0)
+        except ValueError as error:
+            logging.info(f"Outlier ratio {outlier_ratio}: {error}")
+            continue
+        message = f"Outlier ratio {outlier_ratio}: {statistics['number_of_inliers']} inliers found out of {np.count_nonzero(is_inlier)}, " \
+                  f"{statistics['number_of_iterations']} iterations"
+        if np.any(is_inlier):
+            # A wrong fit can put the points behind the camera, where the projection is NaN
+            XYZ_arr = np.array([XYZ for xy, XYZ in xy_XYZ_tuples])[is_inlier]
+            true_xy_arr = true_projection_matrix.ProjectPoints(XYZ_arr)[0]
+            errors = np.nan_to_num(np.linalg.norm(projection_matrix.ProjectPoints(XYZ_arr)[0] - true_xy_arr, axis=1), nan=np.inf)
+            message += f", error to the true projection of the inliers: median {np.median(errors):.4f} px, max {np.max(errors):.4f} px"
+        logging.info(message)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--numberOfCorrespondences', help="The number of synthetic correspondences. Default: 5000", type=int, default=5000)
+    parser.add_argument('--outlierRatios', help="The list of fractions of correspondences replaced by random pixels. Default: '[0.0, 0.5, 0.9, 0.99, 1.0]'", default='[0.0, 0.5, 0.9, 0.99, 1.0]')
+    parser.add_argument('--noiseStd', help="The standard deviation of the pixel noise of the inliers. Default: 0.5", type=float, default=0.5)
+    parser.add_argument('--maximumNumberOfIterations', help="The maximum number of RANSAC hypotheses. Default: 200", type=int, default=200)
+    args = parser.parse_args()
+    outlierRatios = ast.literal_eval(args.outlierRatios)
+    main(
+        args.numberOfCorrespondences,
+        outlierRatios,
+        args.noiseStd,
+        args.maximumNumberOfIterations
+    )